@@ -0,0 +1,97 @@
+import time
+
+class AdaptivePredicate:
+    # AND/OR of compiled predicates that reorders its children during a scan
+    # from time to time a few rows are sampled: every child is evaluated (no short-circuit)
+    # and timed, so pass rates and costs aren't biased by the current order. After the
+    # sample the children are sorted by the expected cost to decide the result:
+    #   AND: cost / (1 - pass rate), cheap children that usually fail first
+    #   OR:  cost / pass rate, cheap children that usually pass first
+    # every other row is evaluated with short-circuit in the current order
+
+    # avoids division by zero for children that always (or never) pass
+    _min_rate = 1e-6
+
+    def __init__(self, predicates, logical_operator, sample_rows=32, reorder_interval=2048):
+        if logical_operator not in ('AND', 'OR'):
+            raise ValueError("Logical operator '{0}' is not supported".format(logical_operator))
+
+        self._is_and = logical_operator == 'AND'
+        self._sample_rows = sample_rows
+        self._reorder_interval = reorder_interval
+
+        # [predicate, passed rows, total cost] for each child, in evaluation order
+        self._children = [[predicate, 0, 0.0] for predicate in predicates]
+        self._predicates = tuple(predicates)
+        self._sampled_rows = 0
+
+        self._rows_to_sample = sample_rows
+        self._rows_until_sample = 0
+
+    def __call__(self, table_record):
+        if self._rows_to_sample:
+            return self._sample(table_record)
+
+        self._rows_until_sample -= 1
+        if self._rows_until_sample <= 0:
+            self._rows_to_sample = self._sample_rows
+
+        if self._is_and:
+            for predicate in self._predicates:
+                if not predicate(table_record):
+                    return False
+            return True
+
+        for predicate in self._predicates:
+            if predicate(table_record):
+                return True
+        return False
+
+    def _sample(self, table_record):
+        result = self._is_and
+
+        for child in self._children:
+            start = time.perf_counter()
+            passed = child[0](table_record)
+            child[2] += time.perf_counter() - start
+
+            if passed:
+                child[1] += 1
+                if not self._is_and:
+                    result = True
+            elif self._is_and:
+                result = False
+
+        self._sampled_rows += 1
+        self._rows_to_sample -= 1
+
+        if not self._rows_to_sample:
+            self._reorder()
+            self._rows_until_sample = self._reorder_interval
+
+        return result
+
+    def _rank(self, child):
+        pass_rate = child[1] / self._sampled_rows
+        decisive_rate = 1 - pass_rate if self._is_and else pass_rate
+        return (child[2] / self._sampled_rows) / max(decisive_rate, self._min_rate)
+
+    def _reorder(self):
+        self._children.sort(key=self._rank)
+        self._predicates = tuple(child[0] for child in self._children)
+
+        # older observations weigh less, so the order follows changes in the data
+        for child in self._children:
+            child[1] /= 2
+            child[2] /= 2
+        self._sampled_rows /= 2
+
+    # current evaluation order with the observed pass rate and mean cost (in seconds) of each child
+    def get_stats(self):
+        if not self._sampled_rows:
+            return [{'pass_rate': None, 'cost': None} for _ in self._children]
+
+        return [
+            {'pass_rate': passed / self._sampled_rows, 'cost': cost / self._sampled_rows}
+            for _, passed, cost in self._children
+        ]
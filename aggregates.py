@@ -0,0 +1,105 @@
+# aggregates folded over the matching rows during the scan, see QueryFilter.aggregate
+# an aggregate is given as name -> (function, field), field is None only for count, that
+# then counts rows. None values are skipped, as in SQL: sum of no values is 0 and min, max
+# and avg of no values are None
+
+aggregate_functions = ('count', 'sum', 'min', 'max', 'avg')
+
+# cerberus types that sum and avg accept
+numeric_types = ('integer', 'float', 'number', 'decimal', 'boolean')
+
+# returns a list of (name, function, field)
+def compile_aggregates(aggregates, table_column_types, group_by=None):
+    if not aggregates:
+        raise ValueError("At least one aggregate is required")
+
+    if group_by is not None and group_by not in table_column_types:
+        raise ValueError("Column '{0}' is not in table".format(group_by))
+
+    specs = []
+    for name, (function, field) in aggregates.items():
+        if function not in aggregate_functions:
+            raise ValueError("Aggregate '{0}' is not supported".format(function))
+
+        if field is None:
+            if function != 'count':
+                raise ValueError("Aggregate '{0}' requires a field".format(function))
+        elif field not in table_column_types:
+            raise ValueError("Column '{0}' is not in table".format(field))
+        elif function in ('sum', 'avg') and table_column_types[field]['type'] not in numeric_types:
+            raise ValueError("Aggregate '{0}' requires a numeric column, '{1}' is {2}".format(function, field, table_column_types[field]['type']))
+
+        specs.append((name, function, field))
+    return specs
+
+# the state of an aggregate is [number of values, value]
+def _new_state(function):
+    return [0, 0 if function in ('sum', 'avg') else None]
+
+def _fold_count(state, value):
+    state[0] += 1
+
+def _fold_sum(state, value):
+    state[0] += 1
+    state[1] += value
+
+def _fold_min(state, value):
+    if state[0] == 0 or value < state[1]:
+        state[1] = value
+    state[0] += 1
+
+def _fold_max(state, value):
+    if state[0] == 0 or value > state[1]:
+        state[1] = value
+    state[0] += 1
+
+_folds = {
+    'count': _fold_count,
+    'sum':   _fold_sum,
+    'min':   _fold_min,
+    'max':   _fold_max,
+    'avg':   _fold_sum,
+}
+
+def _finish(function, state):
+    count, value = state
+    if function == 'count':
+        return count
+    if function == 'avg':
+        return value / count if count else None
+    return value
+
+def finish_aggregates(specs, states):
+    return {name: _finish(function, state) for (name, function, _), state in zip(specs, states)}
+
+# folds rows into one list of states per group (None is the only group without group_key)
+# keys are the keys used to read the field of each aggregate from a row, None counts rows
+def fold_rows(rows, specs, keys, group_key=None):
+    folds = [(_folds[function], key) for (_, function, _), key in zip(specs, keys)]
+    groups = {}
+
+    for table_record in rows:
+        group = table_record[group_key] if group_key is not None else None
+
+        states = groups.get(group)
+        if states is None:
+            states = groups[group] = [_new_state(function) for _, function, _ in specs]
+
+        for state, (fold, key) in zip(states, folds):
+            if key is None:
+                state[0] += 1
+                continue
+
+            value = table_record[key]
+            if value is not None:
+                fold(state, value)
+
+    return groups
+
+# result of aggregate: {name: value}, or {group value: {name: value}} when rows are grouped
+def build_result(specs, groups, grouped):
+    if grouped:
+        return {group: finish_aggregates(specs, states) for group, states in groups.items()}
+
+    states = groups.get(None, [_new_state(function) for _, function, _ in specs])
+    return finish_aggregates(specs, states)
@@ -0,0 +1,106 @@
+from query_filter import QueryFilter
+from columnar_query_filter import ColumnarTable, ColumnarQueryFilter, np
+
+class SharedLeaves:
+    # compiled relational queries shared by all queries of a batch
+    # identical leaves (same field, operator and values) are compiled once, and the shared
+    # predicate remembers the result for the last row, so other queries asking the same
+    # leaf for the same row don't evaluate it again
+    def __init__(self):
+        self._predicates = {}
+        self.compiled_leaves = 0
+        self.shared_leaves = 0
+
+    def compile_leaf(self, query_filter, query):
+        key = (type(query_filter), query["field"], query["operator"], tuple(query["value"]))
+
+        if key in self._predicates:
+            self.shared_leaves += 1
+            return self._predicates[key]
+
+        predicate = query_filter._compile_relational_query(query)
+        # [last row, result for the last row]
+        last = [None, False]
+
+        def shared_predicate(table_record):
+            if table_record is last[0]:
+                return last[1]
+            last[1] = predicate(table_record)
+            last[0] = table_record
+            return last[1]
+
+        self.compiled_leaves += 1
+        self._predicates[key] = shared_predicate
+        return shared_predicate
+
+class BatchQueryFilter:
+    # runs many queries against the same table in a single pass, each distinct relational
+    # query is evaluated at most once per row (or once per column on columnar tables)
+    def __init__(self, queries, table, filter_class=None):
+        if filter_class is None:
+            filter_class = ColumnarQueryFilter if isinstance(table, ColumnarTable) else QueryFilter
+
+        self._table = table
+        self._query_filters = [filter_class(query, table) for query in queries]
+        self._shared_leaves = SharedLeaves()
+
+    def _get_data(self):
+        return self._table
+
+    def _compile_queries(self):
+        predicates = []
+
+        for query_filter in self._query_filters:
+            # normalization (and its validation errors) happens here
+            predicate = query_filter.compile_query()
+
+            if query_filter._get_query():
+                predicate = query_filter._compile(
+                    query_filter._get_query(),
+                    lambda query, query_filter=query_filter: self._shared_leaves.compile_leaf(query_filter, query)
+                )
+            predicates.append(predicate)
+        return predicates
+
+    def _run_columnar_row_ids(self):
+        relational_masks = {}
+        results = []
+
+        for query_filter in self._query_filters:
+            if not query_filter._get_query():
+                results.append(list(range(len(self._get_data()))))
+                continue
+
+            query_filter.compile_query()
+            mask = query_filter._evaluate_mask(query_filter._get_query(), relational_masks)
+            results.append(np.flatnonzero(mask).tolist())
+        return results
+
+    # one list of matching row ids for each query, in the order the queries were given
+    def run_queries_row_ids(self):
+        if isinstance(self._get_data(), ColumnarTable):
+            return self._run_columnar_row_ids()
+
+        predicates = self._compile_queries()
+        results = [[] for _ in predicates]
+
+        for row_id, table_record in enumerate(self._get_data()):
+            for predicate, result in zip(predicates, results):
+                if predicate(table_record):
+                    result.append(row_id)
+        return results
+
+    # one list of matching rows for each query, in the order the queries were given
+    def run_queries(self):
+        table = self._get_data()
+
+        if isinstance(table, ColumnarTable):
+            return [table.to_rows(row_ids) for row_ids in self.run_queries_row_ids()]
+        return [[table[row_id] for row_id in row_ids] for row_ids in self.run_queries_row_ids()]
+
+    def get_stats(self):
+        return {
+            'queries':         len(self._query_filters),
+            'compiled_leaves': self._shared_leaves.compiled_leaves,
+            'shared_leaves':   self._shared_leaves.shared_leaves,
+        }
@@ -0,0 +1,274 @@
+import argparse
+import copy
+import datetime
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+import generate_random_query
+import random_table
+from query_filter import QueryFilter
+from columnar_query_filter import ColumnarTable, ColumnarQueryFilter, np
+
+# benchmark of the query engines over random tables and random queries
+# every case (table size, tree depth, fan-out, operator mix, selectivity, caches) runs the same queries
+# in every engine, checks the results against the interpreted evaluator (_evaluate) and saves
+# rows/sec, latency percentiles and peak memory as JSON, so runs can be compared with --compare
+#
+#   python benchmark.py --sizes 10000,100000 --output results.json
+#   python benchmark.py --sizes 10000,100000 --compare results.json
+
+operator_mixes = {
+    'all':      None,
+    'range':    ['gt', 'gte', 'lt', 'lte', 'btw'],
+    'equality': ['eq', 'neq'],
+    'string':   ['sw', 'ew', 'ct', 'nct'],
+}
+
+# caches of the filter classes during a case, they're configured again before each engine so an engine
+# never reuses the plans of another one (compiled and indexed filters share plan cache keys)
+# off: no cache, every query is normalized and compiled
+# plan: a new plan cache, warmed by an untimed run of the queries, it measures repeated queries
+cache_modes = ('off', 'plan')
+
+# ages in random_table are uniform between 1 and 1000
+_max_age = 1000
+
+def _parse_list(value, type=int):
+    return [type(item) for item in value.split(',') if item]
+
+def _percentile(values, percentile):
+    values = sorted(values)
+    index = max(0, int(round(percentile / 100 * len(values))) - 1)
+    return values[index]
+
+# the selectivity is controlled by an extra AND with an age range that keeps about
+# that fraction of the rows, the measured selectivity is reported too
+def generate_queries(count, depth, fan_out, operator_mix, selectivity):
+    queries = []
+
+    for _ in range(count):
+        query = generate_random_query.generate_logical_query(
+            random.choice(['AND', 'OR']), 1, fan_out, depth, operator_mixes[operator_mix]
+        )
+
+        if selectivity < 1:
+            limit = max(1, int(selectivity * _max_age))
+            query = {'AND': [{'field': 'age', 'operator': 'lte', 'value': [str(limit)]}, query]}
+
+        queries.append(query)
+    return queries
+
+def reference_row_ids(query, table):
+    query_filter = QueryFilter(copy.deepcopy(query), table)
+    query_filter._normalize_data_type()
+    normalized_query = query_filter._get_query()
+    return [row_id for row_id, row in enumerate(table) if query_filter._evaluate(normalized_query, row)]
+
+# each engine returns a function (query -> row ids) and the time spent preparing the table
+def prepare_engine(engine, table):
+    start = time.perf_counter()
+
+    if engine == 'interpreted':
+        run = lambda query: reference_row_ids(query, table)
+    elif engine == 'compiled':
+        run = lambda query: QueryFilter(query, table).run_query_row_ids()
+    elif engine == 'adaptive':
+        run = lambda query: QueryFilter(query, table, adaptive=True).run_query_row_ids()
+    elif engine == 'indexed':
+        builder = QueryFilter(None, table)
+        for column in ('age', 'height', 'birth_day'):
+            builder.build_index(column, 'sorted')
+        for kind in ('hash', 'prefix', 'suffix', 'trigram'):
+            builder.build_index('name', kind)
+        indexes = builder.get_indexes()
+        run = lambda query: QueryFilter(query, table, indexes).run_query_row_ids()
+    elif engine == 'columnar':
+        if np is None:
+            raise ValueError("numpy is required by the columnar engine")
+        columnar_table = ColumnarTable.from_rows(table, QueryFilter(None, None)._table_column_types)
+        run = lambda query: ColumnarQueryFilter(query, columnar_table).run_query_row_ids().tolist()
+    else:
+        raise ValueError("Engine '{0}' is not supported".format(engine))
+
+    return run, time.perf_counter() - start
+
+def _configure_caches(caches):
+    if caches == 'off':
+        plan_cache_size = 0
+    elif caches == 'plan':
+        plan_cache_size = 256
+    else:
+        raise ValueError("Cache mode '{0}' is not supported".format(caches))
+
+    # subclasses like ColumnarQueryFilter share the caches of QueryFilter
+    QueryFilter.configure_caches(plan_cache_size=plan_cache_size, result_cache_size=0)
+
+def run_case(table, queries, engine, expected_results, caches='off'):
+    _configure_caches(caches)
+    run, prepare_seconds = prepare_engine(engine, table)
+
+    if caches == 'plan':
+        for query in queries:
+            run(copy.deepcopy(query))
+
+    # peak memory is measured in a separate run, tracemalloc slows everything down
+    tracemalloc.start()
+    run(copy.deepcopy(queries[0]))
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    latencies = []
+    correct = True
+
+    for query, expected in zip(queries, expected_results):
+        # normalization changes the query in place, every run gets its own copy
+        query = copy.deepcopy(query)
+
+        start = time.perf_counter()
+        row_ids = run(query)
+        latencies.append(time.perf_counter() - start)
+
+        if expected is not None and list(row_ids) != expected:
+            correct = False
+
+    total_seconds = sum(latencies)
+    return {
+        'engine':            engine,
+        'caches':            caches,
+        'prepare_seconds':   prepare_seconds,
+        'rows_per_second':   len(table) * len(queries) / total_seconds if total_seconds else None,
+        'latency_ms': {
+            'p50':  _percentile(latencies, 50) * 1000,
+            'p90':  _percentile(latencies, 90) * 1000,
+            'p99':  _percentile(latencies, 99) * 1000,
+            'max':  max(latencies) * 1000,
+        },
+        'peak_memory_bytes': peak_memory,
+        'correct':           correct if expected_results[0] is not None else None,
+    }
+
+def run_benchmark(args):
+    results = []
+
+    for size in args.sizes:
+        random.seed(args.seed)
+        table = random_table.create_random_table(size)
+
+        for depth in args.depths:
+            for fan_out in args.fan_outs:
+                for operator_mix in args.operator_mixes:
+                    for selectivity in args.selectivities:
+                        queries = generate_queries(args.queries, depth, fan_out, operator_mix, selectivity)
+
+                        expected_results = [None] * len(queries)
+                        if args.check:
+                            expected_results = [reference_row_ids(query, table) for query in queries]
+
+                        case = {
+                            'size':         size,
+                            'depth':        depth,
+                            'fan_out':      fan_out,
+                            'operator_mix': operator_mix,
+                            'selectivity':  selectivity,
+                        }
+                        if args.check:
+                            case['measured_selectivity'] = sum(map(len, expected_results)) / (size * len(queries)) if size else 0
+
+                        for caches in args.caches:
+                            for engine in args.engines:
+                                result = dict(case, **run_case(table, queries, engine, expected_results, caches))
+                                results.append(result)
+                                print(_format_result(result), file=sys.stderr)
+
+    # back to the default caches
+    QueryFilter.configure_caches()
+
+    return {
+        'meta': {
+            'created_at': datetime.datetime.now().isoformat(),
+            'python':     platform.python_version(),
+            'platform':   platform.platform(),
+            'arguments':  {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+        },
+        'results': results,
+    }
+
+def _format_result(result):
+    return "size={size} depth={depth} fan_out={fan_out} mix={operator_mix} selectivity={selectivity} caches={caches} {engine}: " \
+           "{rows:,.0f} rows/s p50={p50:.2f}ms p99={p99:.2f}ms peak={memory:,}B correct={correct}".format(
+               rows=result['rows_per_second'] or 0,
+               p50=result['latency_ms']['p50'],
+               p99=result['latency_ms']['p99'],
+               memory=result['peak_memory_bytes'],
+               **result)
+
+def _case_key(result):
+    # results saved before the caches axis have no caches key, they aren't compared
+    return (result['size'], result['depth'], result['fan_out'], result['operator_mix'], result['selectivity'], result.get('caches'), result['engine'])
+
+# returns the cases whose throughput dropped more than threshold (0.1 is 10%) against the baseline
+def compare_results(baseline, current, threshold):
+    baseline_results = {_case_key(result): result for result in baseline['results']}
+    regressions = []
+
+    for result in current['results']:
+        previous = baseline_results.get(_case_key(result))
+        if previous is None or not previous['rows_per_second'] or not result['rows_per_second']:
+            continue
+
+        ratio = result['rows_per_second'] / previous['rows_per_second']
+        print("{0}: {1:.2f}x".format(_case_key(result), ratio), file=sys.stderr)
+        if ratio < 1 - threshold or result['correct'] is False:
+            regressions.append({'case': _case_key(result), 'ratio': ratio, 'correct': result['correct']})
+
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark of the query engines")
+    parser.add_argument('--sizes', type=_parse_list, default=[10000, 100000], help="table sizes, from 10k to 10M")
+    parser.add_argument('--depths', type=_parse_list, default=[0, 2])
+    parser.add_argument('--fan-outs', type=_parse_list, default=[2, 5])
+    parser.add_argument('--operator-mixes', type=lambda value: _parse_list(value, str), default=['all'],
+                        help="comma separated list of {0}".format(', '.join(operator_mixes)))
+    parser.add_argument('--selectivities', type=lambda value: _parse_list(value, float), default=[1.0, 0.01])
+    parser.add_argument('--engines', type=lambda value: _parse_list(value, str),
+                        default=['interpreted', 'compiled', 'adaptive', 'indexed'] + (['columnar'] if np is not None else []))
+    parser.add_argument('--caches', type=lambda value: _parse_list(value, str), default=['off'],
+                        help="comma separated list of {0}".format(', '.join(cache_modes)))
+    parser.add_argument('--queries', type=int, default=20, help="queries per case")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--no-check', dest='check', action='store_false', help="don't check results against _evaluate")
+    parser.add_argument('--output', help="JSON file where results are saved")
+    parser.add_argument('--compare', help="JSON file of a previous run to compare with")
+    parser.add_argument('--threshold', type=float, default=0.1, help="throughput drop considered a regression")
+    args = parser.parse_args(argv)
+
+    for operator_mix in args.operator_mixes:
+        if operator_mix not in operator_mixes:
+            parser.error("Operator mix '{0}' is not supported".format(operator_mix))
+    for caches in args.caches:
+        if caches not in cache_modes:
+            parser.error("Cache mode '{0}' is not supported".format(caches))
+
+    results = run_benchmark(args)
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare_results(json.load(file), results, args.threshold)
+        if regressions:
+            print("Regressions:", json.dumps(regressions, indent=2), file=sys.stderr)
+            return 1
+
+    if any(result['correct'] is False for result in results['results']):
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,235 @@
+import bisect
+import datetime
+import itertools
+import math
+
+# per column statistics collected when a table is loaded (see QueryFilter.ingest and ColumnarTable.from_rows)
+# they estimate the fraction of rows matched by a normalized query without reading any row, which is used
+# by QueryFilter.estimate_count, to order AND/OR children before the first row is evaluated and to skip
+# index lookups that would list most of the table
+# estimates assume the conditions over different columns are independent
+
+# cerberus types that get an equi-depth histogram, their values can be interpolated inside a bucket
+histogram_types = ('integer', 'float', 'number', 'decimal', 'date')
+
+# operator -> (position of the lower bound in the query values, lower inclusive, position of the upper bound, upper inclusive)
+# None is an open side of the range
+_ranges = {
+    'gt':     (0,    False, None, False),
+    'gte':    (0,    True,  None, False),
+    'lt':     (None, False, 0,    False),
+    'lte':    (None, False, 0,    True),
+    'btw':    (0,    True,  1,    True),
+    'gt_lt':  (0,    False, 1,    False),
+    'gte_lt': (0,    True,  1,    False),
+    'gt_lte': (0,    False, 1,    True),
+}
+
+# distance between two values of a histogram column, as a float
+def _distance(lower, upper):
+    distance = upper - lower
+    if isinstance(distance, datetime.timedelta):
+        return distance.days
+    return float(distance)
+
+class ColumnStatistics:
+    # values is the sorted list of the non null values of the column
+    # frequencies (value -> number of rows) are kept when the column has at most max_frequencies
+    # distinct values, they make estimates exact. The histogram has histogram_buckets buckets with
+    # about the same number of values, bounds[i] <= values of bucket i <= bounds[i + 1]
+    def __init__(self, values, row_count, histogram_buckets=0, max_frequencies=0):
+        self.row_count = row_count
+        self.null_count = row_count - len(values)
+        self.min = values[0] if values else None
+        self.max = values[-1] if values else None
+
+        self.distinct_count = 0
+        frequencies = {}
+        for value, group in itertools.groupby(values):
+            self.distinct_count += 1
+            if self.distinct_count <= max_frequencies:
+                frequencies[value] = sum(1 for _ in group)
+        self.frequencies = frequencies if self.distinct_count <= max_frequencies else None
+
+        self.histogram = None
+        if histogram_buckets and values:
+            last = len(values) - 1
+            self.histogram = [values[last * bucket // histogram_buckets] for bucket in range(histogram_buckets + 1)]
+
+    # plain dict of the statistics, encode converts the values of the column to JSON values
+    def to_dict(self, encode):
+        return {
+            'row_count':      self.row_count,
+            'null_count':     self.null_count,
+            'min':            encode(self.min) if self.min is not None else None,
+            'max':            encode(self.max) if self.max is not None else None,
+            'distinct_count': self.distinct_count,
+            'frequencies':    [[encode(value), count] for value, count in self.frequencies.items()] if self.frequencies is not None else None,
+            'histogram':      [encode(value) for value in self.histogram] if self.histogram is not None else None,
+        }
+
+    # statistics saved with to_dict, decode converts the JSON values back to values of the column
+    @classmethod
+    def from_dict(cls, state, decode):
+        statistics = cls.__new__(cls)
+        statistics.row_count = state['row_count']
+        statistics.null_count = state['null_count']
+        statistics.min = decode(state['min']) if state['min'] is not None else None
+        statistics.max = decode(state['max']) if state['max'] is not None else None
+        statistics.distinct_count = state['distinct_count']
+        statistics.frequencies = {decode(value): count for value, count in state['frequencies']} if state['frequencies'] is not None else None
+        statistics.histogram = [decode(value) for value in state['histogram']] if state['histogram'] is not None else None
+        return statistics
+
+    def get_non_null_fraction(self):
+        return (self.row_count - self.null_count) / self.row_count if self.row_count else 0.0
+
+    # fraction of the rows equal to value
+    def estimate_eq(self, value):
+        if self.frequencies is not None:
+            return self.frequencies.get(value, 0) / self.row_count
+        if self.min is None or value < self.min or value > self.max:
+            return 0.0
+
+        estimate = self.get_non_null_fraction() / self.distinct_count
+        if self.histogram is not None:
+            # a frequent value is the bound of many buckets in a row, and it fills the buckets between them
+            bounds = self.histogram
+            repeated = bisect.bisect_right(bounds, value) - bisect.bisect_left(bounds, value) - 1
+            estimate = max(estimate, repeated / (len(bounds) - 1) * self.get_non_null_fraction())
+        return estimate
+
+    # fraction of the non null values lower than value, or lower than or equal to it with inclusive
+    def _estimate_below(self, value, inclusive):
+        bounds = self.histogram
+        if value < bounds[0]:
+            return 0.0
+        if value > bounds[-1]:
+            return 1.0
+
+        # bounds[position - 1] < value <= bounds[position], the buckets before position are all below
+        position = bisect.bisect_left(bounds, value)
+        below = 0.0
+        if position > 0:
+            lower, upper = bounds[position - 1], bounds[position]
+            below = (position - 1 + _distance(lower, value) / _distance(lower, upper)) / (len(bounds) - 1)
+
+        if inclusive and self.get_non_null_fraction():
+            below += self.estimate_eq(value) / self.get_non_null_fraction()
+        return min(below, 1.0)
+
+    # fraction of the rows inside the range, lower and upper are None on an open side
+    def estimate_range(self, lower, lower_inclusive, upper, upper_inclusive):
+        above = 0.0 if lower is None else self._estimate_below(lower, not lower_inclusive)
+        below = 1.0 if upper is None else self._estimate_below(upper, upper_inclusive)
+        return max(below - above, 0.0) * self.get_non_null_fraction()
+
+class TableStatistics:
+    # can be overrided by subclasses
+    # selectivity (fraction of the non null rows) of the operators that the statistics can't estimate,
+    # like the string operators over columns with many distinct values
+    default_selectivities = {
+        'ct':  0.1,
+        'nct': 0.9,
+        'sw':  0.1,
+        'ew':  0.1,
+    }
+
+    # can be overrided by subclasses
+    # selectivity of range operators over columns without histogram (strings with many distinct values)
+    default_range_selectivity = 1 / 3
+
+    def __init__(self, row_count, columns):
+        self.row_count = row_count
+        self.columns = columns
+
+    def _estimate_relational(self, query, get_operator):
+        column = self.columns.get(query["field"])
+        if column is None or not column.row_count:
+            return self.default_selectivities.get(query["operator"], 0.5)
+
+        operator_name = query["operator"]
+        query_values  = query["value"]
+        non_null      = column.get_non_null_fraction()
+
+        # few distinct values, the operator is applied to each of them
+        if column.frequencies is not None:
+            method = get_operator(operator_name)
+            return sum(count for value, count in column.frequencies.items() if method(value, query_values)) / column.row_count
+
+        if operator_name == 'eq':
+            return column.estimate_eq(query_values[0])
+        if operator_name == 'neq':
+            return max(non_null - column.estimate_eq(query_values[0]), 0.0)
+        if operator_name == 'in':
+            return min(sum(column.estimate_eq(value) for value in query_values[0]), non_null)
+
+        if operator_name in _ranges:
+            if column.histogram is None:
+                return non_null * self.default_range_selectivity
+
+            lower, lower_inclusive, upper, upper_inclusive = _ranges[operator_name]
+            return column.estimate_range(
+                query_values[lower] if lower is not None else None, lower_inclusive,
+                query_values[upper] if upper is not None else None, upper_inclusive
+            )
+
+        return non_null * self.default_selectivities.get(operator_name, 0.5)
+
+    # returns (query with ordered children, selectivity, cost), cost is the number of relational queries
+    # AND children that are cheap and reject most rows go first, and OR children that are cheap and
+    # accept most rows, so the evaluation of a row stops as soon as possible
+    def _order(self, query, get_operator):
+        and_op = query.get("AND", None)
+        or_op  = query.get("OR",  None)
+
+        if and_op is None and or_op is None:
+            try:
+                return query, self._estimate_relational(query, get_operator), 1
+            except TypeError:
+                # a query value that can't be compared with the column values
+                return query, self.default_selectivities.get(query["operator"], 0.5), 1
+
+        ordered = dict(query)
+        selectivities = []
+        cost = 0
+
+        if and_op is not None:
+            children = [self._order(dict, get_operator) for dict in and_op]
+            children.sort(key=lambda child: child[2] / (1 - child[1]) if child[1] < 1 else math.inf)
+            ordered["AND"] = [dict for dict, _, _ in children]
+            selectivities.append(math.prod(selectivity for _, selectivity, _ in children))
+            cost += sum(child_cost for _, _, child_cost in children)
+
+        if or_op is not None:
+            children = [self._order(dict, get_operator) for dict in or_op]
+            children.sort(key=lambda child: child[2] / child[1] if child[1] > 0 else math.inf)
+            ordered["OR"] = [dict for dict, _, _ in children]
+            selectivities.append(1 - math.prod(1 - selectivity for _, selectivity, _ in children))
+            cost += sum(child_cost for _, _, child_cost in children)
+
+        # AND and OR in the same dict behave as (AND) or (OR)
+        return ordered, 1 - math.prod(1 - selectivity for selectivity in selectivities), cost
+
+    # get_operator returns the method of an operator name, see QueryFilter._get_operator_by_name
+    def estimate_selectivity(self, query, get_operator):
+        return self._order(query, get_operator)[1]
+
+    # returns a new query with the same children in the order they should be evaluated
+    def order_query(self, query, get_operator):
+        return self._order(query, get_operator)[0]
+
+# get_column_values returns the list of values of a column in row order, with None for missing values
+def collect_statistics(row_count, table_column_types, get_column_values, histogram_buckets=64, max_frequencies=64):
+    columns = {}
+
+    for column, column_type in table_column_types.items():
+        values = sorted(value for value in get_column_values(column) if value is not None)
+        columns[column] = ColumnStatistics(
+            values,
+            row_count,
+            histogram_buckets if column_type['type'] in histogram_types else 0,
+            max_frequencies
+        )
+
+    return TableStatistics(row_count, columns)
@@ -0,0 +1,155 @@
+import datetime
+import json
+import os
+from columnar_query_filter import ColumnarTable, np
+import column_statistics
+
+# on disk format of a ColumnarTable, a directory with:
+#   header.json          length, and type, nullable, files and statistics of every column
+#   column_N.values      int/float/date/bool columns, the raw array (fixed width values)
+#   column_N.offsets     string columns, int64 array with length + 1 offsets in the blob
+#   column_N.blob        string columns, utf-8 bytes of all strings, one after another
+#   column_N.nulls       bool array, only for columns with null values
+#   column_N.codes       dictionary encoded string columns, int32 array with the position of each value in
+#                        the dictionary, whose distinct values are in column_N.dictionary.offsets/.blob
+# fixed width columns are opened with np.memmap, so nothing is read or copied until a query
+# touches the pages it needs. String columns are decoded to a fixed width array the first
+# time they're used, because np.char functions need it, except dictionary encoded ones: their codes
+# are mapped and only the (small) dictionary is decoded, so queries evaluate it once per distinct value
+# the column statistics (see column_statistics) are saved too, so opening a store never reads the columns
+
+_format_version = 1
+_header_file = 'header.json'
+
+# dates of the statistics are saved as ISO strings, other values are JSON values already
+def _encode_value(value):
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    return value
+
+def _get_value_decoder(column_type):
+    if column_type == 'date':
+        return datetime.date.fromisoformat
+    return lambda value: value
+
+def _write_array(path, file_name, array):
+    np.ascontiguousarray(array).tofile(os.path.join(path, file_name))
+    return file_name
+
+# offsets and blob files of an array of strings
+def _write_strings(path, name, values):
+    encoded = [value.encode('utf-8') for value in values.tolist()]
+    offsets = np.zeros(len(encoded) + 1, dtype='<i8')
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+
+    with open(os.path.join(path, name + '.blob'), 'wb') as file:
+        file.write(b''.join(encoded))
+    return _write_array(path, name + '.offsets', offsets), name + '.blob'
+
+# (distinct values, codes) of a string column, from the table or computed when the column has few
+# distinct values (see ColumnarTable._max_dictionary_ratio), None for other columns
+def _get_dictionary(table, column, dictionary_encoding):
+    dictionary = table.get_dictionary(column)
+    if dictionary is not None or not dictionary_encoding:
+        return dictionary
+
+    values = table.get_column(column)
+    distinct_values, codes = np.unique(values, return_inverse=True)
+    if len(distinct_values) <= len(values) * table._max_dictionary_ratio:
+        return distinct_values, codes
+    return None
+
+# string columns with few distinct values are saved dictionary encoded, unless dictionary_encoding is False
+def write_column_store(path, table, dictionary_encoding=True):
+    if np is None:
+        raise ImportError("numpy is required to write a column store")
+
+    os.makedirs(path, exist_ok=True)
+    header = {'format_version': _format_version, 'length': len(table), 'columns': {}}
+
+    statistics = table.statistics
+    if statistics is None:
+        statistics = column_statistics.collect_statistics(len(table), table.get_column_types(), table.get_python_values)
+
+    for position, (column, column_type) in enumerate(table.get_column_types().items()):
+        name = 'column_{0}'.format(position)
+        entry = {'type': column_type['type'], 'nullable': column_type['nullable']}
+
+        dictionary = _get_dictionary(table, column, dictionary_encoding) if column_type['type'] == 'string' else None
+
+        if dictionary is not None:
+            distinct_values, codes = dictionary
+            entry['dictionary_length'] = len(distinct_values)
+            entry['dictionary_offsets'], entry['dictionary_blob'] = _write_strings(path, name + '.dictionary', distinct_values)
+            entry['codes'] = _write_array(path, name + '.codes', codes.astype('<i4'))
+        elif column_type['type'] == 'string':
+            entry['offsets'], entry['blob'] = _write_strings(path, name, table.get_column(column))
+        else:
+            values = table.get_column(column)
+            entry['dtype'] = values.dtype.str
+            entry['values'] = _write_array(path, name + '.values', values)
+
+        null_mask = table.get_null_mask(column)
+        if null_mask is not None:
+            entry['nulls'] = _write_array(path, name + '.nulls', null_mask)
+
+        entry['statistics'] = statistics.columns[column].to_dict(_encode_value)
+        header['columns'][column] = entry
+
+    # the header is written last, a store without it is incomplete
+    with open(os.path.join(path, _header_file), 'w') as file:
+        json.dump(header, file, indent=2)
+
+def _map_array(path, file_name, dtype, length):
+    # np.memmap can't map empty files
+    if length == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(os.path.join(path, file_name), dtype=dtype, mode='r', shape=(length,))
+
+def _read_strings(path, offsets_file, blob_file, length):
+    offsets = _map_array(path, offsets_file, '<i8', length + 1)
+    with open(os.path.join(path, blob_file), 'rb') as file:
+        blob = file.read()
+
+    bounds = offsets.tolist()
+    return np.array(
+        [blob[bounds[index]:bounds[index + 1]].decode('utf-8') for index in range(length)],
+        dtype='str'
+    )
+
+def _string_column_loader(path, entry, length):
+    return lambda: _read_strings(path, entry['offsets'], entry['blob'], length)
+
+# returns a ColumnarTable backed by the files of the store
+def open_column_store(path):
+    if np is None:
+        raise ImportError("numpy is required to open a column store")
+
+    with open(os.path.join(path, _header_file)) as file:
+        header = json.load(file)
+
+    if header.get('format_version') != _format_version:
+        raise ValueError("Column store format version '{0}' is not supported".format(header.get('format_version')))
+
+    length = header['length']
+    columns, null_masks, column_loaders, dictionaries, table_column_types, statistics = {}, {}, {}, {}, {}, {}
+
+    for column, entry in header['columns'].items():
+        table_column_types[column] = {'type': entry['type'], 'nullable': entry['nullable']}
+
+        if 'codes' in entry:
+            columns[column] = _map_array(path, entry['codes'], '<i4', length)
+            dictionaries[column] = _read_strings(path, entry['dictionary_offsets'], entry['dictionary_blob'], entry['dictionary_length'])
+        elif entry['type'] == 'string':
+            column_loaders[column] = _string_column_loader(path, entry, length)
+        else:
+            columns[column] = _map_array(path, entry['values'], np.dtype(entry['dtype']), length)
+
+        if 'nulls' in entry:
+            null_masks[column] = _map_array(path, entry['nulls'], 'bool', length)
+
+        statistics[column] = column_statistics.ColumnStatistics.from_dict(entry['statistics'], _get_value_decoder(entry['type']))
+
+    table = ColumnarTable(columns, null_masks, table_column_types, length=length, column_loaders=column_loaders, dictionaries=dictionaries)
+    table.statistics = column_statistics.TableStatistics(length, statistics)
+    return table
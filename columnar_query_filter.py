@@ -0,0 +1,452 @@
+import datetime
+from query_filter import QueryFilter
+from aggregates import compile_aggregates
+import column_statistics
+
+# numpy is only required by the columnar engine, the row engine in query_filter works without it
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+class ColumnarTable:
+    # cerberus type from _table_column_types -> numpy dtype used to store the column
+    # strings are stored as fixed-width unicode, so np.char functions can be used on them
+    _numpy_dtypes = {
+        'integer': 'int64',
+        'float':   'float64',
+        'date':    'datetime64[D]',
+        'boolean': 'bool',
+        'string':  'str',
+    }
+
+    # value stored in place of None, the real information lives in the null mask
+    _null_placeholders = {
+        'integer': 0,
+        'float':   0.0,
+        'date':    None,
+        'boolean': False,
+        'string':  '',
+    }
+
+    # can be overrided by subclasses
+    # string columns with at most this fraction of distinct values are dictionary encoded by from_rows
+    _max_dictionary_ratio = 0.5
+
+    # column_loaders is a dict column -> function that returns the column array, it's
+    # called only when the column is used for the first time (length is required with it)
+    # dictionaries is a dict column -> array of distinct values, for dictionary encoded columns,
+    # whose array in columns has the int position of the value of each row in the dictionary
+    def __init__(self, columns, null_masks, table_column_types, length=None, column_loaders=None, dictionaries=None):
+        if np is None:
+            raise ImportError("numpy is required to use ColumnarTable")
+
+        self._columns = columns
+        self._null_masks = null_masks
+        self._table_column_types = table_column_types
+        self._column_loaders = column_loaders if column_loaders is not None else {}
+        self._dictionaries = dictionaries if dictionaries is not None else {}
+
+        if length is None:
+            length = len(next(iter(columns.values()))) if columns else 0
+        self._length = length
+
+        # column statistics, see QueryFilter.collect_statistics
+        self.statistics = None
+
+    # builds one array per column from a list of row dicts
+    # columns missing in a row are considered None
+    # string columns with few distinct values are dictionary encoded, unless dictionary_encoding is False
+    # the column statistics are collected too, unless collect_statistics is False
+    @classmethod
+    def from_rows(cls, rows, table_column_types, dictionary_encoding=True, collect_statistics=True):
+        if np is None:
+            raise ImportError("numpy is required to use ColumnarTable")
+
+        columns = {}
+        null_masks = {}
+        dictionaries = {}
+
+        for column, column_type in table_column_types.items():
+            type = column_type['type']
+            values = [row.get(column) for row in rows]
+            null_mask = np.fromiter((value is None for value in values), dtype=bool, count=len(values))
+
+            if null_mask.any():
+                placeholder = cls._null_placeholders[type]
+                values = [placeholder if value is None else value for value in values]
+                null_masks[column] = null_mask
+
+            columns[column] = np.array(values, dtype=cls._numpy_dtypes[type])
+
+            if dictionary_encoding and type == 'string':
+                dictionary, codes = np.unique(columns[column], return_inverse=True)
+                if len(dictionary) <= len(values) * cls._max_dictionary_ratio:
+                    dictionaries[column] = dictionary
+                    columns[column] = codes.astype('int32')
+
+        table = cls(columns, null_masks, table_column_types, dictionaries=dictionaries)
+        if collect_statistics:
+            table.statistics = column_statistics.collect_statistics(len(table), table_column_types, table.get_python_values)
+        return table
+
+    def __len__(self):
+        return self._length
+
+    # stored array of a column, the codes of dictionary encoded columns
+    def _get_stored_column(self, column):
+        if column in self._column_loaders:
+            self._columns[column] = self._column_loaders.pop(column)()
+        if column not in self._columns:
+            raise ValueError("Column '{0}' is not in table".format(column))
+        return self._columns[column]
+
+    # dictionary encoded columns are decoded on every call, queries use get_dictionary instead
+    def get_column(self, column):
+        values = self._get_stored_column(column)
+        if column in self._dictionaries:
+            return self._dictionaries[column][values]
+        return values
+
+    # (distinct values, codes) of a dictionary encoded column, None for other columns
+    def get_dictionary(self, column):
+        if column not in self._dictionaries:
+            return None
+        return self._dictionaries[column], self._get_stored_column(column)
+
+    def _load_columns(self):
+        for column in list(self._column_loaders):
+            self._get_stored_column(column)
+        return self._columns
+
+    # returns None when the column has no null values
+    def get_null_mask(self, column):
+        return self._null_masks.get(column)
+
+    def get_column_type(self, column):
+        return self._table_column_types[column]['type']
+
+    def get_column_types(self):
+        return self._table_column_types
+
+    # converts a normalized query value to a scalar comparable with the column array,
+    # the set of values of the "in" operator becomes an array
+    def to_column_value(self, column, value):
+        if isinstance(value, frozenset):
+            return np.array([self.to_column_value(column, item) for item in value])
+        if self.get_column_type(column) == 'date' and isinstance(value, datetime.date):
+            return np.datetime64(value, 'D')
+        return value
+
+    # python values of a column (None where the value is null), used by the non vectorized fallback
+    def get_python_values(self, column, row_ids=None):
+        values = self._get_stored_column(column)
+        null_mask = self.get_null_mask(column)
+
+        if row_ids is not None:
+            values = values[row_ids]
+            null_mask = null_mask[row_ids] if null_mask is not None else None
+
+        if column in self._dictionaries:
+            values = self._dictionaries[column][values]
+
+        values = values.tolist()
+        if null_mask is not None:
+            for index in np.flatnonzero(null_mask).tolist():
+                values[index] = None
+        return values
+
+    # table with the rows [start, end), arrays are views so nothing is copied
+    def slice(self, start, end):
+        return ColumnarTable(
+            {column: values[start:end] for column, values in self._load_columns().items()},
+            {column: null_mask[start:end] for column, null_mask in self._null_masks.items()},
+            self._table_column_types,
+            length=len(range(self._length)[start:end]),
+            dictionaries=self._dictionaries
+        )
+
+    # materializes rows as dicts, in table order, with all columns or the given ones
+    def to_rows(self, row_ids=None, columns=None):
+        if columns is None:
+            columns = self._load_columns()
+        columns = {column: self.get_python_values(column, row_ids) for column in columns}
+        length = self._length if row_ids is None else len(row_ids)
+        return [{column: values[index] for column, values in columns.items()} for index in range(length)]
+
+class ColumnarQueryFilter(QueryFilter):
+    # can be overrided by subclasses
+    # operators that have no entry here (or that can't be vectorized for a column)
+    # fall back to the row method in _relational_operators applied to each value
+    _vectorized_relational_operators = {
+        "gt":  lambda column, query_value: column > query_value[0],
+        "lt":  lambda column, query_value: column < query_value[0],
+        "eq":  lambda column, query_value: column == query_value[0],
+        "neq": lambda column, query_value: column != query_value[0],
+        "gte": lambda column, query_value: column >= query_value[0],
+        "lte": lambda column, query_value: column <= query_value[0],
+        "btw": lambda column, query_value: (column >= query_value[0]) & (column <= query_value[1]),
+        "in":  lambda column, query_value: np.isin(column, query_value[0]),
+        "gt_lt":  lambda column, query_value: (column > query_value[0])  & (column < query_value[1]),
+        "gte_lt": lambda column, query_value: (column >= query_value[0]) & (column < query_value[1]),
+        "gt_lte": lambda column, query_value: (column > query_value[0])  & (column <= query_value[1]),
+        "ct":  lambda column, query_value: np.char.find(column, query_value[0]) >= 0,
+        "nct": lambda column, query_value: np.char.find(column, query_value[0]) < 0,
+        "sw":  lambda column, query_value: np.char.startswith(column, query_value[0]),
+        "ew":  lambda column, query_value: np.char.endswith(column, query_value[0]),
+    }
+
+    def __init__(self, query, table):
+        super().__init__(query, table)
+
+        # the table only lives as long as the filter, its statistics aren't worth collecting
+        if not isinstance(table, ColumnarTable):
+            self._table = ColumnarTable.from_rows(table, self._table_column_types, collect_statistics=False)
+
+    def _get_column_values(self, column):
+        return self._get_data().get_python_values(column)
+
+    def _can_vectorize(self, operator_name, field):
+        if operator_name not in self._vectorized_relational_operators:
+            return False
+
+        # string operators only are vectorized on string columns, other columns
+        # need the str() conversion made by the row method
+        only_string = self._get_relational_operator(operator_name)['only_string']
+        return not only_string or self._get_data().get_column_type(field) == 'string'
+
+    def _evaluate_relational_mask(self, query):
+        operator_name = query["operator"]
+        query_values  = query["value"]
+        field         = query["field"]
+        table         = self._get_data()
+
+        if self._get_arity_by_name(operator_name) != len(query_values):
+            raise ValueError("Operator '{0}' expects {1} values".format(operator_name, self._get_arity_by_name(operator_name)))
+
+        dictionary = table.get_dictionary(field)
+
+        if dictionary is not None:
+            # the operator is evaluated once for each distinct value and rows are matched by their codes
+            distinct_values, codes = dictionary
+            if self._can_vectorize(operator_name, field):
+                column_values = [table.to_column_value(field, value) for value in query_values]
+                allowed = self._vectorized_relational_operators[operator_name](distinct_values, column_values)
+            else:
+                method = self._get_operator_by_name(operator_name)
+                allowed = np.fromiter(
+                    (method(value, query_values) for value in distinct_values.tolist()),
+                    dtype=bool,
+                    count=len(distinct_values)
+                )
+            mask = allowed[codes]
+        elif self._can_vectorize(operator_name, field):
+            column_values = [table.to_column_value(field, value) for value in query_values]
+            mask = self._vectorized_relational_operators[operator_name](table.get_column(field), column_values)
+        else:
+            method = self._get_operator_by_name(operator_name)
+            mask = np.fromiter(
+                (value is not None and method(value, query_values) for value in table.get_python_values(field)),
+                dtype=bool,
+                count=len(table)
+            )
+
+        # we can't compare None with any value
+        null_mask = table.get_null_mask(field)
+        if null_mask is not None:
+            mask = mask & ~null_mask
+        return mask
+
+    # same semantics as QueryFilter._evaluate, but over the whole table at once
+    # relational_masks is a dict leaf key -> mask, used to share leaves between queries
+    def _evaluate_mask(self, sub_query, relational_masks=None):
+        and_op = sub_query.get("AND", None)
+        or_op  = sub_query.get("OR",  None)
+
+        if and_op is None and or_op is None:
+            if relational_masks is None:
+                return self._evaluate_relational_mask(sub_query)
+
+            key = (sub_query["field"], sub_query["operator"], tuple(sub_query["value"]))
+            if key not in relational_masks:
+                relational_masks[key] = self._evaluate_relational_mask(sub_query)
+            return relational_masks[key]
+
+        length = len(self._get_data())
+        result = np.zeros(length, dtype=bool)
+
+        if and_op is not None:
+            and_mask = np.ones(length, dtype=bool)
+            for dict in and_op:
+                and_mask &= self._evaluate_mask(dict, relational_masks)
+                # no row left to be filtered by the remaining children
+                if not and_mask.any():
+                    break
+            result |= and_mask
+
+        if or_op is not None:
+            for dict in or_op:
+                result |= self._evaluate_mask(dict, relational_masks)
+                if result.all():
+                    break
+
+        return result
+
+    # boolean array with one entry per table row
+    def run_query_mask(self):
+        if not self._get_query():
+            return np.ones(len(self._get_data()), dtype=bool)
+
+        self.compile_query()
+        return self._evaluate_mask(self._get_query())
+
+    # rows are ordered by the rank of their value, a top-k only sorts the rows up to the k-th rank
+    def _order_row_ids(self, row_ids, order_by, descending, stop):
+        values, valid = self._get_row_values(order_by, row_ids)
+        ranks = np.unique(values, return_inverse=True)[1].astype('int64').reshape(-1)
+        if descending:
+            ranks = -ranks
+        # None values go last
+        ranks[~valid] = len(ranks) + 1
+
+        positions = np.arange(len(ranks))
+        if stop is not None and 0 < stop < len(ranks):
+            positions = np.flatnonzero(ranks <= np.partition(ranks, stop - 1)[stop - 1])
+
+        # rows with the same value keep the table order
+        positions = positions[np.lexsort((positions, ranks[positions]))]
+        return row_ids[positions[:stop]]
+
+    def run_query_row_ids(self, limit=None, offset=0, order_by=None, descending=False):
+        stop = self._get_page_stop(limit, offset)
+        row_ids = np.flatnonzero(self.run_query_mask())
+
+        if order_by is not None:
+            self._get_type_from_table_column(order_by)
+            row_ids = self._order_row_ids(row_ids, order_by, descending, stop)
+        return row_ids[offset:stop]
+
+    def run_query(self, limit=None, offset=0, select=None, order_by=None, descending=False):
+        if select is not None:
+            for field in select:
+                self._get_type_from_table_column(field)
+        return self._get_data().to_rows(self.run_query_row_ids(limit, offset, order_by, descending), select)
+
+    def count(self):
+        return int(np.count_nonzero(self.run_query_mask()))
+
+    # values and non null flags of a column for the given rows (dictionary encoded columns are decoded)
+    def _get_row_values(self, column, row_ids):
+        table = self._get_data()
+        dictionary = table.get_dictionary(column)
+
+        if dictionary is not None:
+            values = dictionary[0][dictionary[1][row_ids]]
+        else:
+            values = table.get_column(column)[row_ids]
+
+        null_mask = table.get_null_mask(column)
+        valid = ~null_mask[row_ids] if null_mask is not None else np.ones(len(row_ids), dtype=bool)
+        return values, valid
+
+    def _aggregate_values(self, function, values):
+        if function == 'count':
+            return len(values)
+        if function in ('sum', 'avg'):
+            total = values.astype('int64').sum() if values.dtype == bool else values.sum()
+            if function == 'sum':
+                return total.item()
+            return total.item() / len(values) if len(values) else None
+        if not len(values):
+            return None
+        # numpy has no min/max for strings
+        if values.dtype.kind == 'U':
+            return min(values.tolist()) if function == 'min' else max(values.tolist())
+        return (values.min() if function == 'min' else values.max()).item()
+
+    # group_ids has the group of each value, min and max come from sorting the values inside each group
+    def _aggregate_groups(self, function, values, group_ids, group_count):
+        counts = np.bincount(group_ids, minlength=group_count)
+        if function == 'count':
+            return counts.tolist()
+
+        if function in ('sum', 'avg'):
+            if values.dtype.kind == 'f':
+                totals = np.bincount(group_ids, weights=values, minlength=group_count)
+            else:
+                totals = np.zeros(group_count, dtype='int64')
+                np.add.at(totals, group_ids, values.astype('int64'))
+
+            if function == 'sum':
+                return totals.tolist()
+            return [total / count if count else None for total, count in zip(totals.tolist(), counts.tolist())]
+
+        results = [None] * group_count
+        if not len(values):
+            return results
+
+        order = np.lexsort((values, group_ids))
+        sorted_group_ids = group_ids[order]
+        starts = np.flatnonzero(np.concatenate(([True], sorted_group_ids[1:] != sorted_group_ids[:-1])))
+        positions = starts if function == 'min' else np.concatenate((starts[1:], [len(order)])) - 1
+
+        for group, value in zip(sorted_group_ids[positions].tolist(), values[order][positions].tolist()):
+            results[group] = value
+        return results
+
+    # same results as QueryFilter.aggregate, computed with numpy over the mask of matching rows
+    def aggregate(self, aggregates, group_by=None):
+        specs = compile_aggregates(aggregates, self._table_column_types, group_by)
+        row_ids = self.run_query_row_ids()
+
+        if group_by is None:
+            result = {}
+            for name, function, field in specs:
+                if field is None:
+                    result[name] = len(row_ids)
+                    continue
+                values, valid = self._get_row_values(field, row_ids)
+                result[name] = self._aggregate_values(function, values[valid])
+            return result
+
+        # rows with a null group value are in the None group
+        group_values, group_valid = self._get_row_values(group_by, row_ids)
+        groups, inverse = np.unique(group_values[group_valid], return_inverse=True)
+        groups = groups.tolist()
+
+        group_ids = np.full(len(row_ids), len(groups), dtype='int64')
+        group_ids[group_valid] = inverse
+        if not group_valid.all():
+            groups.append(None)
+
+        results_by_name = {}
+        for name, function, field in specs:
+            if field is None:
+                results_by_name[name] = self._aggregate_groups('count', None, group_ids, len(groups))
+                continue
+            values, valid = self._get_row_values(field, row_ids)
+            results_by_name[name] = self._aggregate_groups(function, values[valid], group_ids[valid], len(groups))
+
+        return {
+            group: {name: results[position] for name, results in results_by_name.items()}
+            for position, group in enumerate(groups)
+        }
+
+    def exists(self):
+        return bool(self.run_query_mask().any())
+
+    # can be overrided by subclasses
+    # rows materialized at a time by iter_query over the filter table
+    _iter_chunk_size = 10000
+
+    # the filter table isn't iterable, its matching rows are materialized as dicts a chunk at a time
+    # other rows (dict rows) are filtered by the row predicate, as in QueryFilter.iter_query
+    def iter_query(self, rows=None, convert_rows=False):
+        if rows is not None:
+            yield from super().iter_query(rows, convert_rows)
+            return
+
+        table = self._get_data()
+        row_ids = np.flatnonzero(self.run_query_mask())
+        for start in range(0, len(row_ids), self._iter_chunk_size):
+            yield from table.to_rows(row_ids[start:start + self._iter_chunk_size])
@@ -0,0 +1,126 @@
+import datetime
+import decimal
+
+# hand written checks for the fixed query grammar and the table rows
+# they follow the same rules of the Cerberus schemas in QueryFilter (unknown keys are ignored,
+# as with purge_unknown) and return errors in the same format of Validator.errors,
+# an empty dict means that the document is valid
+
+# cerberus type -> python types accepted by it (bool is an int, as in Cerberus)
+python_types = {
+    'string':   (str,),
+    'integer':  (int,),
+    'float':    (float, int),
+    'number':   (float, int),
+    'boolean':  (bool,),
+    'date':     (datetime.date,),
+    'datetime': (datetime.datetime,),
+    'decimal':  (decimal.Decimal,),
+    'list':     (list,),
+    'dict':     (dict,),
+}
+
+# returns None when some type isn't known, so Cerberus has to be used
+def get_python_types(types):
+    if any(type not in python_types for type in types):
+        return None
+    return tuple(python_type for type in types for python_type in python_types[type])
+
+def _type_error(types):
+    if len(types) == 1:
+        return "must be of {0} type".format(types[0])
+    return "must be of {0} type".format(list(types))
+
+def validate_logical_query(query):
+    errors = {}
+
+    for key in ('AND', 'OR'):
+        if key not in query:
+            continue
+
+        value = query[key]
+        if value is None:
+            errors[key] = ['null value not allowed']
+        elif not isinstance(value, list):
+            errors[key] = [_type_error(['list'])]
+        else:
+            item_errors = {}
+            for index, item in enumerate(value):
+                if item is None:
+                    item_errors[index] = ['null value not allowed']
+                elif not isinstance(item, dict):
+                    item_errors[index] = [_type_error(['dict'])]
+            if item_errors:
+                errors[key] = [item_errors]
+
+    return errors
+
+# value_types is a tuple (cerberus types, python types), or None to skip the value types check
+def validate_relational_query(query, columns, operators, value_types=None):
+    errors = {}
+
+    for key, allowed in (('field', columns), ('operator', operators)):
+        if key not in query:
+            errors[key] = ['required field']
+        elif query[key] is None:
+            errors[key] = ['null value not allowed']
+        elif not isinstance(query[key], str):
+            errors[key] = [_type_error(['string'])]
+        elif query[key] not in allowed:
+            errors[key] = ['unallowed value {0}'.format(query[key])]
+
+    if 'value' not in query:
+        errors['value'] = ['required field']
+        return errors
+
+    value = query['value']
+    if value is None:
+        errors['value'] = ['null value not allowed']
+    elif not isinstance(value, list):
+        errors['value'] = [_type_error(['list'])]
+    elif len(value) < 1:
+        errors['value'] = ['min length is 1']
+    elif len(value) > 2:
+        errors['value'] = ['max length is 2']
+    elif value_types is not None:
+        types, accepted_types = value_types
+        item_errors = {}
+        for index, item in enumerate(value):
+            if item is None:
+                item_errors[index] = ['null value not allowed']
+            elif not isinstance(item, accepted_types):
+                item_errors[index] = [_type_error(types)]
+        if item_errors:
+            errors['value'] = [item_errors]
+
+    return errors
+
+# column_checks is a list of (column, cerberus type, python types, nullable), see compile_row_checks
+def validate_row(table_record, column_checks):
+    errors = {}
+
+    for column, type, accepted_types, nullable in column_checks:
+        if column not in table_record:
+            errors[column] = ['required field']
+            continue
+
+        value = table_record[column]
+        if value is None:
+            if not nullable:
+                errors[column] = ['null value not allowed']
+        elif not isinstance(value, accepted_types):
+            errors[column] = [_type_error([type])]
+
+    return errors
+
+# returns None when some column type isn't known
+def compile_row_checks(table_column_types):
+    column_checks = []
+
+    for column, column_type in table_column_types.items():
+        accepted_types = get_python_types([column_type['type']])
+        if accepted_types is None:
+            return None
+        column_checks.append((column, column_type['type'], accepted_types, column_type['nullable']))
+
+    return column_checks
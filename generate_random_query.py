@@ -20,51 +20,62 @@ _types_from_fields = {
 }
 
 
-def generate_value_from_operator_and_field(operator, field):
+# service is the RandomService that draws the values, queries of different threads need their own
+def generate_value_from_operator_and_field(operator, field, service=random_service):
     type = _types_from_fields[field]
 
     if type == str:
-        return [random_service.get_random_string(5, 10)]
+        return [service.get_random_string(5, 10)]
     elif type == int:
         if operator == 'btw':
-            min = random_service.get_random_intenger_between(1, 100)
-            max = min + random_service.get_random_intenger_between(1, 20)
+            min = service.get_random_intenger_between(1, 100)
+            max = min + service.get_random_intenger_between(1, 20)
             return [str(min), (max)]
         else:
-            return [str(random_service.get_random_intenger_between(1, 100))]
+            return [str(service.get_random_intenger_between(1, 100))]
     elif type == float:
         if operator == 'btw':
-            min = random_service.get_random_decimal_between(1, 100)
-            max = min + random_service.get_random_decimal_between(1, 20)
+            min = service.get_random_decimal_between(1, 100)
+            max = min + service.get_random_decimal_between(1, 20)
             return [str(min), str(max)]
         else:
-            return [str(random_service.get_random_decimal_between(1, 100))]
+            return [str(service.get_random_decimal_between(1, 100))]
     elif type == datetime.date:
         if operator == 'btw':
-            min, max = random_service.get_random_date_pair_min_max()
+            min, max = service.get_random_date_pair_min_max()
             return [str(min), str(max)]
         else:
-            return [str(random_service.get_random_date())]
+            return [str(service.get_random_date())]
+
+# operators restricts the generated operators (and so the fields that can be used with them)
+def generate_relational_query(operators=None, service=random_service):
+    suitable_fields = fields
+    if operators is not None:
+        suitable_fields = [field for field in fields if set(relational_operators_suitable_fields[field]) & set(operators)]
+        if not suitable_fields:
+            raise ValueError("No field is suitable for operators {0}".format(operators))
 
-def generate_relational_query():
     query = {}
-    query['field']    = random.choice(fields)
-    query['operator'] = random.choice(relational_operators_suitable_fields[query['field']])
-    query['value']    = generate_value_from_operator_and_field(query['operator'], query['field'])
+    query['field']    = service.get_random_choice(suitable_fields)
+    query['operator'] = service.get_random_choice([
+        operator for operator in relational_operators_suitable_fields[query['field']]
+        if operators is None or operator in operators
+    ])
+    query['value']    = generate_value_from_operator_and_field(query['operator'], query['field'], service)
     return query
 
-def generate_logical_query(type, min_count_relational_queries=2, max_count_relational_queries=5, depth=0):
+def generate_logical_query(type, min_count_relational_queries=2, max_count_relational_queries=5, depth=0, operators=None, service=random_service):
     query = {}
     query[type] = []
     for _ in range(
-                    random_service.get_random_intenger_between(
+                    service.get_random_intenger_between(
                         min_count_relational_queries, 
                         max_count_relational_queries
                 )):
-        sub_query = generate_relational_query() if depth == 0 else (
-                        generate_logical_query(random.choice(['OR', 'AND']), 
+        sub_query = generate_relational_query(operators, service) if depth == 0 else (
+                        generate_logical_query(service.get_random_choice(['OR', 'AND']), 
                                                 min_count_relational_queries, 
-                                                max_count_relational_queries, depth-1)
+                                                max_count_relational_queries, depth-1, operators, service)
                     )
         query[type].append(sub_query)
     return query
@@ -1,5 +1,6 @@
 from cerberus import *
 from generate_random_query import *
+from generate_random_query import _types_from_fields
 
 _relational_operation_schema = {
     'field':    {'type': 'string', 'required': True, 'allowed': fields},
@@ -24,7 +25,7 @@ def _parse_relational_query(query):
     operator = query['operator']
     value    = query['value']
 
-    type = types_from_fields[field]
+    type = _types_from_fields[field]
 
     if len(value) > 1:
         return f"{operator}({field}, {_get_formated_value(value[0], type)}, {_get_formated_value(value[1], type)})"
@@ -0,0 +1,139 @@
+import collections
+from query_filter import QueryFilter
+
+# rows that entered, left or changed inside a view after a mutation, as row ids
+ViewDelta = collections.namedtuple('ViewDelta', ['added', 'removed', 'updated'])
+
+class LiveView:
+    # result of a standing query that is kept up to date by its MutableTable,
+    # each mutation only evaluates the changed rows
+    # subscribers are called with (view, delta) after every mutation that changes the view
+    def __init__(self, query, table, filter_class=QueryFilter):
+        self._table = table
+        # the query is validated and normalized once, when the view is registered
+        self._predicate = filter_class(query, None).compile_query()
+        self._row_ids = {row_id for row_id, row in table.items() if self._predicate(row)}
+        self._subscribers = []
+
+    def subscribe(self, callback):
+        self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        self._subscribers.remove(callback)
+
+    def __len__(self):
+        return len(self._row_ids)
+
+    def __contains__(self, row_id):
+        return row_id in self._row_ids
+
+    # matching row ids, in insertion order
+    def get_row_ids(self):
+        return sorted(self._row_ids)
+
+    def get_rows(self):
+        return [self._table.get_row(row_id) for row_id in self.get_row_ids()]
+
+    # changes is a list of (row id, old row, new row), old row is None for
+    # inserted rows and new row is None for deleted rows
+    def _apply(self, changes):
+        added, removed, updated = [], [], []
+
+        for row_id, old_row, new_row in changes:
+            was_in_view = row_id in self._row_ids
+            is_in_view = new_row is not None and self._predicate(new_row)
+
+            if is_in_view and not was_in_view:
+                self._row_ids.add(row_id)
+                added.append(row_id)
+            elif was_in_view and not is_in_view:
+                self._row_ids.discard(row_id)
+                removed.append(row_id)
+            elif is_in_view and old_row is not None:
+                updated.append(row_id)
+
+        if added or removed or updated:
+            delta = ViewDelta(added, removed, updated)
+            for callback in list(self._subscribers):
+                callback(self, delta)
+
+class MutableTable:
+    # table with insert/update/delete that keeps its registered live views up to date
+    # row ids are given on insert and never reused, rows are kept in insertion order
+    # rows must not be changed in place, use update
+    def __init__(self, rows=()):
+        self._rows = {}
+        self._next_row_id = 0
+        self._views = []
+        self.version = 0
+
+        for row in rows:
+            self._rows[self._next_row_id] = row
+            self._next_row_id += 1
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __iter__(self):
+        return iter(self._rows.values())
+
+    def items(self):
+        return self._rows.items()
+
+    def get_row(self, row_id):
+        if row_id not in self._rows:
+            raise KeyError("Row id '{0}' is not in table".format(row_id))
+        return self._rows[row_id]
+
+    def register_view(self, query, filter_class=QueryFilter):
+        view = LiveView(query, self, filter_class)
+        self._views.append(view)
+        return view
+
+    def unregister_view(self, view):
+        self._views.remove(view)
+
+    def _notify(self, changes):
+        self.version += 1
+        for view in self._views:
+            view._apply(changes)
+
+    def insert(self, row):
+        return self.insert_many([row])[0]
+
+    def insert_many(self, rows):
+        changes = []
+        for row in rows:
+            row_id = self._next_row_id
+            self._next_row_id += 1
+            self._rows[row_id] = row
+            changes.append((row_id, None, row))
+
+        self._notify(changes)
+        return [row_id for row_id, _, _ in changes]
+
+    # values is a dict with the changed columns, the row is replaced by a new dict
+    def update(self, row_id, values):
+        self.update_many({row_id: values})
+
+    def update_many(self, values_by_row_id):
+        # all row ids are checked before the table is changed
+        changes = [
+            (row_id, self.get_row(row_id), {**self.get_row(row_id), **values})
+            for row_id, values in values_by_row_id.items()
+        ]
+        for row_id, _, new_row in changes:
+            self._rows[row_id] = new_row
+
+        self._notify(changes)
+
+    def delete(self, row_id):
+        self.delete_many([row_id])
+
+    def delete_many(self, row_ids):
+        # all row ids are checked before the table is changed, a repeated row id is deleted once
+        changes = [(row_id, self.get_row(row_id), None) for row_id in dict.fromkeys(row_ids)]
+        for row_id, _, _ in changes:
+            del self._rows[row_id]
+
+        self._notify(changes)
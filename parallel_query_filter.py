@@ -0,0 +1,211 @@
+import concurrent.futures
+import itertools
+from query_filter import QueryFilter
+from columnar_query_filter import ColumnarTable, ColumnarQueryFilter, np
+
+# numpy (and shared memory) are only needed for columnar tables
+if np is not None:
+    from multiprocessing import shared_memory
+
+# state of each worker process, filled once by _initialize_worker
+_worker_state = {}
+
+def _attach_shared_array(shared_array, handles):
+    name, dtype, length = shared_array
+    handle = shared_memory.SharedMemory(name=name)
+    # keeps the segment open while the worker lives
+    handles.append(handle)
+    return np.ndarray((length,), dtype=np.dtype(dtype), buffer=handle.buf)
+
+# runs once per worker: the table is received here (or inherited with fork), scans only carry
+# the query and row ranges
+def _initialize_worker(filter_class, table, shared_columns):
+    _worker_state.clear()
+    _worker_state['filter_class'] = filter_class
+
+    if shared_columns is None:
+        _worker_state['table'] = table
+        return
+
+    handles = []
+    columns, null_masks, dictionaries = {}, {}, {}
+    for column, (shared_values, shared_null_mask, dictionary) in shared_columns.items():
+        columns[column] = _attach_shared_array(shared_values, handles)
+        if shared_null_mask is not None:
+            null_masks[column] = _attach_shared_array(shared_null_mask, handles)
+        if dictionary is not None:
+            dictionaries[column] = dictionary
+
+    table_column_types = filter_class(None, ColumnarTable({}, {}, {}))._table_column_types
+    _worker_state['table'] = ColumnarTable(columns, null_masks, table_column_types, dictionaries=dictionaries)
+    _worker_state['handles'] = handles
+
+# filter (and predicate for row tables) of the (already normalized) query, built again only when
+# the worker receives another query
+def _get_worker_filter(query):
+    cached = _worker_state.get('query_filter')
+    if cached is not None and cached[0] == query:
+        return cached[1], cached[2]
+
+    filter_class = _worker_state['filter_class']
+    table = _worker_state['table']
+
+    if isinstance(table, ColumnarTable):
+        query_filter, predicate = filter_class(query, ColumnarTable({}, {}, {})), None
+    else:
+        query_filter = filter_class(query, table)
+        predicate = query_filter._compile(query)
+
+    _worker_state['query_filter'] = (query, query_filter, predicate)
+    return query_filter, predicate
+
+def _scan_chunk(query, start, end):
+    table = _worker_state['table']
+    query_filter, predicate = _get_worker_filter(query)
+
+    if predicate is not None:
+        rows = table[start:end]
+        return list(itertools.compress(range(start, end), map(predicate, rows)))
+
+    # columnar chunk, the arrays are sliced without copying
+    query_filter._table = table.slice(start, end)
+    return np.flatnonzero(query_filter._evaluate_mask(query)) + start
+
+class ParallelScanPool:
+    # process pool that keeps a table in its workers across queries, so only the query and the row
+    # ranges are sent for each scan. Columnar tables are copied once to shared memory, that lives
+    # until close. It's a context manager, and it can be shared by many ParallelQueryFilter
+    #
+    #   with ParallelScanPool(table, max_workers=8) as pool:
+    #       ParallelQueryFilter(query, table, pool=pool).run_query()
+    def __init__(self, table, filter_class=None, max_workers=None, mp_context=None):
+        if filter_class is None:
+            filter_class = ColumnarQueryFilter if isinstance(table, ColumnarTable) else QueryFilter
+
+        self.table = table
+        self.filter_class = filter_class
+        self._shared_blocks = []
+
+        columnar = isinstance(table, ColumnarTable)
+        try:
+            shared_columns = self._share_columns(table) if columnar else None
+            self._executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=max_workers,
+                mp_context=mp_context,
+                initializer=_initialize_worker,
+                initargs=(filter_class, None if columnar else table, shared_columns)
+            )
+        except Exception:
+            self._release_shared_blocks()
+            raise
+
+    def _share_columns(self, table):
+        shared_columns = {}
+
+        def share(array):
+            block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            self._shared_blocks.append(block)
+            np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[:] = array
+            return block.name, array.dtype.str, len(array)
+
+        # dictionary encoded columns share their codes, the (small) dictionary is sent to each worker
+        for column in table.get_column_types():
+            null_mask = table.get_null_mask(column)
+            dictionary = table.get_dictionary(column)
+            shared_columns[column] = (
+                share(table.get_column(column) if dictionary is None else dictionary[1]),
+                share(null_mask) if null_mask is not None else None,
+                dictionary[0] if dictionary is not None else None
+            )
+        return shared_columns
+
+    def _release_shared_blocks(self):
+        for block in self._shared_blocks:
+            block.close()
+            block.unlink()
+        self._shared_blocks = []
+
+    # row ids matched by a normalized query, in table order
+    def scan(self, query, chunk_size=100000):
+        if self._executor is None:
+            raise ValueError("ParallelScanPool is closed")
+
+        columnar = isinstance(self.table, ColumnarTable)
+        futures = [
+            self._executor.submit(_scan_chunk, query, start, min(start + chunk_size, len(self.table)))
+            for start in range(0, len(self.table), chunk_size)
+        ]
+
+        # futures are read in submission order, so row ids stay in table order
+        row_ids = []
+        for future in futures:
+            row_ids.extend(future.result().tolist() if columnar else future.result())
+        return row_ids
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        self._release_shared_blocks()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class ParallelQueryFilter:
+    # evaluates a query over chunks of the table in a pool of processes, the result
+    # keeps the table order
+    # the query is validated and normalized here and sent with the row ranges to the workers,
+    # that already have the table: with the fork start method it's inherited without pickling
+    # and columnar tables are placed in shared memory, so they aren't copied to the workers either
+    # pool is a ParallelScanPool over the same table, kept across queries; without it a pool is
+    # started (and the table shared) for each query
+    def __init__(self, query, table, filter_class=None, max_workers=None, chunk_size=100000, mp_context=None, pool=None):
+        if chunk_size <= 0:
+            raise ValueError("chunk_size must be greater than 0")
+
+        if pool is not None:
+            if pool.table is not table:
+                raise ValueError("pool must be over the same table")
+            filter_class = pool.filter_class
+        elif filter_class is None:
+            filter_class = ColumnarQueryFilter if isinstance(table, ColumnarTable) else QueryFilter
+
+        self._filter_class = filter_class
+        self._query_filter = filter_class(query, table)
+        self._max_workers = max_workers
+        self._chunk_size = chunk_size
+        self._mp_context = mp_context
+        self._pool = pool
+
+    def _get_data(self):
+        return self._query_filter._get_data()
+
+    def run_query_row_ids(self):
+        table = self._get_data()
+
+        if not self._query_filter._get_query():
+            return list(range(len(table)))
+
+        # errors in the query are raised here, before starting the workers
+        self._query_filter.compile_query()
+        query = self._query_filter._get_query()
+
+        if self._pool is not None:
+            return self._pool.scan(query, self._chunk_size)
+
+        with ParallelScanPool(table, self._filter_class, self._max_workers, self._mp_context) as pool:
+            return pool.scan(query, self._chunk_size)
+
+    def run_query(self):
+        table = self._get_data()
+
+        if not self._query_filter._get_query():
+            return table.to_rows() if isinstance(table, ColumnarTable) else table
+
+        row_ids = self.run_query_row_ids()
+        if isinstance(table, ColumnarTable):
+            return table.to_rows(row_ids)
+        return [table[row_id] for row_id in row_ids]
@@ -0,0 +1,62 @@
+import collections
+import hashlib
+
+class LRUCache:
+    # bounded cache that discards the least recently used entry when it's full
+    def __init__(self, max_size):
+        if max_size <= 0:
+            raise ValueError("max_size must be greater than 0")
+
+        self._max_size = max_size
+        self._entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        if key not in self._entries:
+            self.misses += 1
+            return default
+
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return self._entries[key]
+
+    def put(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+
+        if len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_stats(self):
+        return {
+            'size':     len(self._entries),
+            'max_size': self._max_size,
+            'hits':     self.hits,
+            'misses':   self.misses,
+        }
+
+# a cache hit skips normalization and its validation, so everything but the order of AND/OR
+# children is part of the key: repr keeps "1" and 1, or "am" and ["a", "m"], as different values
+def _canonical_query(query):
+    if not isinstance(query, dict):
+        return repr(query)
+
+    parts = []
+    for key, value in query.items():
+        # children are sorted, so the order they have in the query doesn't matter
+        if key in ("AND", "OR") and isinstance(value, list):
+            parts.append(key + "[" + ",".join(sorted(_canonical_query(dict) for dict in value)) + "]")
+        else:
+            parts.append(repr(key) + ":" + repr(value))
+    return "{" + ",".join(sorted(parts)) + "}"
+
+# same fingerprint for queries that only differ in the order of AND/OR children
+def query_fingerprint(query):
+    return hashlib.sha1(_canonical_query(query).encode()).hexdigest()
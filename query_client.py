@@ -0,0 +1,185 @@
+import argparse
+import itertools
+import json
+import random
+import socket
+import sys
+import threading
+import time
+import generate_random_query
+from random_services import RandomService
+
+# blocking client of query_server.py, with a load generator of random queries (from generate_random_query)
+#
+#   with QueryClient(unix_path='/tmp/query.sock') as client:
+#       client.request('people', query, mode='count')
+#
+#   python query_client.py --unix /tmp/query.sock --table people --connections 4 --requests 2000 --pipeline 16
+
+class QueryClient:
+    # one persistent connection, errors of the server are raised as ValueError
+    def __init__(self, unix_path=None, host='127.0.0.1', port=7878, timeout=None):
+        if unix_path is not None:
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            address = unix_path
+        else:
+            self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            address = (host, port)
+
+        self._socket.settimeout(timeout)
+        self._socket.connect(address)
+        self._file = self._socket.makefile('rwb')
+        self._ids = itertools.count(1)
+
+    def close(self):
+        self._file.close()
+        self._socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    # sends a request without waiting for the response, returns its id
+    def send(self, request):
+        request = dict(request)
+        request.setdefault('id', next(self._ids))
+        self._file.write(json.dumps(request).encode() + b'\n')
+        self._file.flush()
+        return request['id']
+
+    # next response, responses come in the order the requests were sent
+    def receive(self):
+        line = self._file.readline()
+        if not line:
+            raise ConnectionError("Connection closed by the server")
+        return json.loads(line)
+
+    @staticmethod
+    def _get_result(response):
+        if 'error' in response:
+            raise ValueError(response['error'])
+        return response['result']
+
+    # options are the mode options of query_server: limit, offset, select, order_by and descending
+    def request(self, table, query, mode='rows', **options):
+        self.send(dict(options, table=table, query=query, mode=mode))
+        return self._get_result(self.receive())
+
+    def get_stats(self):
+        self.send({'mode': 'stats'})
+        return self._get_result(self.receive())
+
+    # sends the requests keeping at most window of them waiting for the response, returns the
+    # responses (not only the results, errors are returned too) in the order of the requests
+    def pipeline(self, requests, window=32):
+        responses = []
+        pending = 0
+
+        for request in requests:
+            if pending == window:
+                responses.append(self.receive())
+                pending -= 1
+            self.send(request)
+            pending += 1
+
+        for _ in range(pending):
+            responses.append(self.receive())
+        return responses
+
+def _percentile(values, percentile):
+    index = max(0, int(round(percentile / 100 * len(values))) - 1)
+    return values[index] * 1000
+
+# every connection draws its queries from its own generator, the global random module is never used
+def _generate_requests(args, seed):
+    service = RandomService(generator=random.Random(seed))
+    for _ in range(args.requests):
+        query = generate_random_query.generate_logical_query(service.get_random_choice(['AND', 'OR']), 1, args.fan_out, args.depth, service=service)
+        request = {'table': args.table, 'query': query, 'mode': args.mode}
+        if args.mode in ('rows', 'row_ids'):
+            request['limit'] = args.limit
+        yield request
+
+# each connection runs in a thread, latencies are measured in the client, from the time the request
+# is sent to the time its response is read, so they include the pipelining wait
+def _run_connection(args, seed, latencies, errors):
+    with QueryClient(args.unix, args.host, args.port) as client:
+        sent = {}
+        pending = 0
+
+        def receive():
+            response = client.receive()
+            latencies.append(time.perf_counter() - sent.pop(response['id']))
+            if 'error' in response:
+                errors.append(response['error'])
+
+        for request in _generate_requests(args, seed):
+            if pending == args.pipeline:
+                receive()
+                pending -= 1
+            start = time.perf_counter()
+            sent[client.send(request)] = start
+            pending += 1
+
+        for _ in range(pending):
+            receive()
+
+def run_load(args):
+    latencies, errors = [], []
+    threads = [
+        threading.Thread(target=_run_connection, args=(args, args.seed + connection, latencies, errors))
+        for connection in range(args.connections)
+    ]
+
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - start
+
+    latencies.sort()
+    with QueryClient(args.unix, args.host, args.port) as client:
+        server_stats = client.get_stats()
+
+    return {
+        'requests':            len(latencies),
+        'errors':              len(errors),
+        'seconds':             seconds,
+        'requests_per_second': len(latencies) / seconds if seconds else None,
+        'latency_ms': {
+            'p50': _percentile(latencies, 50),
+            'p95': _percentile(latencies, 95),
+            'p99': _percentile(latencies, 99),
+            'max': latencies[-1] * 1000,
+        } if latencies else None,
+        'server': server_stats,
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load generator of query_server")
+    parser.add_argument('--unix', help="unix socket path, TCP is used without it")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=7878)
+    parser.add_argument('--table', required=True)
+    parser.add_argument('--mode', default='count', choices=['rows', 'row_ids', 'count', 'exists', 'estimate'])
+    parser.add_argument('--limit', type=int, default=100, help="limit of rows and row_ids requests")
+    parser.add_argument('--connections', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=1000, help="requests per connection")
+    parser.add_argument('--pipeline', type=int, default=8, help="requests waiting for a response per connection")
+    parser.add_argument('--depth', type=int, default=1)
+    parser.add_argument('--fan-out', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args(argv)
+
+    if args.pipeline <= 0:
+        parser.error("--pipeline must be greater than 0")
+
+    result = run_load(args)
+    print(json.dumps(result, indent=2))
+    return 1 if result['errors'] else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
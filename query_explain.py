@@ -0,0 +1,283 @@
+import time
+from generate_textual_conditional_from_query import generate_conditional_text
+from columnar_query_filter import ColumnarQueryFilter, np
+from adaptive_predicate import AdaptivePredicate
+from table_indexes import BitmapIndex
+
+# EXPLAIN / EXPLAIN ANALYZE for query trees
+# explain returns the normalized query as a tree of dict nodes, with the engine, and the index or
+# the kind of evaluation used by each relational query. With analyze=True the query runs once with
+# instrumented predicates and every node gets: rows evaluated, rows passed, selectivity and
+# cumulative time (time spent in the node and its children)
+# with table statistics, every node also gets the rows estimated to pass it (estimated_rows)
+# instrumentation only exists in explain, run_query and the other APIs don't pay anything for it
+
+def _get_engine(query_filter):
+    if isinstance(query_filter, ColumnarQueryFilter):
+        return 'columnar'
+    if query_filter._adaptive:
+        return 'adaptive'
+    return 'compiled'
+
+def _relational_text(query):
+    # generate_conditional_text only knows the fields of generate_random_query
+    try:
+        text = generate_conditional_text(query)
+    except Exception:
+        text = None
+
+    if not text:
+        values = query["value"]
+        # the values of the "in" operator are in a set
+        if isinstance(values[0], frozenset):
+            values = sorted(values[0])
+        values = ', '.join('"{0}"'.format(value) if isinstance(value, str) else str(value) for value in values)
+        text = "{0}({1}, {2})".format(query["operator"], query["field"], values)
+    return text
+
+def _build_node(query_filter, sub_query, engine):
+    node = _build_node_access(query_filter, sub_query, engine)
+    if query_filter._get_statistics() is not None:
+        node['estimated_rows'] = round(query_filter._estimate_selectivity(sub_query) * len(query_filter._get_data()))
+    return node
+
+def _build_node_access(query_filter, sub_query, engine):
+    and_op = sub_query.get("AND", None)
+    or_op  = sub_query.get("OR",  None)
+
+    if and_op is None and or_op is None:
+        node = {
+            'node':      'relational',
+            'condition': _relational_text(sub_query),
+            'field':     sub_query["field"],
+            'operator':  sub_query["operator"],
+            'value':     sub_query["value"],
+            'engine':    engine,
+        }
+
+        if engine == 'columnar':
+            node['access'] = 'vectorized' if query_filter._can_vectorize(sub_query["operator"], sub_query["field"]) else 'row fallback'
+            if query_filter._get_data().get_dictionary(sub_query["field"]) is not None:
+                node['access'] += ' over dictionary'
+        else:
+            index = query_filter._get_index(sub_query["field"], sub_query["operator"])
+            node['access'] = 'index' if index is not None else 'scan'
+            if index is not None:
+                node['index'] = type(index).__name__
+
+            # bitmap lookups are never skipped, see QueryFilter._plan_node
+            if index is not None and not isinstance(index, BitmapIndex) and query_filter._is_unselective(sub_query):
+                node['access'] = 'scan (unselective index)'
+                del node['index']
+        return node
+
+    children = []
+    if and_op is not None:
+        and_children = [_build_node(query_filter, dict, engine) for dict in and_op]
+
+        # indexes that the planner doesn't look up, see QueryFilter._get_unselective_children
+        unselective = query_filter._get_unselective_children(and_op)
+        for dict, child in zip(and_op, and_children):
+            if any(dict is unselective_child for unselective_child in unselective):
+                child['access'] = 'scan (unselective index)'
+                child.pop('index', None)
+
+        children.append({'node': 'AND', 'engine': engine, 'children': and_children})
+    if or_op is not None:
+        children.append({'node': 'OR', 'engine': engine, 'children': [_build_node(query_filter, dict, engine) for dict in or_op]})
+
+    if len(children) == 1:
+        return children[0]
+    # AND and OR in the same dict behave as (AND) or (OR)
+    return {'node': 'AND_OR', 'engine': engine, 'children': children}
+
+def _record(node, rows_evaluated, rows_passed, seconds):
+    node['rows_evaluated'] = node.get('rows_evaluated', 0) + rows_evaluated
+    node['rows_passed'] = node.get('rows_passed', 0) + rows_passed
+    node['time_ms'] = node.get('time_ms', 0.0) + seconds * 1000
+
+# same predicates of QueryFilter._compile, wrapped to count rows and time per node
+def _instrument(query_filter, sub_query, node):
+    if node['node'] == 'relational':
+        predicate = query_filter._compile_relational_query(sub_query)
+    elif node['node'] == 'AND_OR':
+        predicate = query_filter._compile_or((
+            _instrument(query_filter, {'AND': sub_query["AND"]}, node['children'][0]),
+            _instrument(query_filter, {'OR': sub_query["OR"]}, node['children'][1]),
+        ))
+    else:
+        predicates = tuple(
+            _instrument(query_filter, dict, child)
+            for dict, child in zip(sub_query[node['node']], node['children'])
+        )
+        if query_filter._adaptive and len(predicates) > 1:
+            predicate = AdaptivePredicate(predicates, node['node'])
+        elif node['node'] == 'AND':
+            predicate = query_filter._compile_and(predicates)
+        else:
+            predicate = query_filter._compile_or(predicates)
+
+    _record(node, 0, 0, 0)
+
+    def instrumented_predicate(table_record):
+        start = time.perf_counter()
+        result = predicate(table_record)
+        node['time_ms'] += (time.perf_counter() - start) * 1000
+        node['rows_evaluated'] += 1
+        if result:
+            node['rows_passed'] += 1
+        return result
+
+    return instrumented_predicate
+
+# mirrors ColumnarQueryFilter._evaluate_mask, without stopping early so every node gets stats
+def _analyze_mask(query_filter, sub_query, node):
+    start = time.perf_counter()
+
+    if node['node'] == 'relational':
+        mask = query_filter._evaluate_relational_mask(sub_query)
+    elif node['node'] == 'AND_OR':
+        mask = _analyze_mask(query_filter, {'AND': sub_query["AND"]}, node['children'][0]) | \
+               _analyze_mask(query_filter, {'OR': sub_query["OR"]}, node['children'][1])
+    else:
+        masks = [_analyze_mask(query_filter, dict, child) for dict, child in zip(sub_query[node['node']], node['children'])]
+        length = len(query_filter._get_data())
+        mask = np.ones(length, dtype=bool) if node['node'] == 'AND' else np.zeros(length, dtype=bool)
+        for child_mask in masks:
+            if node['node'] == 'AND':
+                mask = mask & child_mask
+            else:
+                mask = mask | child_mask
+
+    _record(node, len(mask), int(mask.sum()), time.perf_counter() - start)
+    return mask
+
+def _analyze_indexes(query_filter, sub_query, node):
+    if node.get('access') == 'index':
+        index = query_filter._get_index(sub_query["field"], sub_query["operator"])
+        start = time.perf_counter()
+        node['index_rows'] = len(index.lookup(sub_query["operator"], sub_query["value"]))
+        node['index_time_ms'] = (time.perf_counter() - start) * 1000
+
+    if node['node'] == 'AND_OR':
+        _analyze_indexes(query_filter, {'AND': sub_query["AND"]}, node['children'][0])
+        _analyze_indexes(query_filter, {'OR': sub_query["OR"]}, node['children'][1])
+    elif node['node'] in ('AND', 'OR'):
+        for dict, child in zip(sub_query[node['node']], node['children']):
+            _analyze_indexes(query_filter, dict, child)
+
+def _analyze_rows(query_filter, query, plan):
+    table = query_filter._get_data()
+    predicate = _instrument(query_filter, query, plan['tree'])
+    _analyze_indexes(query_filter, query, plan['tree'])
+
+    row_ids, exact = query_filter._plan(query) if query_filter._indexes else (None, False)
+
+    if row_ids is None:
+        candidates = table
+    else:
+        candidates = [table[row_id] for row_id in sorted(row_ids)]
+
+    plan['candidate_rows'] = len(candidates)
+    plan['exact_index_plan'] = exact
+
+    # all candidates are known to match, no row is evaluated
+    if exact:
+        return len(candidates)
+    return sum(1 for table_record in candidates if predicate(table_record))
+
+def _finish_nodes(node, path, metrics_hook):
+    node['path'] = path
+
+    if 'rows_evaluated' in node:
+        node['selectivity'] = node['rows_passed'] / node['rows_evaluated'] if node['rows_evaluated'] else None
+
+    for position, child in enumerate(node.get('children', [])):
+        _finish_nodes(child, '{0}.{1}'.format(path, position), metrics_hook)
+
+    if metrics_hook is not None:
+        metrics_hook({key: value for key, value in node.items() if key != 'children'})
+
+# metrics_hook is called once per node (children first) with the node stats, to export them
+def explain(query_filter, analyze=False, metrics_hook=None):
+    query_filter.compile_query()
+    query = query_filter._get_query()
+    engine = _get_engine(query_filter)
+
+    plan = {'engine': engine, 'rows_total': len(query_filter._get_data())}
+
+    if not query:
+        plan['tree'] = None
+        return plan
+
+    plan['tree'] = _build_node(query_filter, query, engine)
+
+    if analyze:
+        start = time.perf_counter()
+        if engine == 'columnar':
+            plan['rows_matched'] = int(_analyze_mask(query_filter, query, plan['tree']).sum())
+        else:
+            plan['rows_matched'] = _analyze_rows(query_filter, query, plan)
+        plan['total_ms'] = (time.perf_counter() - start) * 1000
+
+    _finish_nodes(plan['tree'], '0', metrics_hook)
+    return plan
+
+def _format_node(node):
+    text = node.get('condition', node['node'])
+    details = [node['engine']]
+
+    if 'access' in node:
+        details.append(node['access'] if 'index' not in node else 'index {0}'.format(node['index']))
+
+    if 'estimated_rows' in node:
+        details.append('estimated={0}'.format(node['estimated_rows']))
+
+    if 'rows_evaluated' in node:
+        selectivity = '-' if node['selectivity'] is None else '{0:.1%}'.format(node['selectivity'])
+        details.append('rows={0} passed={1} selectivity={2} time={3:.3f}ms'.format(
+            node['rows_evaluated'], node['rows_passed'], selectivity, node['time_ms']))
+
+    if 'index_rows' in node:
+        details.append('index rows={0} index time={1:.3f}ms'.format(node['index_rows'], node['index_time_ms']))
+
+    return '{0}  [{1}]'.format(text, ', '.join(details))
+
+# same format of generate_conditional_text, for any field of the table
+def condition_text(query):
+    and_op = query.get("AND", None)
+    or_op  = query.get("OR",  None)
+
+    if and_op is None and or_op is None:
+        return _relational_text(query)
+
+    # an empty AND is always true and an empty OR is always false
+    parts = []
+    if and_op is not None:
+        parts.append("({0})".format(' and '.join(condition_text(dict) for dict in and_op) or 'true'))
+    if or_op is not None:
+        parts.append("({0})".format(' or '.join(condition_text(dict) for dict in or_op) or 'false'))
+    return ' or '.join(parts)
+
+# the plan as indented text, after the textual conditional of the whole query
+def render_explain(plan, query=None):
+    lines = []
+
+    if query:
+        lines.append('Condition: {0}'.format(condition_text(query)))
+
+    summary = 'Engine: {0}, rows: {1}'.format(plan['engine'], plan['rows_total'])
+    if 'rows_matched' in plan:
+        summary += ', matched: {0}, time: {1:.3f}ms'.format(plan['rows_matched'], plan['total_ms'])
+    if 'candidate_rows' in plan:
+        summary += ', candidate rows: {0}'.format(plan['candidate_rows'])
+    lines.append(summary)
+
+    def render_node(node, depth):
+        lines.append('  ' * depth + _format_node(node))
+        for child in node.get('children', []):
+            render_node(child, depth + 1)
+
+    if plan['tree'] is not None:
+        render_node(plan['tree'], 0)
+    return '\n'.join(lines)
@@ -1,4 +1,21 @@
 from cerberus import *
+from table_indexes import SortedIndex, HashIndex, BitmapIndex, PrefixIndex, SuffixIndex, TrigramIndex, bitmap_row_ids
+from query_cache import LRUCache, query_fingerprint
+from query_optimizer import optimize_query
+from adaptive_predicate import AdaptivePredicate
+from typed_table import TypedTable
+from aggregates import compile_aggregates, fold_rows, build_result
+import column_statistics
+import fast_validation
+import asyncio
+import concurrent.futures
+import contextlib
+import copy
+import functools
+import heapq
+import itertools
+import operator
+import weakref
 import decimal
 import datetime
 
@@ -8,6 +25,21 @@ class CustomValidator(Validator):
     def _validate_type_decimal(self, value):
         return isinstance(value, decimal.Decimal)
 
+# filters a batch of rows in another process, where a compiled predicate can't be sent,
+# so the (already normalized) query is compiled there
+def _filter_rows_with_query(filter_class, normalized_query, convert_rows, rows):
+    query_filter = filter_class(normalized_query, None)
+    if convert_rows:
+        rows = map(query_filter.convert_row, rows)
+    return list(filter(query_filter._compile(normalized_query), rows))
+
+# splits the plans of AND/OR children in the bitmaps combined with combine (None when there's
+# no bitmap) and the (row_ids, exact) plans
+def _combine_bitmap_plans(plans, combine):
+    bitmaps = [plan for plan in plans if isinstance(plan, int)]
+    plans = [plan for plan in plans if not isinstance(plan, int)]
+    return functools.reduce(combine, bitmaps) if bitmaps else None, plans
+
 class QueryFilter:
     # can be overrided by subclasses
     _relational_operators = {
@@ -73,9 +105,91 @@ class QueryFilter:
         },
     }
 
-    def __init__(self, query, table):
+    # can be overrided by subclasses
+    # operators only written by the optimizer (see query_optimizer), they can't be used in queries
+    # "in" receives a frozenset of values, the others are intervals without one or both of the bounds
+    _optimizer_operators = {
+        "in": {
+            'method': lambda table_data, query_value: table_data in query_value[0],
+            'arity': 1,
+            'only_string': False,
+        },
+        "gt_lt": {
+            'method': lambda table_data, query_value: query_value[0] < table_data < query_value[1],
+            'arity': 2,
+            'only_string': False,
+        },
+        "gte_lt": {
+            'method': lambda table_data, query_value: query_value[0] <= table_data < query_value[1],
+            'arity': 2,
+            'only_string': False,
+        },
+        "gt_lte": {
+            'method': lambda table_data, query_value: query_value[0] < table_data <= query_value[1],
+            'arity': 2,
+            'only_string': False,
+        },
+    }
+
+    # can be overrided by subclasses
+    # normalized queries are rewritten by query_optimizer, that relies on the usual meaning
+    # of gt, gte, lt, lte, btw, eq and neq, subclasses that change them must disable it
+    _optimize_queries = True
+
+    # can be overrided by subclasses
+    # index kinds that can be built by build_index
+    _index_types = {
+        'sorted':  SortedIndex,
+        'hash':    HashIndex,
+        'bitmap':  BitmapIndex,
+        'prefix':  PrefixIndex,
+        'suffix':  SuffixIndex,
+        'trigram': TrigramIndex,
+    }
+
+    # can be overrided by subclasses
+    # validates queries (and rows) with the hand written checks in fast_validation, that
+    # follow the same rules of the Cerberus schemas. Types unknown by it always use Cerberus
+    _fast_validation = True
+
+    # can be overrided by subclasses
+    # buckets of the equi-depth histograms of numeric and date columns, see collect_statistics
+    _histogram_buckets = 64
+
+    # can be overrided by subclasses
+    # inside an AND, indexed children estimated to match more than this many times the rows of the most
+    # selective indexed child aren't looked up, the rows left by it are evaluated against them instead
+    _max_index_selectivity_ratio = 4
+
+    # can be overrided by subclasses
+    # relational queries estimated to match more than this fraction of the rows aren't looked up in their
+    # index (but bitmap ones), the rows are scanned instead: listing, sorting and fetching most of the
+    # table by row id costs more than evaluating every row in table order
+    _max_index_selectivity = 0.4
+
+    # Cerberus validators are expensive to build, so they are built once per schema
+    _validators = {}
+
+    # caches are shared by all filters of the same class, see configure_caches
+    # plan cache: query fingerprint -> (normalized query, compiled predicate)
+    # result cache: (query fingerprint, table, table version) -> matching row ids, only
+    # used with tables that have a version counter, like VersionedTable
+    _plan_cache   = LRUCache(256)
+    _result_cache = None
+
+    # indexes is a dict column -> list of indexes, it can be shared between
+    # filters over the same table (see get_indexes)
+    # adaptive reorders AND/OR children during the scan by their observed pass rate and cost
+    # statistics is a TableStatistics of the table (see collect_statistics), by default the
+    # statistics of the table itself, which tables built by ingest have
+    def __init__(self, query, table, indexes=None, adaptive=False, statistics=None):
         self._query = query
         self._table = table
+        self._indexes = indexes if indexes is not None else {}
+        self._adaptive = adaptive
+        self._statistics = statistics
+        self._compiled_predicate = None
+        self._query_fingerprint = None
 
         # should be overrided by subclasses
         # custom_type_converter is useful to convert a string to a custom type, like a date or a boolean
@@ -125,9 +239,23 @@ class QueryFilter:
             raise ValueError("Column '{0}' is not in table".format(column))
         return self._table_column_types[column]['native_type']
 
+    def _get_validator(self, schema):
+        key = repr(schema)
+        if key not in self._validators:
+            self._validators[key] = CustomValidator(schema, purge_unknown=True)
+        return self._validators[key]
+
     # garantee table consistency in all rows
-    # but how it needs to check all rows, it becomes a heavy operation
+    # but how it needs to check all rows, it becomes a heavy operation, see validate_table
     def _table_keys_validation(self, table_record):
+        if self._fast_validation:
+            column_checks = self._get_row_checks()
+            if column_checks is not None:
+                errors = fast_validation.validate_row(table_record, column_checks)
+                if errors:
+                    raise ValueError(errors)
+                return
+
         schema = {}
 
         for column, value in self._table_column_types.items():
@@ -137,11 +265,51 @@ class QueryFilter:
                 'required': True
             }
 
-        v = CustomValidator(schema, purge_unknown=True)
+        v = self._get_validator(schema)
         if not v.validate(table_record):
             raise ValueError(v.errors)
 
+    # None when the fast checks can't be used with the table column types
+    def _get_row_checks(self):
+        if not hasattr(self, '_row_checks'):
+            self._row_checks = fast_validation.compile_row_checks(self._table_column_types)
+        return self._row_checks
+
+    # checks that every row has all table columns with valid types (the rows of the filter
+    # table by default), it's cheap enough to run once when a table is loaded
+    # errors of the first max_errors invalid rows are raised as {row position: errors}
+    def validate_table(self, rows=None, max_errors=10):
+        if rows is None:
+            rows = self._get_data()
+
+        column_checks = self._get_row_checks() if self._fast_validation else None
+        errors = {}
+
+        for row_id, table_record in enumerate(rows):
+            if column_checks is not None:
+                row_errors = fast_validation.validate_row(table_record, column_checks)
+            else:
+                try:
+                    self._table_keys_validation(table_record)
+                    row_errors = None
+                except ValueError as e:
+                    row_errors = e.args[0]
+
+            if row_errors:
+                errors[row_id] = row_errors
+                if len(errors) >= max_errors:
+                    break
+
+        if errors:
+            raise ValueError(errors)
+
     def _logical_layer_query_validation(self, query, raise_exception=True):
+        if self._fast_validation:
+            errors = fast_validation.validate_logical_query(query)
+            if errors and raise_exception:
+                raise ValueError(errors)
+            return not errors
+
         logical_op_schema = {
             'AND': {
                 'type': 'list',
@@ -160,7 +328,7 @@ class QueryFilter:
             }
         }
 
-        v = CustomValidator(logical_op_schema, purge_unknown=True)
+        v = self._get_validator(logical_op_schema)
         if not v.validate(query):
             if raise_exception:
                 raise ValueError(v.errors)
@@ -169,6 +337,21 @@ class QueryFilter:
 
     # types that query can have are all types that are in the table
     def _relational_layer_query_validation(self, query, type_validation=True, raise_exception=True):
+        if self._fast_validation:
+            types = self._get_list_types_from_table()
+            python_types = fast_validation.get_python_types(types)
+
+            if python_types is not None:
+                errors = fast_validation.validate_relational_query(
+                    query,
+                    self._table_column_types,
+                    self._relational_operators,
+                    (types, python_types) if type_validation else None
+                )
+                if errors and raise_exception:
+                    raise ValueError(errors)
+                return not errors
+
         relational_operation_schema = {
             'field':    {'type': 'string', 'required': True, 'allowed': list(self._table_column_types.keys())},
             'operator': {'type': 'string', 'required': True, 'allowed': list(self._relational_operators.keys())},
@@ -185,21 +368,105 @@ class QueryFilter:
                 'type': self._get_list_types_from_table()
             }
 
-        v = CustomValidator(relational_operation_schema, purge_unknown=True)
+        v = self._get_validator(relational_operation_schema)
         if not v.validate(query):
             if raise_exception:
                 raise ValueError(v.errors)
             return False
         return True
 
+    def _convert_value(self, column, value):
+        column_type = self._table_column_types[column]
+        if 'custom_type_converter' in column_type:
+            return column_type['custom_type_converter'](value)
+        return column_type['native_type'](value)
+
+    def _convert_raw_value(self, column, value):
+        column_type = self._table_column_types[column]
+        if not isinstance(value, str) or column_type['native_type'] is str:
+            return value
+
+        if value == '' and column_type['nullable']:
+            return None
+
+        try:
+            return self._convert_value(column, value)
+        except Exception:
+            raise ValueError("Value '{0}' of column '{1}' is not in valid format to be normalized to '{2}'".format(value, column, column_type['native_type']))
+
+    # converts the string values of a raw row (from a JSONL or CSV file, for example)
+    # to the native types of the table, an empty string in a nullable column becomes None
+    def convert_row(self, table_record):
+        converted = dict(table_record)
+
+        for column in self._table_column_types:
+            if column in converted:
+                converted[column] = self._convert_raw_value(column, converted[column])
+        return converted
+
+    # converts raw rows (dicts with string values, as described in the README) once, to a
+    # compact TypedTable with the table columns. Missing columns are None, unknown ones are dropped
+    # the column statistics are collected too, unless collect_statistics is False
+    def ingest(self, rows, collect_statistics=True):
+        columns = list(self._table_column_types)
+        table = TypedTable(columns)
+
+        for table_record in rows:
+            table.append([self._convert_raw_value(column, table_record.get(column)) for column in columns])
+
+        if collect_statistics:
+            table.statistics = column_statistics.collect_statistics(len(table), self._table_column_types, table.get_column_values, self._histogram_buckets)
+        return table
+
+    # key used to read a column from a row: the column name for dict rows or
+    # the column position for the tuple rows of a TypedTable
+    def _get_record_key(self, column):
+        table = self._get_data()
+        if isinstance(table, TypedTable):
+            return table.get_position(column)
+        return column
+
+    # rows layout the compiled predicates depend on, part of the plan cache key
+    def _get_record_layout(self):
+        table = self._get_data()
+        if isinstance(table, TypedTable):
+            return table.get_columns()
+        return None
+
     def _get_data(self):
         return self._table
 
+    # values of a column in row order, None where the value is missing
+    def _get_column_values(self, column):
+        table = self._get_data()
+        if isinstance(table, TypedTable):
+            return table.get_column_values(column)
+        return [row.get(column) for row in table]
+
+    def _get_statistics(self):
+        if self._statistics is not None:
+            return self._statistics
+        return getattr(self._get_data(), 'statistics', None)
+
+    # min, max, null count, distinct count and histograms of every column of the filter table
+    # they can be shared by other filters over the same table with the statistics argument
+    def collect_statistics(self):
+        return column_statistics.collect_statistics(len(self._get_data()), self._table_column_types, self._get_column_values, self._histogram_buckets)
+
+    # fraction of the rows matched by a normalized query, estimated from the statistics
+    def _estimate_selectivity(self, sub_query):
+        return self._get_statistics().estimate_selectivity(sub_query, self._get_operator_by_name)
+
+    def _get_relational_operator(self, operator_name):
+        if operator_name in self._relational_operators:
+            return self._relational_operators[operator_name]
+        return self._optimizer_operators[operator_name]
+
     def _get_operator_by_name(self, operator_name):
-        return self._relational_operators[operator_name]['method']
+        return self._get_relational_operator(operator_name)['method']
 
     def _get_arity_by_name(self, operator_name):
-        return self._relational_operators[operator_name]['arity']
+        return self._get_relational_operator(operator_name)['arity']
 
     def _get_query(self):
         return self._query
@@ -229,11 +496,7 @@ class QueryFilter:
                     # check if operator is strict with strings
                     if not only_string:
                         try:
-                            if 'custom_type_converter' in self._table_column_types[query["field"]]:
-                                custom_type_converter = self._table_column_types[query["field"]]['custom_type_converter']
-                                query["value"][index] = custom_type_converter(value)
-                            else:
-                                query["value"][index] = type(value)
+                            query["value"][index] = self._convert_value(query["field"], value)
                         except Exception as e:
                             print(e)
                             raise ValueError("Value '{0}' is not in valid format to be normalized to '{1}'".format(value, type))
@@ -251,7 +514,7 @@ class QueryFilter:
         return self._get_operator_by_name(operator_name)(target_value, entry_values)
 
     def _evaluate_relational_query(self, query, table_record):
-        target_value = table_record[query["field"]]
+        target_value = table_record[self._get_record_key(query["field"])]
         
         # check if current row is None
         # because we can't compare None with any value
@@ -268,26 +531,562 @@ class QueryFilter:
         and_op = sub_query.get("AND", None)
         or_op  = sub_query.get("OR",  None)
 
-        if not and_op and not or_op:
+        if and_op is None and or_op is None:
             # here we have a relational query
             # check if table row is valid
-            # this check is so heave, so should be used in small tables
+            # this check is so heave, so should be used in small tables,
+            # validate_table checks the whole table once instead
             # self._table_keys_validation(table_record)
             return self._evaluate_relational_query(sub_query, table_record)
         
-        if and_op is not None and all([self._evaluate(dict, table_record) for dict in and_op]):
+        # generators make all/any stop at the first child that decides the result
+        if and_op is not None and all(self._evaluate(dict, table_record) for dict in and_op):
             return True
         
-        if or_op is not None and any([self._evaluate(dict, table_record) for dict in or_op]):
+        if or_op is not None and any(self._evaluate(dict, table_record) for dict in or_op):
             return True
         
         return False
 
-    def run_query(self):
+    # key is the key used to read the field from a row, by default the one of the filter table
+    def _compile_relational_query(self, query, key=None):
+        operator_name = query["operator"]
+        query_values  = query["value"]
+
+        # arity and operator are resolved once here, not once per row
+        if self._get_arity_by_name(operator_name) != len(query_values):
+            raise ValueError("Operator '{0}' expects {1} values".format(operator_name, self._get_arity_by_name(operator_name)))
+
+        method = self._get_operator_by_name(operator_name)
+        if key is None:
+            key = self._get_record_key(query["field"])
+
+        def relational_predicate(table_record):
+            target_value = table_record[key]
+
+            # we can't compare None with any value
+            if target_value is None:
+                return False
+            return method(target_value, query_values)
+
+        return relational_predicate
+
+    @staticmethod
+    def _compile_and(predicates):
+        if not predicates:
+            return lambda table_record: True
+        if len(predicates) == 1:
+            return predicates[0]
+        if len(predicates) == 2:
+            first, second = predicates
+            return lambda table_record: first(table_record) and second(table_record)
+        return lambda table_record: all(predicate(table_record) for predicate in predicates)
+
+    @staticmethod
+    def _compile_or(predicates):
+        if not predicates:
+            return lambda table_record: False
+        if len(predicates) == 1:
+            return predicates[0]
+        if len(predicates) == 2:
+            first, second = predicates
+            return lambda table_record: first(table_record) or second(table_record)
+        return lambda table_record: any(predicate(table_record) for predicate in predicates)
+
+    # turns a normalized query into a closure tree with the same semantics as _evaluate,
+    # so the dict tree is walked only once instead of once per row
+    # leaf_compiler replaces _compile_relational_query, it's used to share leaves between queries
+    def _compile(self, sub_query, leaf_compiler=None):
+        and_op = sub_query.get("AND", None)
+        or_op  = sub_query.get("OR",  None)
+
+        if and_op is None and or_op is None:
+            if leaf_compiler is not None:
+                return leaf_compiler(sub_query)
+            return self._compile_relational_query(sub_query)
+
+        and_predicate = None
+        or_predicate  = None
+
+        if and_op is not None:
+            and_predicates = tuple(self._compile(dict, leaf_compiler) for dict in and_op)
+            if self._adaptive and len(and_predicates) > 1:
+                and_predicate = AdaptivePredicate(and_predicates, 'AND')
+            else:
+                and_predicate = self._compile_and(and_predicates)
+
+        if or_op is not None:
+            or_predicates = tuple(self._compile(dict, leaf_compiler) for dict in or_op)
+            if self._adaptive and len(or_predicates) > 1:
+                or_predicate = AdaptivePredicate(or_predicates, 'OR')
+            else:
+                or_predicate = self._compile_or(or_predicates)
+
+        if and_predicate is None:
+            return or_predicate
+        if or_predicate is None:
+            return and_predicate
+        # AND and OR in the same dict behave as (AND) or (OR), like in _evaluate
+        return self._compile_or((and_predicate, or_predicate))
+
+    # normalizes and optimizes the query (only once, normalization isn't idempotent) and
+    # returns a predicate that receives a table row and returns a boolean
+    # a cached normalized query is shared by many filters, so it must not be changed
+    def compile_query(self):
+        if self._compiled_predicate is not None:
+            return self._compiled_predicate
+
+        if not self._get_query():
+            self._compiled_predicate = lambda table_record: True
+            return self._compiled_predicate
+
+        # the fingerprint is taken before normalization, it changes the query in place
+        if self._plan_cache is not None or self._result_cache is not None:
+            self._query_fingerprint = query_fingerprint(self._get_query())
+
+        # children are ordered by the estimates of the table statistics, so they're part of the key
+        statistics = self._get_statistics()
+        plan_key = (type(self), self._adaptive, self._get_record_layout(), statistics, self._query_fingerprint)
+
+        plan = None
+        if self._plan_cache is not None:
+            plan = self._plan_cache.get(plan_key)
+
+        if plan is None:
+            # the plan keeps references to the values of the normalized query, so it's built over a copy
+            # and the query of the caller is never changed nor shared with other filters
+            self._query = copy.deepcopy(self._get_query())
+            self._normalize_data_type()
+            if self._optimize_queries:
+                self._query = optimize_query(self._get_query())
+            if statistics is not None:
+                self._query = statistics.order_query(self._get_query(), self._get_operator_by_name)
+            plan = (self._get_query(), self._compile(self._get_query()))
+
+            if self._plan_cache is not None:
+                self._plan_cache.put(plan_key, plan)
+
+        self._query, self._compiled_predicate = plan
+        return self._compiled_predicate
+
+    # size 0 disables the cache
+    @classmethod
+    def configure_caches(cls, plan_cache_size=256, result_cache_size=0):
+        cls._plan_cache   = LRUCache(plan_cache_size)   if plan_cache_size   else None
+        cls._result_cache = LRUCache(result_cache_size) if result_cache_size else None
+
+    @classmethod
+    def get_cache_stats(cls):
+        return {
+            'plan_cache':   cls._plan_cache.get_stats()   if cls._plan_cache   is not None else None,
+            'result_cache': cls._result_cache.get_stats() if cls._result_cache is not None else None,
+        }
+
+    # indexes are built over the current table rows, they must be rebuilt if the table changes
+    def build_index(self, column, kind='sorted'):
+        if kind not in self._index_types:
+            raise ValueError("Index kind '{0}' is not supported".format(kind))
+        self._get_type_from_table_column(column)
+
+        index = self._index_types[kind](self._get_column_values(column))
+        self._indexes.setdefault(column, []).append(index)
+        return index
+
+    def get_indexes(self):
+        return self._indexes
+
+    def _get_sorted_index(self, field):
+        for index in self._indexes.get(field, []):
+            if isinstance(index, SortedIndex):
+                return index
+        return None
+
+    def _get_index(self, field, operator_name):
+        for index in self._indexes.get(field, []):
+            if index.supports(operator_name):
+                return index
+        return None
+
+    # relational query whose index isn't looked up, see _max_index_selectivity
+    def _is_unselective(self, sub_query):
+        return self._get_statistics() is not None and self._estimate_selectivity(sub_query) > self._max_index_selectivity
+
+    # relational children of an AND whose index isn't looked up: when an indexed child is much more selective,
+    # listing the rows of the others costs more than evaluating the few rows left by it against them
+    # bitmap lookups are cheap and never skipped
+    def _get_unselective_children(self, and_op):
+        if self._get_statistics() is None:
+            return []
+
+        estimates = []
+        for dict in and_op:
+            if "AND" in dict or "OR" in dict:
+                continue
+            index = self._get_index(dict["field"], dict["operator"])
+            if index is not None and not isinstance(index, BitmapIndex):
+                estimates.append((dict, self._estimate_selectivity(dict)))
+
+        if not estimates:
+            return []
+        max_selectivity = min(selectivity for _, selectivity in estimates) * self._max_index_selectivity_ratio
+        return [dict for dict, selectivity in estimates if selectivity > max_selectivity]
+
+    # returns (row_ids, exact) for a normalized query
+    # row_ids is a superset of the matching row ids (a set, or a sorted list when it comes from
+    # bitmap indexes), or None when it means all rows
+    # exact indicates that every row in row_ids matches, so no row needs to be evaluated
+    def _plan(self, sub_query):
+        plan = self._plan_node(sub_query)
+        if isinstance(plan, int):
+            return bitmap_row_ids(plan), True
+        return plan
+
+    # the plan of a subtree whose relational queries are all answered by bitmap indexes is
+    # the bitmap of its matching rows, so the whole subtree is evaluated with & and |
+    def _plan_node(self, sub_query):
+        and_op = sub_query.get("AND", None)
+        or_op  = sub_query.get("OR",  None)
+
+        if and_op is None and or_op is None:
+            index = self._get_index(sub_query["field"], sub_query["operator"])
+            if index is None:
+                return None, False
+            if isinstance(index, BitmapIndex):
+                return index.lookup_bitmap(sub_query["operator"], sub_query["value"])
+            if self._is_unselective(sub_query):
+                return None, False
+            return index.lookup(sub_query["operator"], sub_query["value"]), True
+
+        plans = []
+
+        if and_op is not None:
+            unselective = self._get_unselective_children(and_op)
+            plans.append(self._plan_and([
+                (None, False) if any(dict is child for child in unselective) else self._plan_node(dict)
+                for dict in and_op
+            ]))
+
+        if or_op is not None:
+            plans.append(self._plan_or([self._plan_node(dict) for dict in or_op]))
+
+        return self._plan_or(plans)
+
+    @staticmethod
+    def _plan_and(plans):
+        bitmap, plans = _combine_bitmap_plans(plans, operator.and_)
+        if bitmap is not None:
+            if not plans:
+                return bitmap
+            plans.append((set(bitmap_row_ids(bitmap)), True))
+
+        row_ids = None
+        for plan_row_ids, _ in plans:
+            if plan_row_ids is None:
+                continue
+            row_ids = plan_row_ids if row_ids is None else row_ids & plan_row_ids
+        return row_ids, all(exact for _, exact in plans)
+
+    @staticmethod
+    def _plan_or(plans):
+        bitmap, plans = _combine_bitmap_plans(plans, operator.or_)
+        if bitmap is not None:
+            if not plans:
+                return bitmap
+            plans.append((set(bitmap_row_ids(bitmap)), True))
+
+        # a child matching exactly all rows makes the whole OR match all rows
+        if any(row_ids is None and exact for row_ids, exact in plans):
+            return None, True
+        if not plans:
+            return set(), True
+        if any(row_ids is None for row_ids, _ in plans):
+            return None, False
+
+        return set().union(*[row_ids for row_ids, _ in plans]), all(exact for _, exact in plans)
+
+    # lazily yields the positions of the matching rows, in table order
+    def _iter_row_ids(self):
+        predicate = self.compile_query()
+        table = self._get_data()
+
+        row_ids, exact = self._plan(self._get_query()) if self._indexes else (None, False)
+
+        # no index could restrict the rows, so all of them are scanned
+        if row_ids is None:
+            if exact:
+                return iter(range(len(table)))
+            return itertools.compress(range(len(table)), map(predicate, table))
+
+        row_ids = sorted(row_ids)
+        if exact:
+            return iter(row_ids)
+        return (row_id for row_id in row_ids if predicate(table[row_id]))
+
+    def _get_result_cache_key(self):
+        version = getattr(self._get_data(), 'version', None)
+        if self._result_cache is None or version is None:
+            return None
+
+        self.compile_query()
+        return (type(self), self._query_fingerprint, id(self._get_data()), version)
+
+    def _get_cached_row_ids(self, result_key):
+        if result_key is None:
+            return None
+
+        # the table reference is checked because id() can be reused by another table
+        cached = self._result_cache.get(result_key)
+        if cached is not None and cached[0]() is self._get_data():
+            return cached[1]
+        return None
+
+    @staticmethod
+    def _get_page_stop(limit, offset):
+        if offset < 0:
+            raise ValueError("offset must be greater than or equal 0")
+        if limit is None:
+            return None
+        if limit < 0:
+            raise ValueError("limit must be greater than or equal 0")
+        return offset + limit
+
+    # positions of all matching rows in table order, lazily when they aren't cached
+    def _iter_matching_row_ids(self):
+        if not self._get_query():
+            return iter(range(len(self._get_data())))
+
+        cached = self._get_cached_row_ids(self._get_result_cache_key())
+        if cached is not None:
+            return iter(cached)
+        return self._iter_row_ids()
+
+    # positions of the first stop matching rows ordered by the order_by column (all of them when
+    # stop is None), None values go last and rows with the same value keep the table order
+    # a top-k (stop) keeps only k rows in a heap, or reads a sorted index of the column in order
+    # when no index restricts the rows, stopping as soon as k rows match
+    def _get_ordered_row_ids(self, order_by, descending, stop):
+        self._get_type_from_table_column(order_by)
+        table = self._get_data()
+        key = self._get_record_key(order_by)
+        predicate = self.compile_query()
+
+        index = self._get_sorted_index(order_by)
+        if stop is not None and index is not None and (not self._get_query() or self._plan(self._get_query())[0] is None):
+            # rows with a None value aren't in the index
+            row_ids = itertools.chain(
+                index.iter_row_ids(descending),
+                (row_id for row_id, table_record in enumerate(table) if table_record[key] is None)
+            )
+            return list(itertools.islice((row_id for row_id in row_ids if predicate(table[row_id])), stop))
+
+        if descending:
+            sort_key = lambda row_id: (table[row_id][key] is not None, table[row_id][key])
+        else:
+            sort_key = lambda row_id: (table[row_id][key] is None, table[row_id][key])
+
+        row_ids = self._iter_matching_row_ids()
+        if stop is None:
+            return sorted(row_ids, key=sort_key, reverse=descending)
+        # same results as sorted()[:stop], ties keep their order
+        if descending:
+            return heapq.nlargest(stop, row_ids, key=sort_key)
+        return heapq.nsmallest(stop, row_ids, key=sort_key)
+
+    # returns the selected columns of the rows as dicts
+    def _project_rows(self, rows, select):
+        keys = []
+        for field in select:
+            self._get_type_from_table_column(field)
+            keys.append((field, self._get_record_key(field)))
+
+        return [{field: table_record[key] for field, key in keys} for table_record in rows]
+
+    # positions of the matching rows in the table, in table order or ordered by the order_by column
+    # limit and offset select a page of the result, the scan stops as soon as the page is filled
+    def run_query_row_ids(self, limit=None, offset=0, order_by=None, descending=False):
+        table = self._get_data()
+        stop = self._get_page_stop(limit, offset)
+
+        if order_by is not None:
+            return self._get_ordered_row_ids(order_by, descending, stop)[offset:]
+
+        if not self._get_query():
+            return list(range(len(table))[offset:stop])
+
+        result_key = self._get_result_cache_key()
+        cached = self._get_cached_row_ids(result_key)
+        if cached is not None:
+            return list(cached[offset:stop])
+
+        # only whole results are cached
+        if result_key is not None and limit is None and offset == 0:
+            row_ids = list(self._iter_row_ids())
+            self._result_cache.put(result_key, (weakref.ref(table), tuple(row_ids)))
+            return row_ids
+
+        return list(itertools.islice(self._iter_row_ids(), offset, stop))
+
+    # select is a list of columns, the rows are returned as dicts with only these columns
+    def run_query(self, limit=None, offset=0, select=None, order_by=None, descending=False):
+        table = self._get_data()
+        stop = self._get_page_stop(limit, offset)
+
+        if order_by is not None:
+            rows = [table[row_id] for row_id in self.run_query_row_ids(limit, offset, order_by, descending)]
         # check if query is empty
+        elif not self._get_query():
+            rows = table if limit is None and offset == 0 else list(itertools.islice(table, offset, stop))
+        elif not self._indexes and self._get_result_cache_key() is None:
+            rows = list(itertools.islice(filter(self.compile_query(), table), offset, stop))
+        else:
+            rows = [table[row_id] for row_id in self.run_query_row_ids(limit, offset)]
+
+        if select is not None:
+            return self._project_rows(rows, select)
+        return rows
+
+    # number of matching rows, without building the result
+    def count(self):
+        if not self._get_query():
+            return len(self._get_data())
+
+        cached = self._get_cached_row_ids(self._get_result_cache_key())
+        if cached is not None:
+            return len(cached)
+
+        return sum(1 for _ in self._iter_row_ids())
+
+    # number of matching rows estimated from the table statistics, without reading any row
+    # it's meant for quick feedback, like "about N results" while a query is being built
+    def estimate_count(self):
+        table = self._get_data()
+
         if not self._get_query():
-            return self._get_data()
+            return len(table)
+        if self._get_statistics() is None:
+            raise ValueError("Table has no statistics, see collect_statistics")
+
+        self.compile_query()
+        return round(self._estimate_selectivity(self._get_query()) * len(table))
+
+    # whether some row matches, the scan stops at the first match
+    def exists(self):
+        if not self._get_query():
+            return len(self._get_data()) > 0
+
+        cached = self._get_cached_row_ids(self._get_result_cache_key())
+        if cached is not None:
+            return len(cached) > 0
+
+        return next(self._iter_row_ids(), None) is not None
+
+    # matching rows of the filter table in table order, without building a list
+    def _iter_matching_rows(self):
+        table = self._get_data()
+
+        if not self._get_query():
+            return iter(table)
+
+        cached = self._get_cached_row_ids(self._get_result_cache_key())
+        if cached is not None:
+            return (table[row_id] for row_id in cached)
+
+        if not self._indexes:
+            return filter(self.compile_query(), table)
+        return (table[row_id] for row_id in self._iter_row_ids())
+
+    # folds the matching rows into aggregates during the scan, without building the result
+    # aggregates is a dict name -> (function, field), with the functions in aggregates.py
+    # returns {name: value}, or {group value: {name: value}} with group_by
+    def aggregate(self, aggregates, group_by=None):
+        specs = compile_aggregates(aggregates, self._table_column_types, group_by)
+        keys = [self._get_record_key(field) if field is not None else None for _, _, field in specs]
+        group_key = self._get_record_key(group_by) if group_by is not None else None
+
+        groups = fold_rows(self._iter_matching_rows(), specs, keys, group_key)
+        return build_result(specs, groups, group_by is not None)
+
+    # predicate for rows that may not have the layout of the filter table: the compiled predicate of a
+    # filter over a TypedTable reads columns by position, so other rows get a predicate of their own,
+    # that reads columns by position in rows when it's a TypedTable and by name otherwise (dict rows)
+    def _get_rows_predicate(self, rows=None):
+        predicate = self.compile_query()
+        layout = rows.get_columns() if isinstance(rows, TypedTable) else None
+
+        if not self._get_query() or layout == self._get_record_layout():
+            return predicate
+
+        if isinstance(rows, TypedTable):
+            leaf_compiler = lambda query: self._compile_relational_query(query, rows.get_position(query["field"]))
+        else:
+            leaf_compiler = lambda query: self._compile_relational_query(query, query["field"])
+        return self._compile(self._get_query(), leaf_compiler)
+
+    # lazily yields the matching rows of any iterable of rows (the filter table by default),
+    # so tables that don't fit in memory can be filtered with constant memory
+    # convert_rows converts raw string rows with convert_row before evaluating them
+    def iter_query(self, rows=None, convert_rows=False):
+        if rows is None and not convert_rows:
+            yield from filter(self.compile_query(), self._get_data())
+            return
+
+        if rows is None:
+            rows = self._get_data()
+
+        # converted rows are dicts
+        predicate = self._get_rows_predicate(None if convert_rows else rows)
+        if convert_rows:
+            rows = map(self.convert_row, rows)
+
+        yield from filter(predicate, rows)
+
+    # async version of iter_query for rows that arrive in batches from an async iterator
+    # (an HTTP API or an async database cursor, for example)
+    # batches are read ahead by a background task, at most max_pending_batches at a time,
+    # so reading overlaps with filtering and a slow consumer stops the reading (backpressure)
+    # batches with offload_threshold rows or more are filtered in executor (the default thread
+    # pool of the loop when None, a ProcessPoolExecutor can be used too) so the loop isn't blocked
+    # closing or cancelling the iteration cancels the reading of batches
+    async def aiter_query(self, batches, convert_rows=False, executor=None, offload_threshold=10000, max_pending_batches=2):
+        # batches are lists of dict rows, whatever the layout of the filter table
+        predicate = self._get_rows_predicate()
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=max_pending_batches)
+        end_of_batches = object()
+
+        if isinstance(executor, concurrent.futures.ProcessPoolExecutor):
+            offloaded_filter = functools.partial(_filter_rows_with_query, type(self), self._get_query(), convert_rows)
+        else:
+            offloaded_filter = lambda rows: list(filter(predicate, map(self.convert_row, rows) if convert_rows else rows))
+
+        async def read_batches():
+            try:
+                async for batch in batches:
+                    await queue.put(batch)
+            except Exception as e:
+                await queue.put(e)
+            else:
+                await queue.put(end_of_batches)
+
+        reader = asyncio.ensure_future(read_batches())
+
+        try:
+            while True:
+                batch = await queue.get()
+                if batch is end_of_batches:
+                    break
+                if isinstance(batch, Exception):
+                    raise batch
+
+                batch = list(batch)
+                if len(batch) >= offload_threshold:
+                    matches = await loop.run_in_executor(executor, offloaded_filter, batch)
+                else:
+                    matches = filter(predicate, map(self.convert_row, batch) if convert_rows else batch)
 
-        # normalize data before comparisons
-        self._normalize_data_type()
-        return list(filter(lambda row: self._evaluate(self._get_query(), row), self._get_data()))
+                for row in matches:
+                    yield row
+        finally:
+            reader.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await reader
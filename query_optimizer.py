@@ -0,0 +1,220 @@
+# rewrites a normalized query into an equivalent one with fewer relational queries to evaluate per row,
+# it runs once, after _normalize_data_type (see QueryFilter.compile_query)
+#   - nested AND/OR nodes of the same type are flattened and nodes with a single child are unwrapped
+#   - duplicated children are removed
+#   - inside an AND, range queries (gt, gte, lt, lte, btw) over the same field become one interval test,
+#     eq queries restrict it to a set of values and neq queries outside of it are dropped
+#   - inside an OR, eq queries over the same field become one set membership test (in)
+#   - subtrees that never match, like an empty interval, are pruned
+# an always true subtree is written as {"AND": []} and an always false one as {"OR": []}
+# the operators written here that aren't in _relational_operators are in QueryFilter._optimizer_operators
+
+# range operator -> (low bound inclusive, high bound inclusive), None when there isn't that bound
+_range_bounds = {
+    'gt':     (False, None),
+    'gte':    (True,  None),
+    'lt':     (None,  False),
+    'lte':    (None,  True),
+    'btw':    (True,  True),
+    'gt_lt':  (False, False),
+    'gte_lt': (True,  False),
+    'gt_lte': (False, True),
+}
+
+# operators merged with the other queries over the same field
+_and_merged_operators = set(_range_bounds) | {'eq', 'in', 'neq'}
+_or_merged_operators  = {'eq', 'in'}
+
+def _is_leaf(query):
+    return "AND" not in query and "OR" not in query
+
+def _is_node(query, node):
+    return set(query) == {node}
+
+def _leaf(field, operator, values):
+    return {"field": field, "operator": operator, "value": values}
+
+def _set_leaf(field, values):
+    if len(values) == 1:
+        return _leaf(field, 'eq', list(values))
+    return _leaf(field, 'in', [frozenset(values)])
+
+def _get_values(query):
+    if query["operator"] == 'in':
+        return set(query["value"][0])
+    return {query["value"][0]}
+
+# children order doesn't matter, AND and OR give the same result with repeated children
+def _query_key(query):
+    if _is_leaf(query):
+        return (query["field"], query["operator"], tuple(query["value"]))
+    return tuple((node, frozenset(map(_query_key, query[node]))) for node in ('AND', 'OR') if node in query)
+
+# an interval is (low, high), each bound is (value, inclusive) or None when it's unbounded
+def _to_interval(query):
+    low_inclusive, high_inclusive = _range_bounds[query["operator"]]
+    values = iter(query["value"])
+
+    low  = (next(values), low_inclusive)  if low_inclusive  is not None else None
+    high = (next(values), high_inclusive) if high_inclusive is not None else None
+    return low, high
+
+def _tightest_bound(bound, other, is_tighter):
+    if bound is None:
+        return other
+    if other is None:
+        return bound
+    if bound[0] != other[0]:
+        return bound if is_tighter(bound[0], other[0]) else other
+    # same value, an exclusive bound is tighter
+    return bound[0], bound[1] and other[1]
+
+def _intersect(interval, other):
+    return (
+        _tightest_bound(interval[0], other[0], lambda value, other_value: value > other_value),
+        _tightest_bound(interval[1], other[1], lambda value, other_value: value < other_value),
+    )
+
+def _contains(interval, value):
+    low, high = interval
+    if low is not None and (value < low[0] or (value == low[0] and not low[1])):
+        return False
+    if high is not None and (value > high[0] or (value == high[0] and not high[1])):
+        return False
+    return True
+
+def _is_empty(interval):
+    low, high = interval
+    if low is None or high is None:
+        return False
+    return low[0] > high[0] or (low[0] == high[0] and not (low[1] and high[1]))
+
+def _from_interval(field, interval):
+    low, high = interval
+
+    if low is not None and high is not None and low[0] == high[0]:
+        return _leaf(field, 'eq', [low[0]])
+
+    bounds = (low[1] if low is not None else None, high[1] if high is not None else None)
+    for operator, operator_bounds in _range_bounds.items():
+        if operator_bounds == bounds:
+            return _leaf(field, operator, [bound[0] for bound in interval if bound is not None])
+
+# returns the leaves that replace the AND of the given leaves over a field, None when they never match
+def _merge_and_field(field, leaves):
+    interval = None
+    values = None
+    neq_values = []
+
+    for leaf in leaves:
+        operator = leaf["operator"]
+        if operator in _range_bounds:
+            interval = _to_interval(leaf) if interval is None else _intersect(interval, _to_interval(leaf))
+        elif operator == 'neq':
+            neq_values.append(leaf["value"][0])
+        else:
+            values = _get_values(leaf) if values is None else values & _get_values(leaf)
+
+    # a set of values already excludes None, so the interval and neq queries only remove values from it
+    if values is not None:
+        values = {
+            value for value in values
+            if (interval is None or _contains(interval, value)) and value not in neq_values
+        }
+        return [_set_leaf(field, values)] if values else None
+
+    merged = []
+    if interval is not None:
+        if _is_empty(interval):
+            return None
+        merged.append(_from_interval(field, interval))
+
+    # values outside of the interval are already different
+    merged.extend(
+        _leaf(field, 'neq', [value]) for value in neq_values
+        if interval is None or _contains(interval, value)
+    )
+    return merged
+
+def _merge_or_field(field, leaves):
+    return [_set_leaf(field, set().union(*map(_get_values, leaves)))]
+
+# leaves over the same field are merged in the position of the first one, the other children keep their order
+def _merge_leaves(children, merged_operators, merge_field):
+    positions = []
+    leaves_by_field = {}
+
+    for child in children:
+        if _is_leaf(child) and child["operator"] in merged_operators:
+            if child["field"] not in leaves_by_field:
+                positions.append(child["field"])
+            leaves_by_field.setdefault(child["field"], []).append(child)
+        else:
+            positions.append(child)
+
+    merged_children = []
+    for position in positions:
+        if isinstance(position, dict):
+            merged_children.append(position)
+            continue
+
+        leaves = leaves_by_field[position]
+        try:
+            merged = merge_field(position, leaves) if len(leaves) > 1 else leaves
+        except TypeError:
+            # values that can't be compared are kept as they are
+            merged = leaves
+
+        if merged is None:
+            return None
+        merged_children.extend(merged)
+
+    return merged_children
+
+def _optimize_node(node, children):
+    other_node = 'OR' if node == 'AND' else 'AND'
+
+    flat_children = []
+    for child in map(optimize_query, children):
+        if _is_node(child, node):
+            flat_children.extend(child[node])
+        else:
+            flat_children.append(child)
+
+    # an always false child makes an AND always false, an always true one makes an OR always true
+    if any(_is_node(child, other_node) and not child[other_node] for child in flat_children):
+        return {other_node: []}
+
+    unique_children = []
+    keys = set()
+    for child in flat_children:
+        key = _query_key(child)
+        if key not in keys:
+            keys.add(key)
+            unique_children.append(child)
+
+    if node == 'AND':
+        merged_children = _merge_leaves(unique_children, _and_merged_operators, _merge_and_field)
+    else:
+        merged_children = _merge_leaves(unique_children, _or_merged_operators, _merge_or_field)
+
+    if merged_children is None:
+        return {other_node: []}
+    if len(merged_children) == 1:
+        return merged_children[0]
+    return {node: merged_children}
+
+# returns a new query, the given one isn't changed (but leaves that weren't rewritten are shared)
+def optimize_query(query):
+    and_op = query.get("AND", None)
+    or_op  = query.get("OR",  None)
+
+    if and_op is None and or_op is None:
+        return query
+
+    # AND and OR in the same dict behave as (AND) or (OR)
+    if and_op is not None and or_op is not None:
+        return _optimize_node('OR', [{"AND": and_op}, {"OR": or_op}])
+    if and_op is not None:
+        return _optimize_node('AND', and_op)
+    return _optimize_node('OR', or_op)
@@ -0,0 +1,377 @@
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import datetime
+import decimal
+import importlib
+import json
+import multiprocessing
+import os
+import sys
+import time
+import warnings
+from query_filter import QueryFilter
+from typed_table import TypedTable
+from row_readers import iter_jsonl_rows, iter_csv_rows
+from columnar_query_filter import ColumnarTable, ColumnarQueryFilter
+from column_store import open_column_store
+
+# long running server that loads tables once and evaluates queries (in the README format) sent over a
+# unix or TCP socket. The protocol is one JSON document per line in both directions:
+#
+#   {"id": 1, "table": "people", "query": {"AND": [...]}, "mode": "rows", "limit": 50, "select": ["name"]}
+#   {"id": 1, "result": [...], "latency_ms": 1.2}
+#
+# modes are rows (with limit, offset, select, order_by and descending), row_ids (the same without select),
+# count, exists, estimate (the count estimated from the table statistics, without scanning) and stats
+# (the latency stats of the server, no table is needed)
+# connections are persistent and requests can be pipelined: many requests are sent without waiting, they
+# run concurrently and their responses are written in the order the requests were received
+# queries run in a process pool, with the fork start method the workers inherit the tables loaded
+# before the pool is started, so they share them read-only instead of keeping copies
+#
+#   python query_server.py --table people=people.jsonl --index people:age:sorted --unix /tmp/query.sock
+#
+# query_client.py has a client and a load generator
+
+modes = ('rows', 'row_ids', 'count', 'exists', 'estimate', 'stats')
+
+# request keys passed to run_query / run_query_row_ids
+_query_options = {
+    'rows':    ('limit', 'offset', 'select', 'order_by', 'descending'),
+    'row_ids': ('limit', 'offset', 'order_by', 'descending'),
+}
+
+# state of each worker process, filled once by _initialize_worker
+_worker_state = {}
+
+def _initialize_worker(tables):
+    _worker_state['tables'] = tables
+
+def _json_default(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    # numpy integers of columnar row ids
+    if hasattr(value, 'item'):
+        return value.item()
+    raise TypeError("Value of type {0} is not JSON serializable".format(type(value).__name__))
+
+# runs in a worker, the result is returned as JSON text so only a string goes back to the server
+def _execute_request(table_name, query, mode, options):
+    table, filter_class, indexes = _worker_state['tables'][table_name]
+
+    if isinstance(table, ColumnarTable):
+        query_filter = filter_class(query, table)
+    else:
+        query_filter = filter_class(query, table, indexes)
+
+    if mode == 'count':
+        result = query_filter.count()
+    elif mode == 'exists':
+        result = query_filter.exists()
+    elif mode == 'estimate':
+        result = query_filter.estimate_count()
+    elif mode == 'row_ids':
+        result = [int(row_id) for row_id in query_filter.run_query_row_ids(**options)]
+    else:
+        result = query_filter.run_query(**options)
+        if isinstance(table, TypedTable) and options.get('select') is None:
+            result = [table.as_dict(row) for row in result]
+
+    return json.dumps(result, default=_json_default)
+
+class LatencyStats:
+    # latencies of the last window requests of each mode, with counters since the server started
+    def __init__(self, window=10000):
+        self._window = window
+        self._latencies = {}
+        self._requests = collections.Counter()
+        self._errors = collections.Counter()
+
+    def record(self, mode, seconds, error=False):
+        if mode not in self._latencies:
+            self._latencies[mode] = collections.deque(maxlen=self._window)
+        self._latencies[mode].append(seconds)
+        self._requests[mode] += 1
+        if error:
+            self._errors[mode] += 1
+
+    @staticmethod
+    def _percentile(values, percentile):
+        index = max(0, int(round(percentile / 100 * len(values))) - 1)
+        return values[index] * 1000
+
+    def get_stats(self):
+        stats = {}
+        for mode, latencies in self._latencies.items():
+            values = sorted(latencies)
+            stats[mode] = {
+                'requests': self._requests[mode],
+                'errors':   self._errors[mode],
+                'mean_ms':  sum(values) / len(values) * 1000,
+                'p50_ms':   self._percentile(values, 50),
+                'p95_ms':   self._percentile(values, 95),
+                'p99_ms':   self._percentile(values, 99),
+                'max_ms':   values[-1] * 1000,
+            }
+        return stats
+
+class QueryServer:
+    # max_concurrency limits the requests evaluated at the same time (all connections), the others wait
+    # max_pipelined limits the requests of a connection that wait for their response, when it's reached
+    # the connection isn't read until the oldest response is written
+    def __init__(self, workers=None, max_concurrency=None, max_pipelined=64, mp_context=None, latency_window=10000):
+        if max_pipelined <= 0:
+            raise ValueError("max_pipelined must be greater than 0")
+
+        self._tables = {}
+        self._workers = workers or os.cpu_count() or 1
+        self._max_concurrency = max_concurrency or self._workers * 2
+        self._max_pipelined = max_pipelined
+        self._mp_context = mp_context
+        self._stats = LatencyStats(latency_window)
+        self._executor = None
+        self._semaphore = None
+        self._servers = []
+        self._in_flight = 0
+        self._connections = 0
+
+    # tables must be added before start, the workers only know the tables that exist when they're created
+    # queries over a ColumnarTable use ColumnarQueryFilter, and indexes are only used with row tables
+    def add_table(self, name, table, filter_class=None, indexes=None):
+        if self._executor is not None:
+            raise ValueError("Tables can't be added after the server is started")
+
+        if filter_class is None:
+            filter_class = ColumnarQueryFilter if isinstance(table, ColumnarTable) else QueryFilter
+        self._tables[name] = (table, filter_class, indexes if indexes is not None else {})
+
+    def get_stats(self):
+        return {
+            'tables':      {name: len(table) for name, (table, _, _) in self._tables.items()},
+            'connections': self._connections,
+            'in_flight':   self._in_flight,
+            'modes':       self._stats.get_stats(),
+        }
+
+    # forked workers get a copy of every open socket, a connection closed by the client would stay open in
+    # the workers started after it was accepted, so the workers are started before listening
+    async def _start_executor(self):
+        if self._executor is None:
+            self._executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self._workers,
+                mp_context=self._mp_context,
+                initializer=_initialize_worker,
+                initargs=(self._tables,)
+            )
+            self._semaphore = asyncio.Semaphore(self._max_concurrency)
+            await asyncio.get_running_loop().run_in_executor(self._executor, int)
+
+    # lines can be long, a query tree can have many thousands of nodes
+    _line_limit = 16 * 1024 * 1024
+
+    async def start_unix(self, path):
+        await self._start_executor()
+        self._servers.append(await asyncio.start_unix_server(self._handle_connection, path, limit=self._line_limit))
+
+    async def start_tcp(self, host='127.0.0.1', port=0):
+        await self._start_executor()
+        server = await asyncio.start_server(self._handle_connection, host, port, limit=self._line_limit)
+        self._servers.append(server)
+        return server.sockets[0].getsockname()[:2]
+
+    async def serve_forever(self):
+        await asyncio.gather(*(server.serve_forever() for server in self._servers))
+
+    async def close(self):
+        for server in self._servers:
+            server.close()
+            await server.wait_closed()
+        self._servers = []
+
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+    def _parse_request(self, request):
+        if not isinstance(request, dict):
+            raise ValueError("Request must be a JSON object")
+
+        mode = request.get('mode', 'rows')
+        if mode not in modes:
+            raise ValueError("Mode '{0}' is not supported".format(mode))
+        if mode == 'stats':
+            return mode, None, None, None
+
+        if request.get('table') not in self._tables:
+            raise ValueError("Table '{0}' is not loaded".format(request.get('table')))
+
+        options = {key: request[key] for key in _query_options.get(mode, ()) if key in request}
+        return mode, request['table'], request.get('query'), options
+
+    # returns the response line of a request line
+    async def _handle_line(self, line):
+        start = time.perf_counter()
+        response = {'id': None}
+        mode = 'invalid'
+
+        try:
+            request = json.loads(line)
+            if isinstance(request, dict):
+                response['id'] = request.get('id')
+
+            mode, table_name, query, options = self._parse_request(request)
+            if mode == 'stats':
+                result = json.dumps(self.get_stats())
+            else:
+                async with self._semaphore:
+                    self._in_flight += 1
+                    try:
+                        result = await asyncio.get_running_loop().run_in_executor(
+                            self._executor, _execute_request, table_name, query, mode, options
+                        )
+                    finally:
+                        self._in_flight -= 1
+        except Exception as e:
+            response['error'] = str(e) if isinstance(e, ValueError) else '{0}: {1}'.format(type(e).__name__, e)
+            result = None
+
+        seconds = time.perf_counter() - start
+        self._stats.record(mode, seconds, error=result is None)
+        response['latency_ms'] = seconds * 1000
+
+        # the result is already JSON text, made by the worker
+        text = json.dumps(response)
+        if result is None:
+            return text
+        return '{0}, "result": {1}}}'.format(text[:-1], result)
+
+    async def _write_responses(self, responses, writer):
+        while True:
+            response = await responses.get()
+            if response is None:
+                return
+
+            try:
+                writer.write((await response).encode() + b'\n')
+                await writer.drain()
+            except ConnectionError:
+                # the client is gone, the remaining requests are still awaited so they finish
+                pass
+
+    async def _handle_connection(self, reader, writer):
+        self._connections += 1
+        # response tasks in request order, the queue size is the pipelining limit
+        responses = asyncio.Queue(self._max_pipelined)
+        writer_task = asyncio.create_task(self._write_responses(responses, writer))
+
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except (ConnectionError, ValueError):
+                    # ValueError when the line is longer than the limit
+                    break
+                if not line:
+                    break
+                if line.strip():
+                    await responses.put(asyncio.ensure_future(self._handle_line(line)))
+        finally:
+            await responses.put(None)
+            await writer_task
+            self._connections -= 1
+            writer.close()
+
+def _import_filter_class(path):
+    module_name, _, class_name = path.partition(':')
+    return getattr(importlib.import_module(module_name), class_name)
+
+# a directory is a column store, other files are JSONL or CSV (by the extension) converted to a TypedTable
+# both have the column statistics used by the estimate mode, column stores read them from the store
+def load_table(path, filter_class=QueryFilter):
+    if os.path.isdir(path):
+        return open_column_store(path)
+
+    rows = iter_csv_rows(path) if path.endswith('.csv') else iter_jsonl_rows(path)
+    return filter_class(None, None).ingest(rows)
+
+# workers only share the tables read-only with the fork start method, with spawn or forkserver (the default
+# on some platforms and python versions) every worker unpickles its own copy of every table
+def _get_fork_context():
+    if 'fork' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('fork')
+
+    warnings.warn("The fork start method isn't available, every worker will load its own copy of the tables")
+    return None
+
+def _parse_table(value):
+    name, separator, path = value.partition('=')
+    if not separator or not name or not path:
+        raise argparse.ArgumentTypeError("Table must be NAME=PATH")
+    return name, path
+
+def _parse_index(value):
+    parts = value.split(':')
+    if len(parts) != 3:
+        raise argparse.ArgumentTypeError("Index must be TABLE:COLUMN:KIND")
+    return tuple(parts)
+
+async def _serve(server, args):
+    if args.unix:
+        await server.start_unix(args.unix)
+        print("Listening on {0}".format(args.unix), flush=True)
+    else:
+        host, port = await server.start_tcp(args.host, args.port)
+        print("Listening on {0}:{1}".format(host, port), flush=True)
+
+    try:
+        await server.serve_forever()
+    finally:
+        await server.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Query server over a unix or TCP socket")
+    parser.add_argument('--table', type=_parse_table, action='append', required=True,
+                        help="NAME=PATH, a JSONL or CSV file or a column store directory")
+    parser.add_argument('--index', type=_parse_index, action='append', default=[], help="TABLE:COLUMN:KIND")
+    parser.add_argument('--filter-class', default='query_filter:QueryFilter', help="MODULE:CLASS used with row tables")
+    parser.add_argument('--unix', help="unix socket path, TCP is used without it")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=7878)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--max-concurrency', type=int, default=None)
+    parser.add_argument('--max-pipelined', type=int, default=64)
+    args = parser.parse_args(argv)
+
+    filter_class = _import_filter_class(args.filter_class)
+    server = QueryServer(args.workers, args.max_concurrency, args.max_pipelined, mp_context=_get_fork_context())
+
+    tables = {}
+    for name, path in args.table:
+        tables[name] = load_table(path, filter_class)
+
+    for name, _, _ in args.index:
+        if name not in tables:
+            parser.error("Table '{0}' is not loaded".format(name))
+        if isinstance(tables[name], ColumnarTable):
+            parser.error("Indexes are only used with row tables")
+
+    for name, table in tables.items():
+        indexes = {}
+        builder = filter_class(None, table, indexes)
+        for index_name, column, kind in args.index:
+            if index_name == name:
+                builder.build_index(column, kind)
+        server.add_table(name, table, None if isinstance(table, ColumnarTable) else filter_class, indexes)
+
+    try:
+        asyncio.run(_serve(server, args))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
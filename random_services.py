@@ -3,12 +3,17 @@ import datetime
 import calendar
 
 class RandomService:
-    def __init__(self, seed=None):
+    # generator is a random.Random, by default the global one of the random module
+    def __init__(self, seed=None, generator=None):
+        self._generator = generator if generator is not None else random
         if seed:
-            random.seed(seed)
+            self._generator.seed(seed)
 
     def get_random_intenger_between(self, min, max):
-        return random.randint(min, max)
+        return self._generator.randint(min, max)
+
+    def get_random_choice(self, values):
+        return self._generator.choice(values)
 
     def get_random_string(self, min, max):
         alphabet = "abcdefghijklmnopqrstuvwxyz"
@@ -17,7 +22,7 @@ class RandomService:
         len = self.get_random_intenger_between(min, max)
 
         for _ in range(len):
-            ret.append(random.choice(alphabet))
+            ret.append(self.get_random_choice(alphabet))
 
         return "".join(ret)
     
@@ -61,6 +66,6 @@ class RandomService:
     
     def get_random_decimal_between(self, min, max):
         integer = self.get_random_intenger_between(min, max)
-        return integer + random.random()
+        return integer + self._generator.random()
     
 random_service = RandomService()
\ No newline at end of file
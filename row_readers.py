@@ -0,0 +1,40 @@
+import csv
+import itertools
+import json
+
+# lazy row sources for QueryFilter.iter_query, only one row (or one chunk) is kept in memory at a time
+# values are yielded as they are in the file, use convert_rows=True to convert them to the table types
+
+def iter_jsonl_rows(path, encoding='utf-8'):
+    with open(path, encoding=encoding) as file:
+        for line_number, line in enumerate(file, start=1):
+            line = line.strip()
+            if not line:
+                continue
+
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError("Invalid JSON in line {0} of '{1}': {2}".format(line_number, path, e))
+
+def iter_csv_rows(path, encoding='utf-8', **csv_options):
+    with open(path, encoding=encoding, newline='') as file:
+        yield from csv.DictReader(file, **csv_options)
+
+# groups any iterable of rows in lists of at most chunk_size rows
+def iter_chunks(rows, chunk_size=10000):
+    if chunk_size <= 0:
+        raise ValueError("chunk_size must be greater than 0")
+
+    rows = iter(rows)
+    while True:
+        chunk = list(itertools.islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+def iter_jsonl_chunks(path, chunk_size=10000, encoding='utf-8'):
+    return iter_chunks(iter_jsonl_rows(path, encoding), chunk_size)
+
+def iter_csv_chunks(path, chunk_size=10000, encoding='utf-8', **csv_options):
+    return iter_chunks(iter_csv_rows(path, encoding, **csv_options), chunk_size)
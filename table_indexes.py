@@ -0,0 +1,247 @@
+import bisect
+import itertools
+
+# secondary indexes over one table column
+# every index receives the column values ordered by row id (None values are never indexed,
+# because None never matches any relational operator) and answers lookups with a set of row ids
+# lookups receive the normalized query values, as in _relational_operators methods
+
+# bitmaps are python ints used as bitsets, bit i is set when row i is in the bitmap
+_bit_values = bytes.maketrans(b'01', b'\x00\x01')
+
+# row ids of the set bits, in ascending order
+def bitmap_row_ids(bitmap):
+    bits = bin(bitmap)[:1:-1].encode().translate(_bit_values)
+    return list(itertools.compress(range(len(bits)), bits))
+
+def row_ids_bitmap(row_ids):
+    if not row_ids:
+        return 0
+
+    bits = bytearray(b'0') * (max(row_ids) + 1)
+    for row_id in row_ids:
+        bits[row_id] = ord('1')
+    bits.reverse()
+    return int(bits, 2)
+
+class TableIndex:
+    # operators that the index is able to answer, should be overrided by subclasses
+    supported_operators = ()
+
+    def supports(self, operator_name):
+        return operator_name in self.supported_operators
+
+    def lookup(self, operator_name, query_value):
+        raise NotImplementedError
+
+class SortedIndex(TableIndex):
+    # value-sorted keys with their row ids, range operators become two bisect calls
+    supported_operators = ('gt', 'gte', 'lt', 'lte', 'btw', 'eq', 'gt_lt', 'gte_lt', 'gt_lte', 'in')
+
+    def __init__(self, values):
+        pairs = sorted((value, row_id) for row_id, value in enumerate(values) if value is not None)
+        self._keys    = [value  for value, _ in pairs]
+        self._row_ids = [row_id for _, row_id in pairs]
+
+    # [start, end) positions in the sorted keys
+    def _range(self, operator_name, query_value):
+        keys = self._keys
+
+        if operator_name == 'gt':
+            return bisect.bisect_right(keys, query_value[0]), len(keys)
+        if operator_name == 'gte':
+            return bisect.bisect_left(keys, query_value[0]), len(keys)
+        if operator_name == 'lt':
+            return 0, bisect.bisect_left(keys, query_value[0])
+        if operator_name == 'lte':
+            return 0, bisect.bisect_right(keys, query_value[0])
+        if operator_name == 'btw':
+            return bisect.bisect_left(keys, query_value[0]), bisect.bisect_right(keys, query_value[1])
+        if operator_name == 'eq':
+            return bisect.bisect_left(keys, query_value[0]), bisect.bisect_right(keys, query_value[0])
+        if operator_name == 'gt_lt':
+            return bisect.bisect_right(keys, query_value[0]), bisect.bisect_left(keys, query_value[1])
+        if operator_name == 'gte_lt':
+            return bisect.bisect_left(keys, query_value[0]), bisect.bisect_left(keys, query_value[1])
+        if operator_name == 'gt_lte':
+            return bisect.bisect_right(keys, query_value[0]), bisect.bisect_right(keys, query_value[1])
+        raise ValueError("Operator '{0}' is not supported by {1}".format(operator_name, type(self).__name__))
+
+    # row ids ordered by value, rows with the same value in row id order
+    def iter_row_ids(self, descending=False):
+        if not descending:
+            return iter(self._row_ids)
+        return self._iter_row_ids_descending()
+
+    def _iter_row_ids_descending(self):
+        end = len(self._keys)
+        while end > 0:
+            start = bisect.bisect_left(self._keys, self._keys[end - 1], 0, end)
+            yield from self._row_ids[start:end]
+            end = start
+
+    def lookup(self, operator_name, query_value):
+        # "in" is one eq range for each value
+        if operator_name == 'in':
+            return set().union(*(self.lookup('eq', [value]) for value in query_value[0]))
+
+        start, end = self._range(operator_name, query_value)
+        return set(self._row_ids[start:end])
+
+class HashIndex(TableIndex):
+    supported_operators = ('eq', 'neq', 'in')
+
+    def __init__(self, values):
+        self._row_ids_by_value = {}
+        self._non_null_row_ids = set()
+
+        for row_id, value in enumerate(values):
+            if value is None:
+                continue
+            self._row_ids_by_value.setdefault(value, set()).add(row_id)
+            self._non_null_row_ids.add(row_id)
+
+    def lookup(self, operator_name, query_value):
+        if operator_name == 'in':
+            return set().union(*(self._row_ids_by_value.get(value, set()) for value in query_value[0]))
+
+        row_ids = self._row_ids_by_value.get(query_value[0], set())
+
+        if operator_name == 'eq':
+            return set(row_ids)
+        if operator_name == 'neq':
+            return self._non_null_row_ids - row_ids
+        raise ValueError("Operator '{0}' is not supported by {1}".format(operator_name, type(self).__name__))
+
+class BitmapIndex(TableIndex):
+    # one bitmap for each distinct value, meant for low cardinality columns like booleans or status codes
+    # any comparison is answered by OR-ing the bitmaps of the distinct values that pass it, and the
+    # query planner combines the bitmaps of AND/OR children with & and |, before any row id is listed
+    supported_operators = ('eq', 'neq', 'in', 'gt', 'gte', 'lt', 'lte', 'btw', 'gt_lt', 'gte_lt', 'gt_lte')
+
+    # can be overrided by subclasses, a bitmap costs one bit per table row
+    max_distinct_values = 1024
+
+    _comparisons = {
+        'neq':    lambda value, query_value: value != query_value[0],
+        'gt':     lambda value, query_value: value > query_value[0],
+        'gte':    lambda value, query_value: value >= query_value[0],
+        'lt':     lambda value, query_value: value < query_value[0],
+        'lte':    lambda value, query_value: value <= query_value[0],
+        'btw':    lambda value, query_value: query_value[0] <= value <= query_value[1],
+        'gt_lt':  lambda value, query_value: query_value[0] < value < query_value[1],
+        'gte_lt': lambda value, query_value: query_value[0] <= value < query_value[1],
+        'gt_lte': lambda value, query_value: query_value[0] < value <= query_value[1],
+    }
+
+    def __init__(self, values):
+        row_ids_by_value = {}
+
+        for row_id, value in enumerate(values):
+            if value is None:
+                continue
+            row_ids_by_value.setdefault(value, []).append(row_id)
+            if len(row_ids_by_value) > self.max_distinct_values:
+                raise ValueError("Column has more than {0} distinct values, too many for {1}".format(self.max_distinct_values, type(self).__name__))
+
+        self._bitmaps = {value: row_ids_bitmap(row_ids) for value, row_ids in row_ids_by_value.items()}
+
+    def lookup_bitmap(self, operator_name, query_value):
+        if operator_name == 'eq':
+            return self._bitmaps.get(query_value[0], 0)
+        if operator_name == 'in':
+            bitmaps = (self._bitmaps.get(value, 0) for value in query_value[0])
+        elif operator_name in self._comparisons:
+            comparison = self._comparisons[operator_name]
+            bitmaps = (bitmap for value, bitmap in self._bitmaps.items() if comparison(value, query_value))
+        else:
+            raise ValueError("Operator '{0}' is not supported by {1}".format(operator_name, type(self).__name__))
+
+        result = 0
+        for bitmap in bitmaps:
+            result |= bitmap
+        return result
+
+    def lookup(self, operator_name, query_value):
+        return set(bitmap_row_ids(self.lookup_bitmap(operator_name, query_value)))
+
+# string indexes answer the only_string operators, so values are indexed as str(value),
+# the same conversion made by the operator methods
+class PrefixIndex(TableIndex):
+    # sorted strings, every string starting with a prefix is in a contiguous range
+    supported_operators = ('sw',)
+
+    def __init__(self, values):
+        pairs = sorted((self._key(str(value)), row_id) for row_id, value in enumerate(values) if value is not None)
+        self._keys    = [key    for key, _ in pairs]
+        self._row_ids = [row_id for _, row_id in pairs]
+
+    @staticmethod
+    def _key(string):
+        return string
+
+    def lookup(self, operator_name, query_value):
+        if not self.supports(operator_name):
+            raise ValueError("Operator '{0}' is not supported by {1}".format(operator_name, type(self).__name__))
+
+        prefix = self._key(query_value[0])
+        row_ids = set()
+
+        position = bisect.bisect_left(self._keys, prefix)
+        while position < len(self._keys) and self._keys[position].startswith(prefix):
+            row_ids.add(self._row_ids[position])
+            position += 1
+        return row_ids
+
+class SuffixIndex(PrefixIndex):
+    # a suffix of a string is a prefix of the reversed string
+    supported_operators = ('ew',)
+
+    @staticmethod
+    def _key(string):
+        return string[::-1]
+
+class TrigramIndex(TableIndex):
+    # inverted index from every 3 characters substring to the row ids that contain it
+    # it's lossy (all trigrams present doesn't mean the whole string is present), so candidates are verified
+    supported_operators = ('ct', 'nct')
+
+    _gram_size = 3
+
+    def __init__(self, values):
+        self._strings = {}
+        self._row_ids_by_gram = {}
+
+        for row_id, value in enumerate(values):
+            if value is None:
+                continue
+            string = str(value)
+            self._strings[row_id] = string
+            for gram in self._grams(string):
+                self._row_ids_by_gram.setdefault(gram, set()).add(row_id)
+
+    def _grams(self, string):
+        return {string[i:i + self._gram_size] for i in range(len(string) - self._gram_size + 1)}
+
+    def _contains(self, substring):
+        grams = self._grams(substring)
+
+        # substrings smaller than a gram can't use the inverted index
+        if not grams:
+            candidates = self._strings.keys()
+        else:
+            # the rarest grams first, so the intersection shrinks as soon as possible
+            postings = sorted((self._row_ids_by_gram.get(gram, set()) for gram in grams), key=len)
+            candidates = set(postings[0]).intersection(*postings[1:])
+
+        strings = self._strings
+        return {row_id for row_id in candidates if substring in strings[row_id]}
+
+    def lookup(self, operator_name, query_value):
+        row_ids = self._contains(query_value[0])
+
+        if operator_name == 'ct':
+            return row_ids
+        if operator_name == 'nct':
+            return self._strings.keys() - row_ids
+        raise ValueError("Operator '{0}' is not supported by {1}".format(operator_name, type(self).__name__))
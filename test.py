@@ -50,7 +50,7 @@ generate_random_query.show_as_json(query)
 start_time = time.time()
 
 # run query
-query_result = qf.NestedQueryFilter(query, table).run_query()
+query_result = qf.QueryFilter(query, table).run_query()
 # run hardcoded comparison
 real_result  = filter_table_from_hardcoded_comparison(table)
 
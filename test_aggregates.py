@@ -0,0 +1,120 @@
+import copy
+import math
+import random
+import random_table
+from query_filter import QueryFilter
+from columnar_query_filter import ColumnarTable, ColumnarQueryFilter, np
+from benchmark import reference_row_ids
+
+# checks of QueryFilter.aggregate and ColumnarQueryFilter.aggregate against aggregates folded by hand
+#
+#   python test_aggregates.py
+#
+# also collected by pytest
+
+aggregates = {
+    'rows':     ('count', None),
+    'ages':     ('count', 'age'),
+    'born':     ('count', 'birth_day'),
+    'total':    ('sum', 'height'),
+    'posts':    ('sum', 'posted'),
+    'youngest': ('min', 'age'),
+    'last':     ('max', 'birth_day'),
+    'first':    ('min', 'name'),
+    'average':  ('avg', 'age'),
+}
+
+queries = [
+    {'AND': [{'field': 'age', 'operator': 'lt', 'value': ['400']}]},
+    {'OR':  [{'field': 'name', 'operator': 'sw', 'value': ['a']}, {'field': 'height', 'operator': 'gt', 'value': ['950']}]},
+    # no matching row
+    {'AND': [{'field': 'age', 'operator': 'gt', 'value': ['5000']}]},
+]
+
+def _create_rows():
+    random.seed(42)
+    rows = random_table.create_random_table(1000)
+    for row in rows:
+        if random.random() < 0.2:
+            row['birth_day'] = None
+        row['posted'] = random.random() < 0.5
+    return rows
+
+# same rules of aggregates: None values are skipped, sum of no values is 0 and the others are None
+def _aggregate_by_hand(rows):
+    result = {}
+    for name, (function, field) in aggregates.items():
+        values = [1 if field is None else row[field] for row in rows]
+        values = [value for value in values if value is not None]
+
+        if function == 'count':
+            result[name] = len(values)
+        elif function == 'sum':
+            result[name] = sum(values)
+        elif function == 'avg':
+            result[name] = sum(values) / len(values) if values else None
+        else:
+            result[name] = (min if function == 'min' else max)(values) if values else None
+    return result
+
+def _assert_equal(result, expected, context):
+    assert result.keys() == expected.keys(), context
+    for name, value in expected.items():
+        # sums of no float values may be 0 or 0.0
+        if isinstance(value, (int, float)) and not isinstance(value, bool) and type(value) != type(result[name]):
+            assert value == 0 and result[name] == 0, (context, name, result[name], value)
+        elif isinstance(value, float):
+            assert math.isclose(result[name], value, rel_tol=1e-9), (context, name)
+        else:
+            assert result[name] == value and type(result[name]) == type(value), (context, name, result[name], value)
+
+def _get_filters(query, rows):
+    filters = {
+        'rows':  QueryFilter(copy.deepcopy(query), rows),
+        'typed': QueryFilter(copy.deepcopy(query), QueryFilter(None, None).ingest(rows, collect_statistics=False)),
+    }
+    if np is not None:
+        columnar_table = ColumnarTable.from_rows(rows, QueryFilter(None, None)._table_column_types)
+        filters['columnar'] = ColumnarQueryFilter(copy.deepcopy(query), columnar_table)
+    return filters
+
+def test_aggregates():
+    rows = _create_rows()
+
+    for query in queries:
+        matching_rows = [rows[row_id] for row_id in reference_row_ids(query, rows)]
+        for name, query_filter in _get_filters(query, rows).items():
+            _assert_equal(query_filter.aggregate(aggregates), _aggregate_by_hand(matching_rows), (name, query))
+
+def test_group_by():
+    rows = _create_rows()
+    query = queries[0]
+    matching_rows = [rows[row_id] for row_id in reference_row_ids(query, rows)]
+
+    for name, query_filter in _get_filters(query, rows).items():
+        result = query_filter.aggregate(aggregates, group_by='posted')
+        assert sorted(result) == [False, True], name
+        for posted, group in result.items():
+            _assert_equal(group, _aggregate_by_hand([row for row in matching_rows if row['posted'] == posted]), (name, posted))
+
+def test_invalid_aggregates():
+    query_filter = QueryFilter(copy.deepcopy(queries[0]), _create_rows())
+
+    for invalid_aggregates, group_by in (({}, None),
+                                         ({'x': ('median', 'age')}, None),
+                                         ({'x': ('sum', None)}, None),
+                                         ({'x': ('sum', 'name')}, None),
+                                         ({'x': ('min', 'unknown')}, None),
+                                         ({'x': ('count', None)}, 'unknown')):
+        try:
+            query_filter.aggregate(invalid_aggregates, group_by)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("invalid aggregates were accepted: {0}".format(invalid_aggregates))
+
+if __name__ == '__main__':
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print(name, 'ok')
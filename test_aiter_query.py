@@ -0,0 +1,90 @@
+import asyncio
+import concurrent.futures
+import copy
+import multiprocessing
+import random
+import random_table
+from query_filter import QueryFilter
+from benchmark import reference_row_ids
+
+# checks of QueryFilter.aiter_query over async batch sources
+#
+#   python test_aiter_query.py
+#
+# also collected by pytest
+
+query = {'OR': [{'field': 'age', 'operator': 'lt', 'value': ['200']}, {'field': 'name', 'operator': 'sw', 'value': ['b']}]}
+
+def _create_rows():
+    random.seed(42)
+    return random_table.create_random_table(1000)
+
+# batches of batch_size rows, read records how many batches were read
+async def _iter_batches(rows, batch_size, read=None):
+    for start in range(0, len(rows), batch_size):
+        await asyncio.sleep(0)
+        if read is not None:
+            read.append(start)
+        yield rows[start:start + batch_size]
+
+async def _collect(query_filter, batches, **options):
+    return [row async for row in query_filter.aiter_query(batches, **options)]
+
+def test_matches_evaluate():
+    rows = _create_rows()
+    expected = [rows[row_id] for row_id in reference_row_ids(query, rows)]
+
+    # filtered in the loop, in the default executor and in a typed filter table (batches are dict rows anyway)
+    for options in ({}, {'offload_threshold': 1}):
+        assert asyncio.run(_collect(QueryFilter(copy.deepcopy(query), None), _iter_batches(rows, 64), **options)) == expected
+    typed_table = QueryFilter(None, None).ingest(rows, collect_statistics=False)
+    assert asyncio.run(_collect(QueryFilter(copy.deepcopy(query), typed_table), _iter_batches(rows, 64))) == expected
+
+def test_process_pool_executor():
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        return
+    rows = _create_rows()
+    expected = [rows[row_id] for row_id in reference_row_ids(query, rows)]
+
+    with concurrent.futures.ProcessPoolExecutor(2, mp_context=multiprocessing.get_context('fork')) as executor:
+        matches = asyncio.run(_collect(QueryFilter(copy.deepcopy(query), None), _iter_batches(rows, 300), executor=executor, offload_threshold=1))
+    assert matches == expected
+
+def test_convert_rows():
+    rows = _create_rows()
+    raw_rows = [{column: str(value) for column, value in row.items()} for row in rows]
+
+    matches = asyncio.run(_collect(QueryFilter(copy.deepcopy(query), None), _iter_batches(raw_rows, 64), convert_rows=True))
+    assert matches == [rows[row_id] for row_id in reference_row_ids(query, rows)]
+
+def test_closing_stops_the_reading():
+    rows = _create_rows()
+    read = []
+
+    async def take_first():
+        matches = QueryFilter(copy.deepcopy(query), None).aiter_query(_iter_batches(rows, 10, read), max_pending_batches=1)
+        first = await matches.__anext__()
+        await matches.aclose()
+        return first
+
+    assert asyncio.run(take_first()) == rows[reference_row_ids(query, rows)[0]]
+    # the first batch, the one waiting in the queue and the one blocked on it at most
+    assert len(read) <= 3
+
+def test_errors_of_the_source_are_raised():
+    async def failing_batches():
+        yield _create_rows()[:10]
+        raise ConnectionError("source closed")
+
+    try:
+        asyncio.run(_collect(QueryFilter(copy.deepcopy(query), None), failing_batches()))
+    except ConnectionError:
+        pass
+    else:
+        raise AssertionError("the error of the source was lost")
+
+if __name__ == '__main__':
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print(name, 'ok')
@@ -0,0 +1,59 @@
+import random
+import random_table
+from query_filter import QueryFilter
+from query_explain import explain
+from benchmark import reference_row_ids
+
+# checks of the planning with column statistics (see column_statistics)
+#
+#   python test_column_statistics.py
+#
+# also collected by pytest
+
+def _create_table():
+    random.seed(42)
+    table = QueryFilter(None, None).ingest(random_table.create_random_table(2000))
+
+    builder = QueryFilter(None, table)
+    builder.build_index('age', 'sorted')
+    builder.build_index('height', 'sorted')
+    return table, builder.get_indexes()
+
+def _relational(field, operator, value):
+    return {'field': field, 'operator': operator, 'value': [value]}
+
+def test_unselective_leaf_is_scanned():
+    table, indexes = _create_table()
+
+    # ages are uniform between 1 and 1000
+    for query, scanned in (({'AND': [_relational('age', 'gt', '2'), _relational('name', 'ct', 'a')]}, True),
+                           ({'OR':  [_relational('age', 'gt', '2'), _relational('age', 'lt', '1')]}, True),
+                           ({'AND': [_relational('age', 'gt', '2')]}, True),
+                           ({'AND': [_relational('age', 'lt', '50'), _relational('name', 'ct', 'a')]}, False)):
+        query_filter = QueryFilter(query, table, indexes)
+        query_filter.compile_query()
+
+        row_ids, _ = query_filter._plan(query_filter._get_query())
+        assert (row_ids is None) == scanned, query
+        assert query_filter.run_query_row_ids() == reference_row_ids(query, table)
+
+def test_explain_shows_unselective_leaf():
+    table, indexes = _create_table()
+    plan = explain(QueryFilter({'AND': [_relational('age', 'gt', '2'), _relational('height', 'lt', '10')]}, table, indexes))
+
+    accesses = {child['field']: child['access'] for child in plan['tree']['children']}
+    assert accesses == {'age': 'scan (unselective index)', 'height': 'index'}
+
+def test_without_statistics_the_index_is_used():
+    table, indexes = _create_table()
+    table.statistics = None
+
+    query_filter = QueryFilter({'AND': [_relational('age', 'gt', '2')]}, table, indexes)
+    query_filter.compile_query()
+    assert query_filter._plan(query_filter._get_query())[0] is not None
+
+if __name__ == '__main__':
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print(name, 'ok')
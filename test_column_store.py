@@ -0,0 +1,110 @@
+import copy
+import json
+import os
+import random
+import tempfile
+import random_table
+from query_filter import QueryFilter
+from columnar_query_filter import ColumnarTable, ColumnarQueryFilter
+from column_store import write_column_store, open_column_store
+from benchmark import reference_row_ids
+
+# round trip checks of the column store (see column_store)
+#
+#   python test_column_store.py
+#
+# also collected by pytest
+
+def _create_rows():
+    random.seed(42)
+    rows = random_table.create_random_table(1000)
+
+    # a null date column and a string column with few distinct values, saved dictionary encoded
+    for row in rows:
+        if random.random() < 0.2:
+            row['birth_day'] = None
+        row['posted'] = random.random() < 0.5
+    for row in rows[:900]:
+        row['name'] = random.choice(['ana', 'bob', 'carl'])
+    return rows
+
+def _create_table(rows):
+    return ColumnarTable.from_rows(rows, QueryFilter(None, None)._table_column_types, dictionary_encoding=False)
+
+queries = [
+    {'AND': [{'field': 'age', 'operator': 'gt', 'value': ['300']}, {'field': 'name', 'operator': 'sw', 'value': ['a']}]},
+    {'OR':  [{'field': 'birth_day', 'operator': 'lt', 'value': ['1990-01-01']}, {'field': 'posted', 'operator': 'eq', 'value': ['1']}]},
+    {'AND': [{'field': 'name', 'operator': 'ct', 'value': ['o']}, {'field': 'height', 'operator': 'btw', 'value': ['100', '500']}]},
+]
+
+def test_round_trip():
+    rows = _create_rows()
+    table = _create_table(rows)
+
+    for dictionary_encoding in (True, False):
+        with tempfile.TemporaryDirectory() as path:
+            write_column_store(path, table, dictionary_encoding)
+            stored_table = open_column_store(path)
+
+            assert len(stored_table) == len(table)
+            for column, column_type in table.get_column_types().items():
+                stored_type = stored_table.get_column_types()[column]
+                assert (stored_type['type'], stored_type['nullable']) == (column_type['type'], column_type['nullable'])
+            assert (stored_table.get_dictionary('name') is not None) == dictionary_encoding
+            for column in table.get_column_types():
+                assert stored_table.get_python_values(column) == table.get_python_values(column), column
+
+            for query in queries:
+                row_ids = ColumnarQueryFilter(copy.deepcopy(query), stored_table).run_query_row_ids().tolist()
+                assert row_ids == reference_row_ids(query, rows), query
+
+def test_statistics_are_saved():
+    table = _create_table(_create_rows())
+    table.statistics = None
+
+    with tempfile.TemporaryDirectory() as path:
+        # collected while writing when the table has none
+        write_column_store(path, table, dictionary_encoding=False)
+        stored_table = open_column_store(path)
+
+        # the string column wasn't read to get them
+        assert 'name' in stored_table._column_loaders
+
+        table.statistics = ColumnarQueryFilter(None, table).collect_statistics()
+        for column, column_statistics in table.statistics.columns.items():
+            assert vars(stored_table.statistics.columns[column]) == vars(column_statistics), column
+        for query in queries:
+            assert ColumnarQueryFilter(copy.deepcopy(query), stored_table).estimate_count() == \
+                   ColumnarQueryFilter(copy.deepcopy(query), table).estimate_count()
+
+def test_empty_table():
+    with tempfile.TemporaryDirectory() as path:
+        write_column_store(path, _create_table([]))
+        stored_table = open_column_store(path)
+
+        assert len(stored_table) == 0
+        assert ColumnarQueryFilter(copy.deepcopy(queries[0]), stored_table).run_query_row_ids().tolist() == []
+
+def test_other_format_version_is_rejected():
+    with tempfile.TemporaryDirectory() as path:
+        write_column_store(path, _create_table(_create_rows()))
+
+        header_path = os.path.join(path, 'header.json')
+        with open(header_path) as file:
+            header = json.load(file)
+        header['format_version'] += 1
+        with open(header_path, 'w') as file:
+            json.dump(header, file)
+
+        try:
+            open_column_store(path)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("a store of another format version was opened")
+
+if __name__ == '__main__':
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print(name, 'ok')
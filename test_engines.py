@@ -0,0 +1,215 @@
+import copy
+import multiprocessing
+import random
+import sys
+import generate_random_query
+import random_table
+from query_filter import QueryFilter
+from typed_table import TypedTable
+from batch_query_filter import BatchQueryFilter
+from columnar_query_filter import ColumnarTable, ColumnarQueryFilter, np
+from parallel_query_filter import ParallelQueryFilter, ParallelScanPool
+from benchmark import reference_row_ids
+
+# differential test of the engines: every engine runs the same queries (random trees and hand written
+# edge cases) and must return the row ids of the interpreted evaluator (_evaluate over the normalized
+# query, without the optimizer, indexes or caches)
+#
+#   python test_engines.py
+#
+# estimate_count is checked against the real counts too, see check_estimates
+#
+# it's also collected by pytest, through test_engines_match_evaluate and test_estimates
+
+def create_table(size):
+    table = random_table.create_random_table(size)
+
+    # null dates (nullable column) and the boolean column, that random_table doesn't have
+    for row in table:
+        if random.random() < 0.15:
+            row['birth_day'] = None
+        row['posted'] = random.random() < 0.3
+    return table
+
+def _relational(field, operator, *values):
+    return {'field': field, 'operator': operator, 'value': list(values)}
+
+# queries that exercise the rewrites of the optimizer and the corner cases of the planners
+edge_case_queries = [
+    # empty intervals, pruned by the optimizer
+    {'AND': [_relational('age', 'gt', '500'), _relational('age', 'lt', '100')]},
+    {'AND': [_relational('age', 'gte', '300'), _relational('age', 'lte', '300')]},
+    {'AND': [_relational('height', 'btw', '700', '200')]},
+    {'OR': [{'AND': [_relational('age', 'gt', '900'), _relational('age', 'lte', '900')]}, _relational('age', 'eq', '7')]},
+    # merged ranges and equalities over the same field
+    {'AND': [_relational('age', 'gt', '100'), _relational('age', 'lte', '400'), _relational('age', 'gte', '150'), _relational('age', 'lt', '390')]},
+    {'AND': [_relational('age', 'eq', '10'), _relational('age', 'neq', '10')]},
+    {'AND': [_relational('age', 'eq', '10'), _relational('age', 'btw', '5', '20')]},
+    {'OR': [_relational('age', 'eq', '10'), _relational('age', 'eq', '20'), _relational('age', 'eq', '10'), _relational('name', 'sw', 'a')]},
+    # neq and ranges over a nullable column, None never matches
+    {'AND': [_relational('birth_day', 'neq', '2000-01-01')]},
+    {'OR': [_relational('birth_day', 'lt', '1990-01-01'), _relational('birth_day', 'gte', '1990-01-01')]},
+    {'AND': [_relational('birth_day', 'nct', 'zzz')]},
+    # booleans, answered by bitmap indexes
+    {'AND': [_relational('posted', 'eq', '1'), _relational('age', 'lt', '500')]},
+    {'OR': [_relational('posted', 'neq', '1'), _relational('posted', 'eq', '1')]},
+    # AND and OR in the same dict behave as (AND) or (OR)
+    {'AND': [_relational('age', 'lt', '100')], 'OR': [_relational('height', 'gt', '900'), _relational('name', 'ct', 'ab')]},
+    {'AND': [{'AND': [_relational('age', 'gt', '10')], 'OR': [_relational('age', 'lt', '5')]}, _relational('posted', 'eq', '0')]},
+    # an empty AND is always true and an empty OR is always false
+    {'AND': [{'AND': []}, _relational('age', 'lt', '50')]},
+    {'OR': [{'OR': []}, _relational('age', 'lt', '50')]},
+    {'AND': [{'OR': []}]},
+    # nested trees that are flattened
+    {'AND': [{'AND': [{'AND': [_relational('age', 'gt', '100')]}, _relational('height', 'lt', '500')]}, {'OR': [{'OR': [_relational('name', 'ew', 'a')]}]}]},
+    # string operators, answered by prefix, suffix and trigram indexes
+    {'OR': [_relational('name', 'sw', 'ab'), _relational('name', 'ew', 'yz'), _relational('name', 'ct', 'mno'), _relational('name', 'ct', 'q')]},
+    {'AND': [_relational('name', 'nct', 'a'), _relational('name', 'neq', 'abcde')]},
+]
+
+def random_queries(count, fan_out=4):
+    queries = []
+    for index in range(count):
+        query = generate_random_query.generate_logical_query(random.choice(['AND', 'OR']), 1, fan_out, random.randint(0, 2))
+        # a third of them have AND and OR in the same dict
+        if index % 3 == 0:
+            query.update(generate_random_query.generate_logical_query('OR', 1, 3, 0))
+        queries.append(query)
+    return queries
+
+# estimates assume the conditions are independent and use fixed selectivities for string operators (see
+# column_statistics), so only relational queries without string operators are held to max_leaf_error
+# (fraction of the table rows), every query must be inside the table and half of them inside max_median_error
+max_leaf_error = 0.02
+max_median_error = 0.02
+_string_operators = ('sw', 'ew', 'ct', 'nct')
+
+def _iter_relational_queries(query):
+    if "AND" not in query and "OR" not in query:
+        yield query
+        return
+    for dict in query.get("AND", []) + query.get("OR", []):
+        yield from _iter_relational_queries(dict)
+
+# each engine is a function (query -> row ids), queries are copied by the caller
+def prepare_engines(table):
+    column_types = QueryFilter(None, None)._table_column_types
+    columns = list(column_types)
+
+    typed_table = TypedTable(columns, ([row.get(column) for column in columns] for row in table))
+    typed_table.statistics = QueryFilter(None, typed_table).collect_statistics()
+
+    builder = QueryFilter(None, typed_table)
+    for column in ('age', 'height', 'birth_day'):
+        builder.build_index(column, 'sorted')
+    builder.build_index('age', 'hash')
+    builder.build_index('posted', 'bitmap')
+    for kind in ('prefix', 'suffix', 'trigram'):
+        builder.build_index('name', kind)
+    indexes = builder.get_indexes()
+
+    engines = {
+        'compiled':     lambda query: QueryFilter(query, table).run_query_row_ids(),
+        'adaptive':     lambda query: QueryFilter(query, table, adaptive=True).run_query_row_ids(),
+        'typed':        lambda query: QueryFilter(query, typed_table).run_query_row_ids(),
+        'indexed':      lambda query: QueryFilter(query, typed_table, indexes).run_query_row_ids(),
+        'iter_query':   lambda query: [row['__row_id'] for row in QueryFilter(query, typed_table).iter_query(
+                                           dict(row, __row_id=row_id) for row_id, row in enumerate(table))],
+        'count':        lambda query: list(range(QueryFilter(query, typed_table, indexes).count())),
+    }
+
+    if np is not None:
+        columnar_table = ColumnarTable.from_rows(table, column_types)
+        engines['columnar'] = lambda query: ColumnarQueryFilter(query, columnar_table).run_query_row_ids().tolist()
+
+    return engines, typed_table
+
+def run_engines(size=3000, random_count=200, seed=42):
+    random.seed(seed)
+    table = create_table(size)
+    queries = edge_case_queries + random_queries(random_count)
+    expected_results = [reference_row_ids(query, table) for query in queries]
+
+    # every query is normalized and compiled by each engine
+    QueryFilter.configure_caches(plan_cache_size=0, result_cache_size=0)
+    engines, typed_table = prepare_engines(table)
+    failures = []
+
+    try:
+        for name, run in engines.items():
+            for query, expected in zip(queries, expected_results):
+                row_ids = run(copy.deepcopy(query))
+
+                # count only returns the number of rows
+                if name == 'count':
+                    expected = list(range(len(expected)))
+
+                if row_ids != expected:
+                    failures.append((name, query))
+
+        # one pass over the table for all queries
+        batch_results = BatchQueryFilter(copy.deepcopy(queries), table).run_queries_row_ids()
+        failures.extend(('batch', query) for query, row_ids, expected in zip(queries, batch_results, expected_results) if list(row_ids) != expected)
+
+        # a few queries in a pool kept across queries, with small chunks
+        if 'fork' in multiprocessing.get_all_start_methods():
+            with ParallelScanPool(typed_table, max_workers=2, mp_context=multiprocessing.get_context('fork')) as pool:
+                for query, expected in list(zip(queries, expected_results))[:30]:
+                    if ParallelQueryFilter(copy.deepcopy(query), typed_table, chunk_size=size // 7, pool=pool).run_query_row_ids() != expected:
+                        failures.append(('parallel', query))
+    finally:
+        QueryFilter.configure_caches()
+
+    return failures, len(queries), list(engines) + ['batch', 'parallel']
+
+# returns the (query, estimate, count) that are off by more than the tolerances above and the median error
+def check_estimates(size=3000, random_count=200, seed=42):
+    random.seed(seed)
+    table = create_table(size)
+    queries = edge_case_queries + random_queries(random_count)
+    _, typed_table = prepare_engines(table)
+
+    leaves = [
+        {'AND': [dict]} for query in queries for dict in _iter_relational_queries(query)
+        if dict['field'] != 'name' and dict['operator'] not in _string_operators
+    ]
+
+    failures = []
+    errors = []
+    for query, is_leaf in [(query, False) for query in queries] + [(leaf, True) for leaf in leaves]:
+        estimate = QueryFilter(copy.deepcopy(query), typed_table).estimate_count()
+        count = len(reference_row_ids(query, table))
+        error = abs(estimate - count) / size
+
+        if not 0 <= estimate <= size or (is_leaf and error > max_leaf_error):
+            failures.append((query, estimate, count))
+        if not is_leaf:
+            errors.append(error)
+
+    errors.sort()
+    return failures, errors[len(errors) // 2]
+
+def test_engines_match_evaluate():
+    failures, _, _ = run_engines()
+    assert not failures, failures[:5]
+
+def test_estimates():
+    failures, median_error = check_estimates()
+    assert not failures, failures[:5]
+    assert median_error <= max_median_error
+
+if __name__ == '__main__':
+    failures, query_count, engine_names = run_engines()
+
+    print('Queries:', query_count)
+    print('Engines:', ', '.join(engine_names))
+    for name, query in failures[:10]:
+        print('Mismatch in {0}: {1}'.format(name, query))
+    print('Equal:', not failures)
+
+    estimate_failures, median_error = check_estimates()
+    for query, estimate, count in estimate_failures[:10]:
+        print('Estimate {0} of {1} rows: {2}'.format(estimate, count, query))
+    print('Median estimate error: {0:.2%}'.format(median_error))
+
+    sys.exit(1 if failures or estimate_failures or median_error > max_median_error else 0)
@@ -0,0 +1,105 @@
+import datetime
+from query_filter import QueryFilter
+
+# checks that the hand written validation (see fast_validation) accepts and rejects the same queries
+# and rows as the Cerberus schemas, with the same errors
+#
+#   python test_fast_validation.py
+#
+# also collected by pytest
+
+class CerberusQueryFilter(QueryFilter):
+    _fast_validation = False
+
+logical_queries = [
+    {'AND': []},
+    {'OR': [{'field': 'age'}]},
+    {'AND': [{}], 'OR': [{}, {}]},
+    {'AND': {'field': 'age'}},
+    {'AND': 'age'},
+    {'OR': [1, {}]},
+    {'AND': [None]},
+    {'AND': [], 'unknown': 1},
+    {'unknown': 1},
+    {},
+]
+
+relational_queries = [
+    {'field': 'age', 'operator': 'gt', 'value': ['10']},
+    {'field': 'age', 'operator': 'btw', 'value': ['10', '20']},
+    {'field': 'age', 'operator': 'gt', 'value': [10]},
+    {'field': 'height', 'operator': 'lt', 'value': [1.5]},
+    {'field': 'birth_day', 'operator': 'eq', 'value': [datetime.date(2000, 1, 1)]},
+    {'field': 'posted', 'operator': 'eq', 'value': [True]},
+    {'field': 'age', 'operator': 'gt', 'value': []},
+    {'field': 'age', 'operator': 'gt', 'value': ['1', '2', '3']},
+    {'field': 'age', 'operator': 'gt', 'value': '10'},
+    {'field': 'age', 'operator': 'gt', 'value': [None]},
+    {'field': 'age', 'operator': 'gt', 'value': [[1]]},
+    {'field': 'unknown', 'operator': 'gt', 'value': ['10']},
+    {'field': 'age', 'operator': 'in', 'value': ['10']},
+    {'field': 'age', 'operator': 'gt'},
+    {'field': 1, 'operator': 2, 'value': ['10']},
+    {'operator': 'gt', 'value': ['10']},
+    {'field': 'age', 'operator': 'gt', 'value': ['10'], 'unknown': 1},
+    {},
+]
+
+valid_row = {'name': 'ana', 'age': 30, 'height': 1.7, 'birth_day': datetime.date(1990, 1, 1), 'posted': False}
+
+rows = [
+    valid_row,
+    dict(valid_row, age='30'),
+    dict(valid_row, age=None),
+    dict(valid_row, birth_day=None),
+    dict(valid_row, height=2),
+    dict(valid_row, posted=1),
+    dict(valid_row, name=1, age=1.5),
+    dict(valid_row, unknown=1),
+    {key: value for key, value in valid_row.items() if key != 'age'},
+    {},
+]
+
+def _errors(validate):
+    try:
+        return validate()
+    except ValueError as e:
+        return e.args[0]
+
+def test_logical_queries():
+    for query in logical_queries:
+        results = [
+            (_errors(lambda: query_filter._logical_layer_query_validation(query)),
+             query_filter._logical_layer_query_validation(query, raise_exception=False))
+            for query_filter in (QueryFilter(None, None), CerberusQueryFilter(None, None))
+        ]
+        assert results[0] == results[1], (query, results)
+
+def test_relational_queries():
+    for query in relational_queries:
+        for type_validation in (True, False):
+            results = [
+                (_errors(lambda: query_filter._relational_layer_query_validation(query, type_validation)),
+                 query_filter._relational_layer_query_validation(query, type_validation, raise_exception=False))
+                for query_filter in (QueryFilter(None, None), CerberusQueryFilter(None, None))
+            ]
+            assert results[0] == results[1], (query, type_validation, results)
+
+def test_rows():
+    for row in rows:
+        results = [
+            _errors(lambda: query_filter._table_keys_validation(row))
+            for query_filter in (QueryFilter(None, None), CerberusQueryFilter(None, None))
+        ]
+        assert results[0] == results[1], (row, results)
+
+    results = [_errors(lambda: query_filter.validate_table(rows)) for query_filter in (QueryFilter(None, None), CerberusQueryFilter(None, None))]
+    assert results[0] == results[1]
+    # null dates, ints as floats and unknown columns are valid
+    assert sorted(results[0]) == [1, 2, 5, 6, 8, 9]
+
+if __name__ == '__main__':
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print(name, 'ok')
@@ -0,0 +1,82 @@
+import random
+import random_table
+from live_views import MutableTable, ViewDelta
+from benchmark import reference_row_ids
+
+# checks of the live views kept by MutableTable (see live_views)
+#
+#   python test_live_views.py
+#
+# also collected by pytest
+
+query = {'AND': [{'field': 'age', 'operator': 'lt', 'value': ['500']}]}
+
+def _create_table():
+    random.seed(42)
+    return MutableTable(random_table.create_random_table(200))
+
+def _check_view(view, table):
+    # row ids of the table are its positions while nothing is deleted, so the view is compared with
+    # a scan of the current rows
+    row_ids = [row_id for row_id, _ in table.items()]
+    assert view.get_row_ids() == [row_ids[position] for position in reference_row_ids(query, list(table))]
+    assert view.get_rows() == [table.get_row(row_id) for row_id in view.get_row_ids()]
+
+def test_mutations_update_the_view():
+    table = _create_table()
+    view = table.register_view(query)
+    deltas = []
+    view.subscribe(lambda view, delta: deltas.append(delta))
+    _check_view(view, table)
+
+    inserted = table.insert_many([dict(table.get_row(0), age=10), dict(table.get_row(0), age=900)])
+    assert deltas[-1] == ViewDelta([inserted[0]], [], [])
+
+    table.update(inserted[0], {'age': 20})
+    assert deltas[-1] == ViewDelta([], [], [inserted[0]])
+    table.update_many({inserted[0]: {'age': 800}, inserted[1]: {'age': 1}})
+    assert deltas[-1] == ViewDelta([inserted[1]], [inserted[0]], [])
+
+    table.delete(inserted[1])
+    assert deltas[-1] == ViewDelta([], [inserted[1]], [])
+    _check_view(view, table)
+
+    # mutations that don't change the view aren't notified
+    count = len(deltas)
+    table.update(inserted[0], {'age': 700})
+    assert len(deltas) == count
+
+def test_repeated_row_ids_are_deleted_once():
+    table = _create_table()
+    view = table.register_view(query)
+    row_id = view.get_row_ids()[0]
+    deltas = []
+    view.subscribe(lambda view, delta: deltas.append(delta))
+
+    table.delete_many([row_id, row_id])
+
+    assert row_id not in view
+    assert deltas == [ViewDelta([], [row_id], [])]
+    _check_view(view, table)
+
+def test_unknown_row_id_leaves_the_table_unchanged():
+    table = _create_table()
+    view = table.register_view(query)
+    length, version = len(table), table.version
+
+    for mutate in (lambda: table.delete_many([0, 10 ** 6]), lambda: table.update_many({0: {'age': 1}, 10 ** 6: {}})):
+        try:
+            mutate()
+        except KeyError:
+            pass
+        else:
+            raise AssertionError("an unknown row id was accepted")
+
+    assert (len(table), table.version) == (length, version)
+    _check_view(view, table)
+
+if __name__ == '__main__':
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print(name, 'ok')
@@ -0,0 +1,103 @@
+import copy
+import random
+import random_table
+from query_filter import QueryFilter
+from columnar_query_filter import ColumnarTable, ColumnarQueryFilter, np
+from benchmark import reference_row_ids
+
+# checks of run_query/run_query_row_ids with order_by, limit, offset and select
+#
+#   python test_order_by.py
+#
+# also collected by pytest
+
+queries = [
+    {'AND': [{'field': 'height', 'operator': 'lt', 'value': ['600']}]},
+    {'OR':  [{'field': 'name', 'operator': 'ct', 'value': ['a']}, {'field': 'age', 'operator': 'lt', 'value': ['100']}]},
+    {},
+]
+
+pages = [(None, 0), (10, 0), (10, 25), (None, 40), (5000, 3)]
+
+def _create_rows():
+    random.seed(42)
+    rows = random_table.create_random_table(1000)
+    # ages with many ties and null dates
+    for row in rows:
+        row['age'] = random.randint(1, 50)
+        if random.random() < 0.2:
+            row['birth_day'] = None
+    return rows
+
+# None values go last and rows with the same value keep the table order
+def _order_by_hand(rows, row_ids, order_by, descending):
+    values = [row_id for row_id in row_ids if rows[row_id][order_by] is not None]
+    nulls = [row_id for row_id in row_ids if rows[row_id][order_by] is None]
+    return sorted(values, key=lambda row_id: rows[row_id][order_by], reverse=descending) + nulls
+
+def _get_filters(query, rows):
+    typed_table = QueryFilter(None, None).ingest(rows, collect_statistics=False)
+    builder = QueryFilter(None, typed_table)
+    for column in ('age', 'birth_day'):
+        builder.build_index(column, 'sorted')
+
+    filters = {
+        'rows':    lambda: QueryFilter(copy.deepcopy(query), rows),
+        'indexed': lambda: QueryFilter(copy.deepcopy(query), typed_table, builder.get_indexes()),
+    }
+    if np is not None:
+        columnar_table = ColumnarTable.from_rows(rows, QueryFilter(None, None)._table_column_types)
+        filters['columnar'] = lambda: ColumnarQueryFilter(copy.deepcopy(query), columnar_table)
+    return filters
+
+def _as_list(row_ids):
+    return row_ids.tolist() if hasattr(row_ids, 'tolist') else list(row_ids)
+
+def test_order_by_and_pages():
+    rows = _create_rows()
+
+    for query in queries:
+        row_ids = reference_row_ids(query, rows) if query else list(range(len(rows)))
+        for name, create_filter in _get_filters(query, rows).items():
+            for order_by in ('age', 'birth_day', 'name'):
+                for descending in (False, True):
+                    ordered = _order_by_hand(rows, row_ids, order_by, descending)
+                    for limit, offset in pages:
+                        stop = None if limit is None else offset + limit
+                        result = _as_list(create_filter().run_query_row_ids(limit, offset, order_by, descending))
+                        assert result == ordered[offset:stop], (name, query, order_by, descending, limit, offset)
+
+def test_pages_without_order():
+    rows = _create_rows()
+
+    for query in queries:
+        row_ids = reference_row_ids(query, rows) if query else list(range(len(rows)))
+        for name, create_filter in _get_filters(query, rows).items():
+            for limit, offset in pages:
+                stop = None if limit is None else offset + limit
+                assert _as_list(create_filter().run_query_row_ids(limit, offset)) == row_ids[offset:stop], (name, query, limit, offset)
+
+def test_select():
+    rows = _create_rows()
+    query = queries[0]
+    ordered = _order_by_hand(rows, reference_row_ids(query, rows), 'birth_day', True)[:20]
+    expected = [{'name': rows[row_id]['name'], 'birth_day': rows[row_id]['birth_day']} for row_id in ordered]
+
+    for name, create_filter in _get_filters(query, rows).items():
+        result = create_filter().run_query(limit=20, order_by='birth_day', descending=True, select=['name', 'birth_day'])
+        assert result == expected, name
+
+    for name, create_filter in _get_filters(query, rows).items():
+        for invalid in ({'select': ['unknown']}, {'order_by': 'unknown'}):
+            try:
+                create_filter().run_query(**invalid)
+            except ValueError:
+                pass
+            else:
+                raise AssertionError("{0} accepted {1}".format(name, invalid))
+
+if __name__ == '__main__':
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print(name, 'ok')
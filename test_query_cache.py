@@ -0,0 +1,58 @@
+import copy
+import random
+import random_table
+from query_filter import QueryFilter
+from benchmark import reference_row_ids
+
+# plan cache checks of QueryFilter (see query_cache)
+#
+#   python test_query_cache.py
+#
+# also collected by pytest
+
+def _create_table():
+    random.seed(42)
+    return random_table.create_random_table(500)
+
+def _with_plan_cache(test):
+    def run():
+        QueryFilter.configure_caches(plan_cache_size=16, result_cache_size=0)
+        try:
+            test()
+        finally:
+            QueryFilter.configure_caches()
+    run.__name__ = test.__name__
+    return run
+
+query = {'AND': [{'field': 'age', 'operator': 'gt', 'value': ['300']}, {'field': 'name', 'operator': 'sw', 'value': ['a']}]}
+
+@_with_plan_cache
+def test_query_of_the_caller_is_not_normalized():
+    table = _create_table()
+    caller_query = copy.deepcopy(query)
+
+    # a miss and then a hit, the caller's query keeps its string values in both
+    for _ in range(2):
+        QueryFilter(caller_query, table).run_query_row_ids()
+        assert caller_query == query
+
+    assert QueryFilter.get_cache_stats()['plan_cache']['hits'] == 1
+
+@_with_plan_cache
+def test_changing_a_query_after_running_it_keeps_the_cached_plan():
+    table = _create_table()
+    expected = reference_row_ids(query, table)
+
+    caller_query = copy.deepcopy(query)
+    assert QueryFilter(caller_query, table).run_query_row_ids() == expected
+
+    # the cached plan must not share the value lists of the caller's query
+    caller_query['AND'][0]['value'][0] = '900'
+    assert QueryFilter(copy.deepcopy(query), table).run_query_row_ids() == expected
+    assert QueryFilter(caller_query, table).run_query_row_ids() == reference_row_ids(caller_query, table)
+
+if __name__ == '__main__':
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print(name, 'ok')
@@ -0,0 +1,100 @@
+import copy
+import random
+import random_table
+from query_filter import QueryFilter
+from columnar_query_filter import ColumnarTable, ColumnarQueryFilter, np
+from query_explain import explain, render_explain
+from benchmark import reference_row_ids
+
+# checks of EXPLAIN / EXPLAIN ANALYZE (see query_explain)
+#
+#   python test_query_explain.py
+#
+# also collected by pytest
+
+queries = [
+    {'AND': [{'field': 'age', 'operator': 'lt', 'value': ['300']}, {'field': 'name', 'operator': 'ct', 'value': ['a']}]},
+    {'OR':  [{'field': 'height', 'operator': 'gt', 'value': ['900']}, {'field': 'name', 'operator': 'sw', 'value': ['b']}]},
+    {'AND': [{'field': 'age', 'operator': 'gt', 'value': ['100']}], 'OR': [{'field': 'age', 'operator': 'lt', 'value': ['10']}]},
+    {'AND': [{'AND': []}, {'OR': [{'field': 'age', 'operator': 'eq', 'value': ['7']}]}]},
+]
+
+def _create_rows():
+    random.seed(42)
+    return random_table.create_random_table(1000)
+
+def _get_filters(query, rows):
+    typed_table = QueryFilter(None, None).ingest(rows)
+    builder = QueryFilter(None, typed_table)
+    builder.build_index('age', 'sorted')
+
+    filters = {
+        'compiled': QueryFilter(copy.deepcopy(query), rows),
+        'adaptive': QueryFilter(copy.deepcopy(query), rows, adaptive=True),
+        'indexed':  QueryFilter(copy.deepcopy(query), typed_table, builder.get_indexes()),
+    }
+    if np is not None:
+        columnar_table = ColumnarTable.from_rows(rows, QueryFilter(None, None)._table_column_types)
+        filters['columnar'] = ColumnarQueryFilter(copy.deepcopy(query), columnar_table)
+    return filters
+
+def _iter_nodes(node):
+    yield node
+    for child in node.get('children', []):
+        yield from _iter_nodes(child)
+
+def test_analyze_counts_the_matching_rows():
+    rows = _create_rows()
+
+    for query in queries:
+        expected = len(reference_row_ids(query, rows))
+        for name, query_filter in _get_filters(query, rows).items():
+            plan = explain(query_filter, analyze=True)
+            assert plan['rows_matched'] == expected, (name, query)
+
+            for node in _iter_nodes(plan['tree']):
+                assert 0 <= node['rows_passed'] <= node['rows_evaluated'], (name, node)
+
+            # the root evaluates every candidate row, all rows without an index plan
+            if not plan.get('exact_index_plan'):
+                assert plan['tree']['rows_evaluated'] == plan.get('candidate_rows', len(rows)), (name, query)
+
+def test_access_of_relational_queries():
+    rows = _create_rows()
+    filters = _get_filters(queries[0], rows)
+
+    accesses = {name: [node['access'] for node in _iter_nodes(explain(query_filter)['tree']) if 'access' in node]
+                for name, query_filter in filters.items()}
+
+    assert accesses['compiled'] == ['scan', 'scan']
+    assert sorted(accesses['indexed']) == ['index', 'scan']
+    if np is not None:
+        assert accesses['columnar'] == ['vectorized', 'vectorized']
+
+    # estimates come from the statistics of the ingested table
+    plan = explain(filters['indexed'])
+    assert all('estimated_rows' in node for node in _iter_nodes(plan['tree']))
+    assert 'estimated_rows' not in explain(filters['compiled'])['tree']
+
+def test_metrics_hook_and_render():
+    rows = _create_rows()
+    nodes = []
+    plan = explain(QueryFilter(copy.deepcopy(queries[2]), rows), analyze=True, metrics_hook=nodes.append)
+
+    # children first, the root is the last one
+    assert len(nodes) == len(list(_iter_nodes(plan['tree'])))
+    assert nodes[-1]['path'] == '0' and 'children' not in nodes[-1]
+
+    text = render_explain(plan, queries[2])
+    assert text.splitlines()[0].startswith('Condition: ')
+    assert 'matched: {0}'.format(plan['rows_matched']) in text
+    assert len(text.splitlines()) == 2 + len(nodes)
+
+def test_empty_query():
+    assert explain(QueryFilter({}, _create_rows()), analyze=True)['tree'] is None
+
+if __name__ == '__main__':
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print(name, 'ok')
@@ -0,0 +1,165 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import tempfile
+import threading
+import random_table
+import query_client
+from query_client import QueryClient
+from query_filter import QueryFilter
+from query_server import QueryServer, load_table, _json_default
+from columnar_query_filter import ColumnarTable, np
+from column_store import write_column_store
+from benchmark import reference_row_ids
+
+# checks of query_server and its client (see query_server and query_client)
+#
+#   python test_query_server.py
+#
+# also collected by pytest
+
+queries = [
+    {'AND': [{'field': 'age', 'operator': 'lt', 'value': ['300']}, {'field': 'name', 'operator': 'ct', 'value': ['a']}]},
+    {'OR':  [{'field': 'height', 'operator': 'gt', 'value': ['990']}, {'field': 'age', 'operator': 'eq', 'value': ['7']}]},
+    {'AND': [{'field': 'age', 'operator': 'gt', 'value': ['5000']}]},
+]
+
+# rows with every table column, the server returns all of them
+def _create_rows():
+    random.seed(42)
+    rows = random_table.create_random_table(1000)
+    for row in rows:
+        row['posted'] = random.random() < 0.5
+    return rows
+
+# the server runs its own event loop in a thread, the tests use the blocking client
+class _ServerThread:
+    def __init__(self, server, path):
+        self._server = server
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever)
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(server.start_unix(path), self._loop).result()
+
+    # closed connections are noticed by the server asynchronously, they're waited for first
+    async def _close(self):
+        while self._server.get_stats()['connections']:
+            await asyncio.sleep(0.01)
+        await self._server.close()
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self._close(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+def _run_with_server(test):
+    def run():
+        if 'fork' not in multiprocessing.get_all_start_methods():
+            return
+        rows = _create_rows()
+
+        with tempfile.TemporaryDirectory() as path:
+            table = QueryFilter(None, None).ingest(rows)
+            builder = QueryFilter(None, table)
+            builder.build_index('age', 'sorted')
+
+            server = QueryServer(workers=2, mp_context=multiprocessing.get_context('fork'))
+            server.add_table('people', table, QueryFilter, builder.get_indexes())
+            if np is not None:
+                write_column_store(os.path.join(path, 'store'), ColumnarTable.from_rows(rows, QueryFilter(None, None)._table_column_types))
+                server.add_table('store', load_table(os.path.join(path, 'store')))
+
+            socket_path = os.path.join(path, 'query.sock')
+            server_thread = _ServerThread(server, socket_path)
+            try:
+                test(rows, socket_path)
+            finally:
+                server_thread.stop()
+    run.__name__ = test.__name__
+    return run
+
+def _table_names():
+    return ['people'] + (['store'] if np is not None else [])
+
+@_run_with_server
+def test_modes(rows, socket_path):
+    with QueryClient(unix_path=socket_path) as client:
+        for table_name in _table_names():
+            for query in queries:
+                row_ids = reference_row_ids(query, rows)
+                context = (table_name, query)
+
+                assert client.request(table_name, query, mode='row_ids') == row_ids, context
+                assert client.request(table_name, query, mode='count') == len(row_ids), context
+                assert client.request(table_name, query, mode='exists') == bool(row_ids), context
+                assert 0 <= client.request(table_name, query, mode='estimate') <= len(rows), context
+
+                expected_rows = json.loads(json.dumps([rows[row_id] for row_id in row_ids[:5]], default=_json_default))
+                assert client.request(table_name, query, limit=5) == expected_rows, context
+
+                ordered = sorted(row_ids, key=lambda row_id: rows[row_id]['height'], reverse=True)[2:7]
+                assert client.request(table_name, query, limit=5, offset=2, order_by='height', descending=True, select=['name']) == \
+                       [{'name': rows[row_id]['name']} for row_id in ordered], context
+
+@_run_with_server
+def test_pipelined_responses_keep_the_request_order(rows, socket_path):
+    requests = []
+    for index in range(40):
+        query = queries[index % len(queries)]
+        if index % 7 == 3:
+            requests.append({'id': index, 'table': 'unknown', 'query': query, 'mode': 'count'})
+        elif index % 7 == 5:
+            requests.append({'id': index, 'table': 'people', 'query': {'AND': [{'field': 'unknown'}]}, 'mode': 'count'})
+        else:
+            requests.append({'id': index, 'table': 'people', 'query': query, 'mode': 'count'})
+
+    with QueryClient(unix_path=socket_path) as client:
+        responses = client.pipeline(requests, window=8)
+
+        assert [response['id'] for response in responses] == list(range(40))
+        for request, response in zip(requests, responses):
+            if request['id'] % 7 in (3, 5):
+                assert 'error' in response and 'result' not in response, response
+            else:
+                assert response['result'] == len(reference_row_ids(request['query'], rows)), response
+
+        # the connection is still usable after errors, and invalid requests are errors too
+        client.send({'mode': 'unknown'})
+        assert 'error' in client.receive()
+        assert client.request('people', queries[0], mode='count') == len(reference_row_ids(queries[0], rows))
+
+        stats = client.get_stats()
+        assert stats['tables']['people'] == len(rows)
+        assert stats['modes']['count']['requests'] >= 35 and stats['modes']['count']['errors'] >= 5
+
+@_run_with_server
+def test_load_generator(rows, socket_path):
+    args = argparse.Namespace(
+        unix=socket_path, host=None, port=None, table='people', mode='count', limit=10,
+        connections=3, requests=30, pipeline=4, depth=1, fan_out=3, seed=1,
+    )
+    result = query_client.run_load(args)
+
+    assert result['requests'] == 90 and result['errors'] == 0
+    assert result['server']['modes']['count']['requests'] >= 90
+
+def test_load_generator_draws_from_the_connection_generator():
+    args = argparse.Namespace(table='people', mode='count', requests=20, fan_out=3, depth=1, limit=10)
+
+    state = random.getstate()
+    requests = list(query_client._generate_requests(args, 1))
+
+    # the global random module isn't used nor reseeded
+    assert random.getstate() == state
+    assert requests == list(query_client._generate_requests(args, 1))
+    assert requests != list(query_client._generate_requests(args, 2))
+
+if __name__ == '__main__':
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print(name, 'ok')
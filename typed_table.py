@@ -0,0 +1,56 @@
+import collections
+
+class TypedTable:
+    # compact table with rows stored as named tuples, values are already converted to the
+    # native types of the table, so nothing is converted while filtering
+    # a tuple row has no per-row hash table, it costs a fraction of the memory of a dict row,
+    # and QueryFilter reads values by position (see get_position)
+    # it is built with QueryFilter.ingest
+    def __init__(self, columns, rows=()):
+        self._columns = tuple(columns)
+        self._positions = {column: position for position, column in enumerate(self._columns)}
+        self._row_type = collections.namedtuple('TypedRow', self._columns, rename=True)
+        self._rows = [self._row_type._make(row) for row in rows]
+        # column statistics, see QueryFilter.collect_statistics
+        self.statistics = None
+
+    def get_columns(self):
+        return self._columns
+
+    def get_position(self, column):
+        if column not in self._positions:
+            raise ValueError("Column '{0}' is not in table".format(column))
+        return self._positions[column]
+
+    def get_column_values(self, column):
+        position = self.get_position(column)
+        return [row[position] for row in self._rows]
+
+    def append(self, values):
+        self._rows.append(self._row_type._make(values))
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __iter__(self):
+        return iter(self._rows)
+
+    # a slice returns a list of rows
+    def __getitem__(self, index):
+        return self._rows[index]
+
+    def as_dict(self, row):
+        return dict(zip(self._columns, row))
+
+    def to_rows(self, row_ids=None):
+        rows = self._rows if row_ids is None else (self._rows[row_id] for row_id in row_ids)
+        return [self.as_dict(row) for row in rows]
+
+    # the named tuple class is created at runtime, so rows are pickled as plain tuples
+    def __getstate__(self):
+        return self._columns, [tuple(row) for row in self._rows], self.statistics
+
+    def __setstate__(self, state):
+        columns, rows, statistics = state
+        self.__init__(columns, rows)
+        self.statistics = statistics
@@ -0,0 +1,61 @@
+class VersionedTable(list):
+    # list of rows with a version counter that is bumped on every mutation made through the list,
+    # it lets caches know when results computed over the table are stale
+    # rows changed in place (table[0]['age'] = 10) aren't detected, call mark_modified after it
+    def __init__(self, rows=()):
+        super().__init__(rows)
+        self.version = 0
+
+    def mark_modified(self):
+        self.version += 1
+
+    def append(self, row):
+        super().append(row)
+        self.mark_modified()
+
+    def extend(self, rows):
+        super().extend(rows)
+        self.mark_modified()
+
+    def insert(self, index, row):
+        super().insert(index, row)
+        self.mark_modified()
+
+    def pop(self, index=-1):
+        row = super().pop(index)
+        self.mark_modified()
+        return row
+
+    def remove(self, row):
+        super().remove(row)
+        self.mark_modified()
+
+    def clear(self):
+        super().clear()
+        self.mark_modified()
+
+    def sort(self, *args, **kwargs):
+        super().sort(*args, **kwargs)
+        self.mark_modified()
+
+    def reverse(self):
+        super().reverse()
+        self.mark_modified()
+
+    def __setitem__(self, index, row):
+        super().__setitem__(index, row)
+        self.mark_modified()
+
+    def __delitem__(self, index):
+        super().__delitem__(index)
+        self.mark_modified()
+
+    def __iadd__(self, rows):
+        result = super().__iadd__(rows)
+        self.mark_modified()
+        return result
+
+    def __imul__(self, count):
+        result = super().__imul__(count)
+        self.mark_modified()
+        return result